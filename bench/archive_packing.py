@@ -0,0 +1,87 @@
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from archive_packer import CODECS, ArchivePacker
+
+WORDS = (b"the torrent piece archive upload dataset frame audio video subtitle chapter "
+         b"index header stream packet timestamp metadata track sample").split()
+
+
+def video_piece(size):
+    """已经压缩过的视频：随机字节，每 188 字节一个 TS 包头"""
+    data = bytearray(os.urandom(size))
+    data[::188] = b'\x47' * len(data[::188])
+    return bytes(data)
+
+
+def text_piece(size, rng):
+    """日志/字幕之类的文本"""
+    out = bytearray()
+    while len(out) < size:
+        out += b' '.join(rng.choice(WORDS) for _ in range(12)) + b'\n'
+    return bytes(out[:size])
+
+
+def make_pieces(kind, count, piece_size, rng):
+    pieces = {}
+    for i in range(count):
+        if kind == "video" or (kind == "mixed" and i % 4):
+            pieces[f"piece_{i}.dat"] = video_piece(piece_size)
+        else:
+            pieces[f"piece_{i}.dat"] = text_piece(piece_size, rng)
+    return pieces
+
+
+def zip_deflated(pieces):
+    """原来的做法：所有 piece 都用默认级别的 ZIP_DEFLATED"""
+    start = time.perf_counter()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in pieces.items():
+            zf.writestr(name, data)
+    seconds = time.perf_counter() - start
+    size = sum(len(data) for data in pieces.values())
+    return {"ratio": round(archive.getbuffer().nbytes / size, 3), "mb_per_sec": round(size / seconds / 2 ** 20, 1)}
+
+
+def packed(pieces, codec, level):
+    packer = ArchivePacker(codec, level)
+    packer.pack(pieces, io.BytesIO())
+    stats = packer.stats()
+    return {key: stats[key] for key in ("ratio", "mb_per_sec", "stored", "compressed")}
+
+
+def run(args):
+    rng = random.Random(0)
+    results = {}
+    for kind in ("video", "text", "mixed"):
+        pieces = make_pieces(kind, args.pieces, args.piece_kb * 1024, rng)
+        row = {"zip_deflated": zip_deflated(pieces)}
+        for codec in CODECS:
+            row[f"packer_{codec}"] = packed(pieces, codec, None)
+        if args.level is not None:
+            row[f"packer_{args.codec}_{args.level}"] = packed(pieces, args.codec, args.level)
+        results[kind] = row
+    print(json.dumps({
+        "pieces": args.pieces,
+        "piece_kb": args.piece_kb,
+        "codecs": list(CODECS),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ZIP_DEFLATED with content-aware packing on video-like and text-like pieces.")
+    parser.add_argument("--pieces", type=int, default=32)
+    parser.add_argument("--piece-kb", type=int, default=4096)
+    parser.add_argument("--codec", default="deflate", choices=list(CODECS), help="codec for the --level run")
+    parser.add_argument("--level", type=int, help="also run the packer with this level")
+    args = parser.parse_args()
+    run(args)
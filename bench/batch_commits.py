@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from huggingface_hub import HfApi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from uploader import HubBatchUploader
+from fake_hub import FakeHub
+
+
+async def run(pieces, piece_size, batch_size, flush_interval):
+    hub = await FakeHub().start()
+    api = HfApi(endpoint=hub.endpoint, token="hf_bench")
+    batcher = HubBatchUploader(api, "bench/pieces", "dataset", batch_size=batch_size, flush_interval=flush_interval)
+    batcher.start()
+
+    data = os.urandom(piece_size)
+    start = time.perf_counter()
+    for i in range(pieces):
+        await batcher.add(f"pieces/piece_{i}.dat", data)
+    await batcher.stop()
+    elapsed = time.perf_counter() - start
+    await hub.stop()
+
+    stats = batcher.stats()
+    assert stats["files_committed"] == pieces, stats
+    assert len(hub.commits) == stats["commits"]
+    print(f"batch_size={batch_size}: {pieces} pieces in {len(hub.commits)} commits, "
+          f"{hub.requests} HTTP requests, {pieces / elapsed:.1f} pieces/s")
+    return len(hub.commits)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-piece commits with batched commits against a fake Hub.")
+    parser.add_argument("--pieces", type=int, default=500)
+    parser.add_argument("--piece-size", type=int, default=16 * 1024)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-interval", type=float, default=30)
+    args = parser.parse_args()
+
+    for batch_size in (1, args.batch_size):
+        asyncio.run(run(args.pieces, args.piece_size, batch_size, args.flush_interval))
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+
+# 替身服务器没有实现 Xet 接口
+os.environ["HF_HUB_DISABLE_XET"] = "1"
+os.environ["HF_HUB_DISABLE_PROGRESS_BARS"] = "1"
+from huggingface_hub import HfApi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunked_upload import ChunkedUploader, join_parts
+from fake_hub import FakeHub
+
+REPO_ID = "bench/large-files"
+
+
+def start_hub(**kwargs):
+    """在后台线程的事件循环中运行 FakeHub，HfApi 是同步调用"""
+    loop = asyncio.new_event_loop()
+    hub = FakeHub(**kwargs)
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(hub.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return hub
+
+
+def make_file(path, size):
+    with open(path, 'wb') as f:
+        for _ in range(size // (1024 * 1024)):
+            f.write(os.urandom(1024 * 1024))
+        f.write(os.urandom(size % (1024 * 1024)))
+
+
+def run(args):
+    shutil.rmtree(args.root, ignore_errors=True)
+    os.makedirs(args.root)
+    local_file = os.path.join(args.root, "large.bin")
+    make_file(local_file, args.size_mb * 1024 * 1024)
+    with open(local_file, 'rb') as f:
+        expected = hashlib.file_digest(f, 'sha256').hexdigest()
+
+    hub = start_hub(lfs_threshold=1024 * 1024, fail_rate=args.fail_rate)
+    api = HfApi(endpoint=hub.endpoint, token="hf_bench")
+    manifest_folder = os.path.join(args.root, "manifests")
+
+    def uploader():
+        return ChunkedUploader(api, REPO_ID, "dataset", part_size=args.part_mb * 1024 * 1024,
+                               workers=args.workers, parts_per_commit=args.parts_per_commit,
+                               retries=args.retries, backoff=0.05, manifest_folder=manifest_folder)
+
+    # 第一次：提交几次后服务器持续返回 503，重试用尽后中断
+    hub.fail_after_commits = args.interrupt_after
+    first = uploader()
+    start = time.perf_counter()
+    try:
+        first.upload_file(local_file, "videos/large.bin")
+    except Exception as e:
+        print(f"Interrupted as planned: {e.__class__.__name__}")
+    else:
+        raise RuntimeError("upload was expected to be interrupted")
+    first_seconds = time.perf_counter() - start
+    first_bytes = hub.bytes_received
+
+    # 第二次：换一个新的 runner（本地 manifest 丢失），从仓库里的 manifest 继续
+    hub.fail_after_commits = None
+    shutil.rmtree(manifest_folder)
+    second = uploader()
+    start = time.perf_counter()
+    num_parts = second.upload_file(local_file, "videos/large.bin")
+    second_seconds = time.perf_counter() - start
+    second_bytes = hub.bytes_received - first_bytes
+
+    parts_folder = os.path.join(args.root, "download", "large.bin.parts")
+    os.makedirs(parts_folder)
+    for (repo_id, path), data in hub.files.items():
+        if path.startswith("videos/large.bin.parts/"):
+            with open(os.path.join(parts_folder, path.rsplit('/', 1)[1]), 'wb') as f:
+                f.write(data)
+    output = os.path.join(args.root, "joined.bin")
+    join_parts(parts_folder, output)
+    with open(output, 'rb') as f:
+        joined = hashlib.file_digest(f, 'sha256').hexdigest()
+    assert joined == expected, "joined file differs from the original"
+
+    print(f"{args.size_mb} MB in {num_parts} parts of {args.part_mb} MB, "
+          f"{hub.failures} injected failures, {first.part_retries + second.part_retries} part retries")
+    print(f"first run:  {first.parts_uploaded} parts uploaded, {first.commits} commits, "
+          f"{first_bytes / 2 ** 20:.1f} MB sent, {first_seconds:.2f}s")
+    print(f"second run: {second.parts_skipped} parts skipped, {second.parts_uploaded} parts uploaded, "
+          f"{second_bytes / 2 ** 20:.1f} MB sent, {second_seconds:.2f}s")
+    print("joined file matches the original")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload a large file in parts to a failing fake Hub, interrupt it and resume.")
+    parser.add_argument("--root", default="/tmp/chunked-upload-bench")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--part-mb", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--parts-per-commit", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="probability that a write request fails with 500")
+    parser.add_argument("--interrupt-after", type=int, default=2, help="commits before the simulated outage")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+from aiohttp import web
+
+
+class FakeHub:
+    """本地的 Hugging Face Hub 替身，只实现本项目用到的接口，并统计请求和 commit 次数
+
+    lfs_threshold 不为空时，不小于这个大小的文件走 LFS（batch 接口 + PUT 上传）；
+    fail_rate 是写请求（preupload、commit、LFS 上传）随机返回 500 的概率，
+    fail_after_commits 设置后，成功提交这么多次以后 commit 请求都返回 503，模拟中断；
+    throttle_rate 是 commit 请求返回 429（带 Retry-After: retry_after 秒）的概率。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, lfs_threshold=None, fail_rate=0.0, seed=0,
+                 throttle_rate=0.0, retry_after=1, latency=0.0):
+        self.host = host
+        self.port = port
+        self.lfs_threshold = lfs_threshold
+        self.fail_rate = fail_rate
+        self.fail_after_commits = None
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.latency = latency  # 每个请求额外等待的秒数，模拟到 Hub 的往返时间
+        self.random = random.Random(seed)
+        self.files = {}  # {(repo_id, path): bytes}
+        self.lfs_objects = {}  # {sha256: bytes}
+        self.commits = []  # [(repo_id, 提交的文件数)]
+        self.heads = {}  # {repo_id: 最新 commit}，hf_hub_download 按它判断缓存是否过期
+        self.salt = os.urandom(8).hex()  # 每次运行的 commit id 都不同，不会命中上次运行留下的缓存
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0  # resolve 返回的文件数据
+        self.runner = None
+        self.loop = None  # start_in_thread() 时 hub 所在的事件循环
+
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_get('/api/whoami-v2', self.whoami)
+        app.router.add_post('/api/repos/create', self.create_repo)
+        app.router.add_post('/api/{repo_type}s/{namespace}/{name}/preupload/{revision}', self.preupload)
+        app.router.add_post('/api/{repo_type}s/{namespace}/{name}/commit/{revision}', self.commit)
+        app.router.add_post('/{repo_type}s/{namespace}/{name}.git/info/lfs/objects/batch', self.lfs_batch)
+        app.router.add_put('/lfs/{oid}', self.lfs_upload)
+        app.router.add_get('/api/{repo_type}s/{namespace}/{name}/tree/{revision}', self.tree)
+        app.router.add_get('/api/{repo_type}s/{namespace}/{name}/tree/{revision}/{path:.+}', self.tree)
+        app.router.add_route('*', '/{repo_type}s/{namespace}/{name}/resolve/{revision}/{path:.+}', self.resolve)
+        app.middlewares.append(self.count_requests)
+        self.app = app
+
+    @property
+    def endpoint(self):
+        return f"http://{self.host}:{self.port}"
+
+    @web.middleware
+    async def count_requests(self, request, handler):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.method in ('POST', 'PUT') and not request.path.startswith('/api/repos/'):
+            if (self.fail_after_commits is not None and len(self.commits) >= self.fail_after_commits
+                    and '/commit/' in request.path):
+                self.failures += 1
+                return web.Response(status=503, text="injected outage")
+            if self.throttle_rate and '/commit/' in request.path and self.random.random() < self.throttle_rate:
+                self.throttled += 1
+                return web.Response(status=429, text="rate limited", headers={"Retry-After": str(self.retry_after)})
+            if self.fail_rate and self.random.random() < self.fail_rate:
+                self.failures += 1
+                return web.Response(status=500, text="injected failure")
+            self.bytes_received += request.content_length or 0
+        return await handler(request)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def start_in_thread(self):
+        """在后台线程的事件循环中运行，调用方是同步代码或会被阻塞的另一个事件循环时使用"""
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def whoami(self, request):
+        """login() 用它校验 token"""
+        return web.json_response({"name": "bench", "auth": {"accessToken": {"displayName": "bench", "role": "write"}}})
+
+    async def create_repo(self, request):
+        body = await request.json()
+        repo_id = f"{body.get('organization') or 'user'}/{body['name']}"
+        return web.json_response({"url": f"{self.endpoint}/{body.get('type', 'model')}s/{repo_id}"})
+
+    async def preupload(self, request):
+        body = await request.json()
+        return web.json_response({
+            "files": [
+                {"path": f["path"], "uploadMode": self.upload_mode(f["size"]), "shouldIgnore": False}
+                for f in body["files"]
+            ]
+        })
+
+    def upload_mode(self, size):
+        return "lfs" if self.lfs_threshold is not None and size >= self.lfs_threshold else "regular"
+
+    async def lfs_batch(self, request):
+        """LFS batch 接口：已有的对象不返回 actions，客户端跳过上传"""
+        body = await request.json()
+        objects = []
+        for obj in body["objects"]:
+            entry = {"oid": obj["oid"], "size": obj["size"]}
+            if obj["oid"] not in self.lfs_objects:
+                entry["actions"] = {"upload": {"href": f"{self.endpoint}/lfs/{obj['oid']}"}}
+            objects.append(entry)
+        return web.json_response({"transfer": "basic", "objects": objects})
+
+    async def lfs_upload(self, request):
+        data = await request.read()
+        oid = request.match_info['oid']
+        if hashlib.sha256(data).hexdigest() != oid:
+            return web.Response(status=400, text="sha256 mismatch")
+        self.lfs_objects[oid] = data
+        return web.Response()
+
+    async def commit(self, request):
+        repo_id = f"{request.match_info['namespace']}/{request.match_info['name']}"
+        added = {}
+        deleted = []
+        for line in (await request.read()).splitlines():
+            item = json.loads(line)
+            if item["key"] == "file":
+                value = item["value"]
+                added[(repo_id, value["path"])] = base64.b64decode(value["content"])
+            elif item["key"] == "lfsFile":
+                value = item["value"]
+                if value["oid"] not in self.lfs_objects:
+                    return web.json_response({"error": f"LFS object {value['oid']} not uploaded"}, status=422)
+                added[(repo_id, value["path"])] = self.lfs_objects[value["oid"]]
+            elif item["key"] == "deletedFile":
+                deleted.append((repo_id, item["value"]["path"]))
+        # 整个 commit 要么全部生效，要么都不生效
+        for key in deleted:
+            self.files.pop(key, None)
+        self.files.update(added)
+        self.commits.append((repo_id, len(added)))
+        oid = hashlib.sha1(f"{self.salt}{repo_id}{len(self.commits)}".encode()).hexdigest()
+        self.heads[repo_id] = oid
+        return web.json_response({
+            "commitUrl": f"{self.endpoint}/{request.match_info['repo_type']}s/{repo_id}/commit/{oid}",
+            "commitOid": oid,
+        })
+
+    async def tree(self, request):
+        """列出仓库中的文件（总是递归列出）"""
+        repo_id = f"{request.match_info['namespace']}/{request.match_info['name']}"
+        prefix = request.match_info.get('path', '')
+        return web.json_response([
+            {"type": "file", "path": path, "size": len(data), "oid": hashlib.sha1(data).hexdigest()}
+            for (repo, path), data in sorted(self.files.items())
+            if repo == repo_id and path.startswith(prefix)
+        ])
+
+    async def resolve(self, request):
+        repo_id = f"{request.match_info['namespace']}/{request.match_info['name']}"
+        data = self.files.get((repo_id, request.match_info['path']))
+        if data is None:
+            return web.Response(status=404, headers={"X-Error-Code": "EntryNotFound"})
+        headers = {
+            "ETag": f'"{hashlib.sha1(data).hexdigest()}"',
+            "X-Repo-Commit": self.heads.get(repo_id, hashlib.sha1(repo_id.encode()).hexdigest()),
+            "Content-Length": str(len(data)),
+        }
+        if request.method == 'HEAD':
+            return web.Response(headers=headers)
+        if request.http_range.start is not None or request.http_range.stop is not None:
+            # Range 请求（包括 bytes=-N），返回 206
+            start, stop, _ = request.http_range.indices(len(data))
+            headers["Content-Length"] = str(stop - start)
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{len(data)}"
+            self.bytes_sent += stop - start
+            return web.Response(status=206, body=data[start:stop], headers=headers)
+        self.bytes_sent += len(data)
+        return web.Response(body=data, headers=headers)
+
+
+async def main(port):
+    hub = await FakeHub(port=port).start()
+    print(f"Fake Hub running on {hub.endpoint}")
+    await asyncio.Future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Hugging Face Hub.")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+    asyncio.run(main(args.port))
@@ -0,0 +1,105 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import time
+import libtorrent as lt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run import download_files
+from status_cache import StatusCache
+from swarm import LOOPBACK_SETTINGS, Tracker, make_torrent, start_seeders, wait_for
+
+
+class SlowUploader:
+    """代替 ChunkedUploader：按固定速率“上传”，并校验上传时文件内容已经完整"""
+
+    def __init__(self, rate, seed_folder):
+        self.rate = rate
+        self.seed_folder = seed_folder
+        self.uploaded = []
+
+    def upload_file(self, local_path, path_in_repo):
+        with open(local_path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha1').hexdigest()
+        with open(os.path.join(self.seed_folder, path_in_repo), 'rb') as f:
+            if hashlib.file_digest(f, 'sha1').hexdigest() != digest:
+                raise ValueError(f"{path_in_repo} was uploaded before it was complete")
+        time.sleep(os.path.getsize(local_path) / self.rate)
+        self.uploaded.append(path_in_repo)
+        return 0
+
+
+def download_once(root, torrent_info, disk_budget, args):
+    save_path = os.path.join(root, f'download_{disk_budget}')
+    shutil.rmtree(save_path, ignore_errors=True)
+    session = lt.session({**LOOPBACK_SETTINGS, 'download_rate_limit': args.download_mb * 2 ** 20})
+    params = lt.add_torrent_params()
+    params.ti = lt.torrent_info(torrent_info)
+    params.save_path = save_path
+    handle = session.add_torrent(params)
+    files = sorted([
+        {"index": i, "path": torrent_info.files().file_path(i), "size": torrent_info.files().file_size(i)}
+        for i in range(torrent_info.num_files())
+        if not torrent_info.files().file_flags(i) & lt.file_storage.flag_pad_file
+    ], key=lambda x: x["size"], reverse=True)
+    uploader = SlowUploader(args.upload_mb * 2 ** 20, os.path.join(root, 'seed'))
+
+    start = time.monotonic()
+    # download_files 每次循环都会打印进度，这里不需要
+    with contextlib.redirect_stdout(io.StringIO()):
+        download_files(session, handle, files, uploader, save_path, disk_budget, StatusCache(session), interval=0.05)
+    elapsed = time.monotonic() - start
+    session.remove_torrent(handle)
+    shutil.rmtree(save_path, ignore_errors=True)
+    assert len(uploader.uploaded) == len(files)
+    return round(elapsed, 2)
+
+
+def run(args):
+    root = args.root
+    tracker = Tracker().start()
+    torrent_info = make_torrent(root, args.size_mb * 2 ** 20, 256 * 1024, args.files, [tracker.url])
+    seeders = start_seeders(root, torrent_info, 2)
+    wait_for(lambda: len(next(iter(tracker.peers.values()), ())) >= 2, 10)
+
+    total = args.size_mb
+    sequential, pipelined = [], []
+    try:
+        # 两种方式交替运行，取各自最快的一次
+        for _ in range(args.repeat):
+            sequential.append(download_once(root, torrent_info, 0, args))
+            pipelined.append(download_once(root, torrent_info, args.budget_mb * 2 ** 20, args))
+    finally:
+        for session, handle in seeders:
+            session.remove_torrent(handle)
+        tracker.stop()
+
+    print(json.dumps({
+        "size_mb": total,
+        "files": args.files,
+        "download_seconds": round(total / args.download_mb, 2),
+        "upload_seconds": round(total / args.upload_mb, 2),
+        "sequential_seconds": min(sequential),
+        "pipelined_seconds": min(pipelined),
+        "runs_sequential": sequential,
+        "runs_pipelined": pipelined,
+        "budget_mb": args.budget_mb,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare upload-then-download with the pipelined file scheduler on a loopback swarm.")
+    parser.add_argument("--root", default="/tmp/pipeline-bench")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--download-mb", type=float, default=16, help="download rate limit in MB/s")
+    parser.add_argument("--upload-mb", type=float, default=16, help="simulated upload rate in MB/s")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget-mb", type=int, default=32, help="disk budget for the pipelined run")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from web_server import create_app
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """原来的 HTTPServer 线程方案，去掉日志输出"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_thread_server(root):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=root))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, httpd.server_address[1]
+
+
+async def start_aiohttp_server(root, status):
+    runner = web.AppRunner(create_app(lambda: status, lambda: 1, root), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+async def load(url, concurrency, requests):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    async with session.get(url, headers={"Accept-Encoding": "gzip"}) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "req_per_sec": round(len(latencies) / elapsed),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "errors": errors,
+    }
+
+
+async def run(args):
+    status = {"files": [{"index": i, "path": f"file_{i}.mxf", "size": 10 ** 9, "downloaded": 0,
+                         "speed": 0, "progress": 0, "state": "downloading"} for i in range(args.files)],
+              "peers": 0, "total_progress": 0}
+
+    httpd, thread_port = start_thread_server(ROOT)
+    runner, aio_port = await start_aiohttp_server(ROOT, status)
+    # 线程服务没有 /status，用首页对比静态文件，再单独测 aiohttp 的 /status
+    targets = [
+        ("thread", f"http://127.0.0.1:{thread_port}/index.html"),
+        ("aiohttp", f"http://127.0.0.1:{aio_port}/index.html"),
+        ("aiohttp /status", f"http://127.0.0.1:{aio_port}/status"),
+    ]
+    results = {}
+    try:
+        for name, url in targets:
+            await load(url, args.concurrency, args.concurrency)  # 预热
+            results[name] = await load(url, args.concurrency, args.requests)
+    finally:
+        await runner.cleanup()
+        httpd.shutdown()
+        httpd.server_close()
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the thread HTTPServer with the aiohttp server.")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--files", type=int, default=2000, help="files in the /status payload")
+    args = parser.parse_args()
+    asyncio.run(run(args))
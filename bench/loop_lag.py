@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+
+# 替身服务器没有实现 Xet 接口
+os.environ["HF_HUB_DISABLE_XET"] = "1"
+os.environ["HF_HUB_DISABLE_PROGRESS_BARS"] = "1"
+from huggingface_hub import HfApi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_executor import io_executor, LoopLagMonitor
+from fake_hub import FakeHub
+
+REPO_ID = "bench/loop-lag"
+
+
+def save_progress(path, data):
+    """和 ResumeState.save 一样先写临时文件再 rename"""
+    with open(path + ".tmp", 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return data
+
+
+async def broadcast(interval, gaps, stop):
+    """模拟 DownloadManager 每 interval 秒推送一次状态，记录相邻两次推送的间隔"""
+    last = time.monotonic()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        gaps.append(now - last)
+        last = now
+
+
+async def workload(api, root, args, use_executor):
+    """和 k.py 的定时上传一样：保存进度文件、上传进度文件、提交一批 piece"""
+    async def call(resource, func, *a, **kw):
+        if use_executor:
+            return await io_executor.run(resource, func, *a, **kw)
+        return func(*a, **kw)
+
+    progress = os.urandom(args.progress_kb * 1024)
+    piece = os.urandom(args.piece_kb * 1024)
+    for i in range(args.rounds):
+        data = await call("disk", save_progress, os.path.join(root, "download_progress.bin"), progress)
+        await call("hub", api.upload_file, path_or_fileobj=data, path_in_repo="download_progress.bin",
+                   repo_id=REPO_ID, repo_type="dataset")
+        await call("hub", api.upload_file, path_or_fileobj=piece, path_in_repo=f"pieces/piece_{i}.dat",
+                   repo_id=REPO_ID, repo_type="dataset")
+        # 下载循环每个 tick 之间的 sleep
+        await asyncio.sleep(args.pause)
+
+
+async def measure(api, root, args, use_executor):
+    monitor = LoopLagMonitor(interval=0.01, warn=float("inf"))
+    monitor.start()
+    gaps = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(broadcast(args.interval, gaps, stop))
+    start = time.perf_counter()
+    await workload(api, root, args, use_executor)
+    seconds = time.perf_counter() - start
+    stop.set()
+    await ticker
+    await monitor.stop()
+    stats = monitor.stats()
+    return {
+        "seconds": round(seconds, 2),
+        "max_lag_ms": stats["max_lag_ms"],
+        "mean_lag_ms": stats["mean_lag_ms"],
+        "blocked_seconds": round(monitor.total_lag, 2),
+        "broadcasts": len(gaps),
+        "expected_broadcasts": int(seconds / args.interval),
+        "max_broadcast_gap_ms": round(max(gaps, default=0) * 1000, 1),
+    }
+
+
+def run(args):
+    shutil.rmtree(args.root, ignore_errors=True)
+    os.makedirs(args.root)
+    # FakeHub 运行在另一个线程的事件循环中，内联的阻塞调用卡住的只是被测的事件循环
+    hub = FakeHub(latency=args.latency).start_in_thread()
+    api = HfApi(endpoint=hub.endpoint, token="hf_bench")
+    api.create_repo(REPO_ID, repo_type="dataset")
+
+    results = {}
+    for name, use_executor in (("inline", False), ("io_executor", True)):
+        results[name] = asyncio.run(measure(api, args.root, args, use_executor))
+    results["io_executor"]["pools"] = io_executor.stats()
+    print(json.dumps({
+        "rounds": args.rounds,
+        "hub_latency_ms": args.latency * 1000,
+        "broadcast_interval_ms": args.interval * 1000,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure event-loop stalls from inline HfApi/file calls versus the I/O executor.")
+    parser.add_argument("--root", default="/tmp/loop-lag-bench")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="extra seconds per fake Hub request")
+    parser.add_argument("--progress-kb", type=int, default=4096, help="size of the progress file written each round")
+    parser.add_argument("--piece-kb", type=int, default=1024)
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds the download loop sleeps between rounds")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between simulated websocket broadcasts")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, UTC
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH))
+
+# 三种下载方式：download_torrent.py（流水线逐 piece 提交）、k.py（结束时批量提交 pack）、
+# run.py（按文件下载并分块上传）
+VARIANTS = ("download_torrent", "k", "run")
+
+
+# ---- 子进程：运行一种下载方式 ----
+# 每种方式在单独的进程中运行，峰值 RSS 只包含它自己；Hub 地址、HF_HOME 和
+# TORRENT_PROFILE=loopback 由父进程通过环境变量传入，loopback 设置档由子进程注册
+
+def peak_rss():
+    """本进程的峰值 RSS（VmHWM）；ru_maxrss 在 Linux 上会继承 fork 出它的父进程的峰值"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+async def drain_websocket(websocket):
+    async for _ in websocket:
+        pass
+
+
+async def run_download_torrent(magnet_link, save_path):
+    import websockets
+    from download_torrent import TorrentDownloader
+    # download_torrent.py 把进度推送到 server2.py 的 WebSocket 服务
+    async with websockets.serve(drain_websocket, "localhost", 8765):
+        await TorrentDownloader(magnet_link, save_path, "hf_bench").start()
+
+
+async def run_k(magnet_link, save_path):
+    from k import TorrentDownloader
+    downloader = TorrentDownloader(magnet_link, save_path, "hf_bench")
+    # k.py 在设置档之后又打开了 DHT/LSD/UPnP，回环测试中关掉
+    downloader.session.apply_settings({
+        'enable_dht': False, 'enable_lsd': False, 'enable_upnp': False, 'enable_natpmp': False,
+    })
+    await downloader.download()
+
+
+def run_worker(args):
+    from io_executor import io_executor, loop_monitor
+    from swarm import register_loopback_profile
+    register_loopback_profile()
+    # 先导入被测模块（模块名和方式名相同）：startup_sec 包含解释器启动和导入，seconds 只包含下载和上传
+    importlib.import_module(args.worker)
+    result = {"variant": args.worker, "started": time.time(), "error": None}
+    try:
+        if args.worker == "run":
+            from run import download_torrent_with_priority
+            download_torrent_with_priority(args.magnet, args.save_path, "hf_bench")
+        else:
+            runner = run_download_torrent if args.worker == "download_torrent" else run_k
+            asyncio.run(runner(args.magnet, args.save_path))
+    except BaseException as e:
+        result["error"] = repr(e)
+    result["finished"] = time.time()
+    result["peak_rss"] = peak_rss()
+    # run.py 没有事件循环
+    result["loop_lag"] = loop_monitor.stats() if loop_monitor.samples else None
+    result["io"] = io_executor.stats()
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+    return 1 if result["error"] else 0
+
+
+# ---- 父进程：tracker、做种方和替身 Hub ----
+
+def payload_size(torrent_info):
+    """不含填充文件的数据大小；hybrid torrent 的 total_size() 包括填充文件，它们不会传输和上传"""
+    import libtorrent as lt
+    files = torrent_info.files()
+    return sum(files.file_size(i) for i in range(files.num_files())
+               if not files.file_flags(i) & lt.file_storage.flag_pad_file)
+
+
+def run_once(args, variant, attempt, torrent_info, seeders, magnet_link):
+    from fake_hub import FakeHub
+
+    name = f"{variant}_{attempt}"
+    save_path = os.path.join(args.root, f"download_{name}")
+    hf_home = os.path.join(args.root, f"hf_home_{name}")
+    for folder in (save_path, hf_home):
+        shutil.rmtree(folder, ignore_errors=True)
+    result_path = os.path.join(args.root, f"{name}.json")
+    log_path = os.path.join(args.root, f"{name}.log")
+
+    hub = FakeHub(latency=args.hub_latency).start_in_thread()
+    env = {
+        **os.environ,
+        "HF_ENDPOINT": hub.endpoint,
+        "HF_HOME": hf_home,  # login() 写 token 的位置，不影响本机的 ~/.cache/huggingface
+        "HF_HUB_DISABLE_XET": "1",  # 替身服务器没有实现 Xet 接口
+        "HF_HUB_DISABLE_PROGRESS_BARS": "1",
+        "HF_HUB_DISABLE_TELEMETRY": "1",
+        "TORRENT_PROFILE": "loopback",
+    }
+    total_size = payload_size(torrent_info)
+    piece_length = torrent_info.piece_length()
+
+    def served():
+        return sum(handle.status().total_payload_upload for _, handle in seeders)
+
+    baseline = served()
+    first_piece = all_served = first_upload = None
+    spawned = time.time()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", variant, "--magnet", magnet_link,
+             "--save-path", save_path, "--result", result_path],
+            stdout=log, stderr=subprocess.STDOUT, env=env, cwd=args.root,
+        )
+        # 做种方的上传计数是实时更新的，第一次凑够一个 piece 的时间就是收到第一个 piece 的时间
+        while process.poll() is None and time.time() - spawned < args.timeout:
+            now = time.time()
+            uploaded = served() - baseline
+            if first_piece is None and uploaded >= piece_length:
+                first_piece = now
+            if all_served is None and uploaded >= total_size:
+                all_served = now
+            # metadata 和进度文件很小，收到一个 piece 大小的数据才算开始上传 piece
+            if first_upload is None and hub.bytes_received >= piece_length:
+                first_upload = now
+            time.sleep(0.01)
+        timed_out = process.poll() is None
+        if timed_out:
+            process.kill()
+        process.wait()
+    hub.stop_thread()
+
+    try:
+        with open(result_path) as f:
+            worker = json.load(f)
+    except (OSError, ValueError):
+        worker = {"started": spawned, "finished": time.time(), "error": "worker did not report",
+                  "peak_rss": None, "loop_lag": None, "io": None}
+    if timed_out:
+        worker["error"] = f"timed out after {args.timeout}s"
+
+    started = worker["started"]
+    seconds = worker["finished"] - started
+
+    def since_start(moment):
+        return round(moment - started, 3) if moment else None
+
+    completed = worker["error"] is None and hub.bytes_received >= total_size
+    if not args.keep:
+        shutil.rmtree(save_path, ignore_errors=True)
+        shutil.rmtree(hf_home, ignore_errors=True)
+    return {
+        "completed": completed,
+        "error": worker["error"],
+        "seconds": round(seconds, 2),
+        # 下载并把数据全部提交到 Hub 的端到端速率
+        "mb_per_sec": round(total_size / seconds / 2 ** 20, 1) if completed else None,
+        "startup_sec": round(started - spawned, 2),
+        "time_to_first_piece_sec": since_start(first_piece),
+        "download_done_sec": since_start(all_served),
+        "time_to_first_upload_sec": since_start(first_upload),
+        "peak_rss_mb": round(worker["peak_rss"] / 2 ** 20, 1) if worker["peak_rss"] else None,
+        "loop_lag": worker["loop_lag"],
+        "io": worker["io"],
+        "hub": {
+            "requests": hub.requests,
+            "commits": len(hub.commits),
+            "files": len(hub.files),
+            "uploaded_mb": round(hub.bytes_received / 2 ** 20, 1),
+        },
+        "log": log_path,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+CONFIG_KEYS = ("size_mb", "piece_kb", "files", "seeders", "hub_latency_ms")
+
+
+def compare(previous_path, report):
+    """和之前的结果文件比较每种方式的端到端速率，torrent 或 swarm 配置不同时在结果中注明"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    changes = {"config_differs": [key for key in CONFIG_KEYS if previous.get(key) != report[key]]}
+    for variant, result in report["variants"].items():
+        before = (previous["variants"].get(variant) or {}).get("mb_per_sec")
+        after = result["mb_per_sec"]
+        changes[variant] = {
+            "mb_per_sec_before": before,
+            "mb_per_sec_after": after,
+            "change": f"{(after / before - 1) * 100:+.1f}%" if before and after else None,
+        }
+    return changes
+
+
+def run(args):
+    import libtorrent as lt
+    from swarm import Tracker, make_torrent, start_seeders, wait_for
+
+    os.makedirs(args.root, exist_ok=True)
+    tracker = Tracker().start()
+    torrent_info = make_torrent(os.path.join(args.root, "swarm"), args.size_mb * 2 ** 20, args.piece_kb * 1024,
+                                args.files, [tracker.url])
+    seeders = start_seeders(os.path.join(args.root, "swarm"), torrent_info, args.seeders)
+    wait_for(lambda: len(next(iter(tracker.peers.values()), ())) >= args.seeders, 10)
+    # 下载方只拿到 magnet，metadata 也要从回环 swarm 获取
+    magnet_link = lt.make_magnet_uri(torrent_info)
+
+    results = {}
+    try:
+        for variant in args.variants:
+            runs = [run_once(args, variant, i, torrent_info, seeders, magnet_link) for i in range(args.repeat)]
+            finished = [r for r in runs if r["completed"]]
+            best = max(finished, key=lambda r: r["mb_per_sec"]) if finished else runs[-1]
+            results[variant] = {**best, "runs_mb_per_sec": [r["mb_per_sec"] for r in runs]}
+    finally:
+        for session, handle in seeders:
+            session.remove_torrent(handle)
+        tracker.stop()
+
+    report = {
+        "date": datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "libtorrent": lt.__version__,
+        "cpus": os.cpu_count(),
+        "size_mb": args.size_mb,
+        "piece_kb": args.piece_kb,
+        "files": args.files,
+        "seeders": args.seeders,
+        "hub_latency_ms": args.hub_latency * 1000,
+        "variants": results,
+    }
+    if args.compare:
+        report["compared_with"] = args.compare
+        report["changes"] = compare(args.compare, report)
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"offline_swarm_{report['date'].replace(':', '')}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Results written to {path}")
+    return 0 if all(r["completed"] for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download a synthetic torrent from a loopback tracker and seeders with each downloader "
+                    "and commit it to a stand-in Hub, without touching the public swarm or the real Hub.")
+    parser.add_argument("--root", default="/tmp/offline-swarm-bench", help="working directory for seed data, downloads and logs")
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--piece-kb", type=int, default=1024)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--seeders", type=int, default=4)
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a download is killed")
+    parser.add_argument("--hub-latency", type=float, default=0.0, help="extra seconds per fake Hub request")
+    parser.add_argument("--keep", action="store_true", help="keep downloaded data and HF_HOME of each run")
+    parser.add_argument("--output-dir", default=os.path.join(BENCH, "results"), help="where the JSON results are written")
+    parser.add_argument("--compare", help="earlier results file to compare MB/s against")
+    # 父进程用这些参数启动子进程
+    parser.add_argument("--worker", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--magnet", help=argparse.SUPPRESS)
+    parser.add_argument("--save-path", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sys.exit(run_worker(args) if args.worker else run(args))
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+# 替身服务器没有实现 Xet 接口
+os.environ["HF_HUB_DISABLE_XET"] = "1"
+os.environ["HF_HUB_DISABLE_PROGRESS_BARS"] = "1"
+from huggingface_hub import HfApi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from combine_pieces import PIECE_NAME, FileLayout, combine_pieces
+from piece_pack import HubSource, PackReader, write_pack
+from uploader import HubBatchUploader
+from fake_hub import FakeHub
+from swarm import make_torrent
+
+REPO_ID = "bench/piece-packs"
+
+
+def read_piece(layout, root, torrent_info, piece_index):
+    """从做种目录读出一个 piece，填充文件部分为 0"""
+    data = bytearray(torrent_info.piece_size(piece_index))
+    for file_index, file_offset, piece_offset, length in layout.segments(piece_index, len(data)):
+        with open(os.path.join(root, layout.files[file_index][0]), 'rb') as f:
+            data[piece_offset:piece_offset + length] = os.pread(f.fileno(), length, file_offset)
+    return bytes(data)
+
+
+async def upload(api, pieces, pieces_per_pack):
+    """和 k.py 一样用 HubBatchUploader 的 pack 选项，每个批次提交一个 pack"""
+    def pack(batch):
+        indexes = {int(PIECE_NAME.search(path).group(1)): data for path, data in batch}
+        return f"pieces/pack_{min(indexes)}_{max(indexes)}.pack", write_pack(indexes)
+
+    batcher = HubBatchUploader(api, REPO_ID, "dataset", batch_size=pieces_per_pack, pack=pack)
+    batcher.start()
+    for piece_index, data in pieces.items():
+        await batcher.add(f"pieces/piece_{piece_index}.dat", data)
+    await batcher.stop()
+    return batcher.commits
+
+
+def tree_digest(folder):
+    digests = {}
+    for dirpath, _, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                digests[os.path.relpath(path, folder)] = hashlib.file_digest(f, 'sha1').hexdigest()
+    return digests
+
+
+def run(args):
+    root = args.root
+    torrent_info = make_torrent(root, args.size_mb * 2 ** 20, args.piece_kb * 1024, args.files)
+    layout = FileLayout.from_torrent(torrent_info)
+    seed = os.path.join(root, 'seed')
+    pieces = {i: read_piece(layout, seed, torrent_info, i) for i in range(torrent_info.num_pieces())}
+    total = sum(len(data) for data in pieces.values())
+
+    # HfApi 和 combine_pieces 是同步调用，FakeHub 在后台线程中运行
+    hub = FakeHub().start_in_thread()
+    api = HfApi(endpoint=hub.endpoint, token="hf_bench")
+    api.create_repo(REPO_ID, repo_type="dataset")
+    commits = asyncio.run(upload(api, pieces, args.pieces_per_pack))
+    packs = {path: data for (repo, path), data in hub.files.items() if path.endswith('.pack')}
+
+    # 读取一个 piece：末尾一次请求拿到索引，再一次请求拿到数据
+    path = sorted(packs)[len(packs) // 2]
+    source = HubSource(api, REPO_ID, "dataset", path)
+    reader = PackReader(source)
+    piece_index = sorted(reader.entries)[len(reader.entries) // 2]
+    assert reader.read_piece(piece_index) == pieces[piece_index]
+    single = {"requests": source.requests, "bytes": source.bytes_fetched, "pack_bytes": len(packs[path])}
+
+    # 从仓库还原全部文件，以及本地已有一半 piece 时只下载另一半
+    expected = tree_digest(os.path.join(seed, 'data'))
+    results = {}
+    for name, local_pieces in (("full", ()), ("half_local", range(0, len(pieces), 2))):
+        local = os.path.join(root, f"local_{name}")
+        output = os.path.join(root, f"output_{name}")
+        shutil.rmtree(local, ignore_errors=True)
+        shutil.rmtree(output, ignore_errors=True)
+        os.makedirs(local)
+        for i in local_pieces:
+            with open(os.path.join(local, f"piece_{i}.dat"), 'wb') as f:
+                f.write(pieces[i])
+        before = hub.bytes_sent
+        combine_pieces(local, output, torrent_info, repo_id=REPO_ID, api=api)
+        assert tree_digest(os.path.join(output, 'data')) == expected, f"{name}: output differs from the seed data"
+        results[name] = {"bytes_fetched": hub.bytes_sent - before}
+
+    print(json.dumps({
+        "size_mb": args.size_mb,
+        "pieces": len(pieces),
+        "packs": len(packs),
+        "commits": commits,
+        "piece_bytes": total,
+        "pack_bytes": sum(len(data) for data in packs.values()),
+        "single_piece": single,
+        "combine": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload pieces as packs to a fake Hub and rebuild files with range requests.")
+    parser.add_argument("--root", default="/tmp/piece-pack-bench")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--piece-kb", type=int, default=256)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--pieces-per-pack", type=int, default=100)
+    args = parser.parse_args()
+    run(args)
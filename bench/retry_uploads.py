@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+
+# 替身服务器没有实现 Xet 接口
+os.environ["HF_HUB_DISABLE_XET"] = "1"
+os.environ["HF_HUB_DISABLE_PROGRESS_BARS"] = "1"
+from huggingface_hub import HfApi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from combine_pieces import PIECE_NAME
+from retry import DeadLetterQueue, Retrier
+from uploader import HubBatchUploader
+from fake_hub import FakeHub
+
+REPO_ID = "bench/retry-uploads"
+
+
+async def upload(api, retrier, pieces, batch_size, dead_letters):
+    """和 k.py 一样：重试用尽后把这一批 piece 记入 dead_letters"""
+    async def on_committed(paths):
+        dead_letters.discard([int(PIECE_NAME.search(path).group(1)) for path in paths])
+
+    async def on_failed(paths, error):
+        dead_letters.add([int(PIECE_NAME.search(path).group(1)) for path in paths], error)
+
+    batcher = HubBatchUploader(api, REPO_ID, "dataset", batch_size=batch_size,
+                               on_committed=on_committed, on_failed=on_failed, retrier=retrier)
+    batcher.start()
+    for piece_index in pieces:
+        await batcher.add(f"pieces/piece_{piece_index}.dat", pieces[piece_index])
+    await batcher.stop()
+    return batcher.stats()
+
+
+async def run(args):
+    shutil.rmtree(args.root, ignore_errors=True)
+    hub = FakeHub(fail_rate=args.fail_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    await hub.start()
+    api = HfApi(endpoint=hub.endpoint, token="hf_bench")
+    pieces = {i: os.urandom(args.piece_kb * 1024) for i in range(args.pieces)}
+    results = {}
+
+    # 1. 服务器随机返回 500 和 429：全部靠重试完成，没有 piece 进入 dead-letter 队列
+    retrier = Retrier(args.retries, base=args.base, cap=args.cap)
+    dead_letters = DeadLetterQueue(os.path.join(args.root, "flaky", "failed_pieces.json"))
+    start = time.perf_counter()
+    stats = await upload(api, retrier, pieces, args.batch_size, dead_letters)
+    results["flaky"] = {
+        "seconds": round(time.perf_counter() - start, 2),
+        "injected_errors": hub.failures,
+        "injected_429": hub.throttled,
+        "retry": retrier.stats(),
+        "committed": stats["files_committed"],
+        "dead_letters": len(dead_letters),
+    }
+
+    # 2. 提交两次以后持续 503：重试用尽的 piece 写入 dead-letter 文件；
+    #    服务恢复后用新进程的方式重新读取文件，在任务结束前补传
+    hub.files.clear()
+    hub.fail_rate = hub.throttle_rate = 0
+    hub.fail_after_commits = len(hub.commits) + 2
+    path = os.path.join(args.root, "outage", "failed_pieces.json")
+    retrier = Retrier(2, base=args.base, cap=args.cap)
+    dead_letters = DeadLetterQueue(path)
+    stats = await upload(api, retrier, pieces, args.batch_size, dead_letters)
+    lost = len(dead_letters)
+
+    hub.fail_after_commits = None
+    dead_letters = DeadLetterQueue(path)
+    assert len(dead_letters) == lost, "dead-letter queue was not persisted"
+    await upload(api, retrier, {i: pieces[i] for i in dead_letters}, args.batch_size, dead_letters)
+    stored = {int(PIECE_NAME.search(p).group(1)) for (_, p) in hub.files}
+    assert stored == set(pieces), f"{len(set(pieces) - stored)} pieces missing after the retry pass"
+    results["outage"] = {
+        "committed_before_outage": stats["files_committed"],
+        "dead_letters_after_outage": lost,
+        "dead_letters_after_retry": len(dead_letters),
+        "dead_letter_file_removed": not os.path.exists(path),
+        "retry": retrier.stats(),
+    }
+    await hub.stop()
+
+    print(json.dumps({"pieces": args.pieces, "batch_size": args.batch_size, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Commit pieces to a fake Hub that errors, rate limits and goes down.")
+    parser.add_argument("--root", default="/tmp/retry-bench")
+    parser.add_argument("--pieces", type=int, default=200)
+    parser.add_argument("--piece-kb", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="probability of a 500 on any write request")
+    parser.add_argument("--throttle-rate", type=float, default=0.2, help="probability of a 429 on a commit")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After sent with each 429, in seconds")
+    parser.add_argument("--retries", type=int, default=6)
+    parser.add_argument("--base", type=float, default=0.05, help="backoff base in seconds")
+    parser.add_argument("--cap", type=float, default=1.0, help="backoff cap in seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+# 替身服务器没有实现 Xet 接口
+os.environ["HF_HUB_DISABLE_XET"] = "1"
+os.environ["HF_HUB_DISABLE_PROGRESS_BARS"] = "1"
+import libtorrent as lt
+from huggingface_hub import HfApi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from streaming import StreamingDownload, disable_uploads, punch_hole_supported
+from fake_hub import FakeHub
+from swarm import LOOPBACK_SETTINGS, Tracker, make_torrent, start_seeders, wait_for
+
+REPO_ID = "bench/streaming"
+
+
+def allocated_bytes(folder):
+    total = 0
+    for dirpath, _, names in os.walk(folder):
+        for name in names:
+            total += os.stat(os.path.join(dirpath, name)).st_blocks * 512
+    return total
+
+
+def run(args):
+    root = args.root
+    save_path = os.path.join(root, "stream")
+    shutil.rmtree(save_path, ignore_errors=True)
+    if not punch_hole_supported(root):
+        sys.exit(f"{root} does not support punching holes")
+
+    tracker = Tracker().start()
+    size = args.size_mb * 2 ** 20
+    torrent_info = make_torrent(root, size, args.piece_kb * 1024, args.files, [tracker.url])
+    seeders = start_seeders(root, torrent_info, args.seeders)
+    wait_for(lambda: len(next(iter(tracker.peers.values()), ())) >= args.seeders, 10)
+
+    hub = FakeHub(latency=args.hub_latency).start_in_thread()
+    api = HfApi(endpoint=hub.endpoint, token="hf_bench")
+    api.create_repo(REPO_ID, repo_type="dataset")
+
+    session = lt.session(LOOPBACK_SETTINGS)
+    # 和 run.py 一样在添加 torrent 之前调用
+    disable_uploads(session)
+    params = lt.add_torrent_params()
+    params.ti = lt.torrent_info(torrent_info)
+    params.save_path = save_path
+    params.storage_mode = lt.storage_mode_t.storage_mode_sparse
+    handle = session.add_torrent(params)
+
+    # 只连接被测客户端的 leecher（torrent 中没有 tracker），会向它请求所有已经 "have" 的 piece；
+    # 如果被测客户端把打过洞的 piece 发出去，leecher 会校验失败
+    leecher = lt.session(LOOPBACK_SETTINGS)
+    leech_params = lt.add_torrent_params()
+    leech_params.ti = lt.torrent_info(make_torrent(root, size, args.piece_kb * 1024, args.files))
+    leech_params.save_path = os.path.join(root, "leecher")
+    shutil.rmtree(leech_params.save_path, ignore_errors=True)
+    leech_handle = leecher.add_torrent(leech_params)
+    leech_handle.connect_peer(("127.0.0.1", session.listen_port()))
+
+    stream = StreamingDownload(session, handle, api, REPO_ID, "dataset", args.budget_mb * 2 ** 20, save_path,
+                               batch_bytes=args.batch_mb * 2 ** 20)
+    peak = {"allocated": 0, "upload_at_first_eviction": None}
+
+    def on_tick(stream):
+        peak["allocated"] = max(peak["allocated"], allocated_bytes(save_path))
+        if stream.uploaded and peak["upload_at_first_eviction"] is None:
+            peak["upload_at_first_eviction"] = handle.status().total_payload_upload
+
+    start = time.monotonic()
+    stream.run(on_tick=on_tick, tick=0.05)
+    seconds = time.monotonic() - start
+    # leecher 继续请求一段时间，看被测客户端是否还会上传
+    time.sleep(args.linger)
+
+    status = handle.status()
+    leech_status = leech_handle.status()
+    uploaded_after = status.total_payload_upload - (peak["upload_at_first_eviction"] or 0)
+    stored = {path for (_, path) in hub.files}
+    result = {
+        "pieces": stream.num_pieces,
+        "seconds": round(seconds, 2),
+        "budget_mb": args.budget_mb,
+        "peak_allocated_mb": round(peak["allocated"] / 2 ** 20, 1),
+        "stream": stream.stats(),
+        "pieces_on_hub": len(stored),
+        "payload_uploaded": status.total_payload_upload,
+        "payload_uploaded_after_first_eviction": uploaded_after,
+        "leecher_failed_bytes": leech_status.total_failed_bytes,
+    }
+    session.remove_torrent(handle, lt.session.delete_files)
+    for seed_session, seed_handle in seeders:
+        seed_session.remove_torrent(seed_handle)
+    hub.stop_thread()
+    tracker.stop()
+    print(json.dumps(result, indent=2))
+
+    errors = []
+    if len(stored) != stream.num_pieces:
+        errors.append(f"{stream.num_pieces - len(stored)} pieces missing on the Hub")
+    if uploaded_after or status.total_payload_upload:
+        errors.append(f"uploaded {status.total_payload_upload} payload bytes to peers "
+                      f"({uploaded_after} after the first eviction)")
+    if leech_status.total_failed_bytes:
+        errors.append(f"leecher failed {leech_status.total_failed_bytes} bytes of hash checks")
+    for error in errors:
+        print(f"FAIL: {error}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a torrent through a small disk budget and check that "
+                                                 "evicted (hole-punched) pieces are never uploaded to peers.")
+    parser.add_argument("--root", default="/tmp/streaming-bench")
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--piece-kb", type=int, default=256)
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--seeders", type=int, default=2)
+    parser.add_argument("--budget-mb", type=int, default=4)
+    parser.add_argument("--batch-mb", type=int, default=1)
+    parser.add_argument("--hub-latency", type=float, default=0.02, help="extra seconds per fake Hub request")
+    parser.add_argument("--linger", type=float, default=3, help="seconds the leecher keeps requesting after the stream ends")
+    args = parser.parse_args()
+    sys.exit(run(args))
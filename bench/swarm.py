@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote_to_bytes
+import libtorrent as lt
+
+# 本地回环 swarm 的公共设置：关闭 DHT/LSD/UPnP，允许同一 IP 的多个 peer
+LOOPBACK_SETTINGS = {
+    'listen_interfaces': '127.0.0.1:0',
+    'enable_dht': False,
+    'enable_lsd': False,
+    'enable_upnp': False,
+    'enable_natpmp': False,
+    'allow_multiple_connections_per_ip': True,
+    'announce_to_all_tiers': True,
+    'alert_mask': lt.alert.category_t.error_notification | lt.alert.category_t.status_notification,
+}
+
+
+def register_loopback_profile():
+    """注册只在测试中使用的设置档 loopback：throughput 加上回环设置，被测代码通过 TORRENT_PROFILE=loopback 选择
+
+    alert_mask 和 announce_to_all_tiers 由被测代码自己决定，不放进设置档。
+    """
+    from session_profiles import PROFILES
+    PROFILES['loopback'] = {
+        **PROFILES['throughput'],
+        **{key: value for key, value in LOOPBACK_SETTINGS.items()
+           if key not in ('alert_mask', 'announce_to_all_tiers')},
+    }
+
+
+class Tracker:
+    """最小的 HTTP tracker，只实现 announce，返回 compact peer 列表"""
+
+    def __init__(self):
+        self.peers = {}  # {info_hash: {(ip, port)}}
+        self.lock = threading.Lock()
+        self.server = None
+        self.announces = 0
+
+    def start(self):
+        tracker = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                tracker.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/announce"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handle(self, request):
+        query = {}
+        for pair in request.path.partition('?')[2].split('&'):
+            key, _, value = pair.partition('=')
+            query[key] = unquote_to_bytes(value)
+        info_hash = query.get('info_hash', b'')
+        port = int(query.get('port', b'0'))
+        with self.lock:
+            self.announces += 1
+            peers = self.peers.setdefault(info_hash, set())
+            if query.get('event') == b'stopped':
+                peers.discard(('127.0.0.1', port))
+            else:
+                peers.add(('127.0.0.1', port))
+            others = [p for p in peers if p[1] != port]
+        compact = b''.join(bytes(map(int, ip.split('.'))) + p.to_bytes(2, 'big') for ip, p in others)
+        body = b'd8:intervali5e12:min intervali1e5:peers' + str(len(compact)).encode() + b':' + compact + b'e'
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/plain')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+def make_torrent(root, total_size, piece_length=1024 * 1024, num_files=4, trackers=()):
+    """在 root/seed/data 下生成随机内容的文件并创建 torrent，已存在时直接复用"""
+    data_folder = os.path.join(root, 'seed', 'data')
+    os.makedirs(data_folder, exist_ok=True)
+    file_size = total_size // num_files
+    block = os.urandom(1024 * 1024)
+    for i in range(num_files):
+        path = os.path.join(data_folder, f'file_{i:03d}.bin')
+        if os.path.exists(path) and os.path.getsize(path) == file_size:
+            continue
+        with open(path, 'wb') as f:
+            written = 0
+            while written < file_size:
+                # 每个 MB 的开头不同，避免不同 piece 的内容完全相同
+                chunk = os.urandom(16) + block[16:min(len(block), file_size - written)]
+                f.write(chunk)
+                written += len(chunk)
+    storage = lt.file_storage()
+    lt.add_files(storage, data_folder)
+    creator = lt.create_torrent(storage, piece_length)
+    for tracker in trackers:
+        creator.add_tracker(tracker)
+    lt.set_piece_hashes(creator, os.path.join(root, 'seed'))
+    return lt.torrent_info(lt.bencode(creator.generate()))
+
+
+def start_seeders(root, torrent_info, count, settings=None):
+    """启动 count 个做种的 session，共用同一份数据"""
+    seeders = []
+    for _ in range(count):
+        session = lt.session({**LOOPBACK_SETTINGS, **(settings or {})})
+        params = lt.add_torrent_params()
+        params.ti = lt.torrent_info(torrent_info)
+        params.save_path = os.path.join(root, 'seed')
+        params.flags |= lt.torrent_flags.seed_mode
+        handle = session.add_torrent(params)
+        seeders.append((session, handle))
+    return seeders
+
+
+def wait_for(condition, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return False
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import libtorrent as lt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from session_profiles import PROFILES, profile_settings
+from swarm import LOOPBACK_SETTINGS, Tracker, make_torrent, start_seeders, wait_for
+
+
+def download_once(root, torrent_info, profile, timeout):
+    """用指定的设置档从本地 swarm 下载一次，返回统计结果"""
+    save_path = os.path.join(root, f'download_{profile}')
+    shutil.rmtree(save_path, ignore_errors=True)
+    session = lt.session({**LOOPBACK_SETTINGS, **profile_settings(profile)})
+    params = lt.add_torrent_params()
+    params.ti = lt.torrent_info(torrent_info)
+    params.save_path = save_path
+    start = time.monotonic()
+    handle = session.add_torrent(params)
+
+    first_byte = None
+    peak_peers = 0
+    while time.monotonic() - start < timeout:
+        status = handle.status()
+        peak_peers = max(peak_peers, status.num_peers)
+        if first_byte is None and status.total_wanted_done > 0:
+            first_byte = time.monotonic() - start
+        if status.is_seeding:
+            break
+        time.sleep(0.05)
+    elapsed = time.monotonic() - start
+    status = handle.status()
+    done = status.total_wanted_done
+    session.remove_torrent(handle)
+    shutil.rmtree(save_path, ignore_errors=True)
+    return {
+        "completed": status.is_seeding,
+        "seconds": round(elapsed, 2),
+        "mb_per_sec": round(done / elapsed / 2 ** 20, 1),
+        "first_byte_sec": round(first_byte, 2) if first_byte is not None else None,
+        "peak_peers": peak_peers,
+    }
+
+
+def run(args):
+    root = args.root
+    tracker = Tracker().start()
+    torrent_info = make_torrent(root, args.size_mb * 2 ** 20, args.piece_kb * 1024, args.files, [tracker.url])
+    seeders = start_seeders(root, torrent_info, args.seeders)
+    wait_for(lambda: len(next(iter(tracker.peers.values()), ())) >= args.seeders, 10)
+
+    results = {}
+    try:
+        for profile in args.profiles:
+            runs = [download_once(root, torrent_info, profile, args.timeout) for _ in range(args.repeat)]
+            best = max(runs, key=lambda r: r["mb_per_sec"])
+            results[profile] = {**best, "runs_mb_per_sec": [r["mb_per_sec"] for r in runs]}
+    finally:
+        for session, handle in seeders:
+            session.remove_torrent(handle)
+        tracker.stop()
+
+    print(json.dumps({
+        "size_mb": args.size_mb,
+        "piece_kb": args.piece_kb,
+        "files": args.files,
+        "seeders": args.seeders,
+        "cpus": os.cpu_count(),
+        "profiles": results,
+    }, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download a torrent from a loopback tracker + seeder swarm with each session profile.")
+    parser.add_argument("--root", default="/tmp/torrent-bench", help="working directory for seed data and downloads")
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--piece-kb", type=int, default=1024)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--seeders", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import time
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dler import DownloadManager
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+async def fast_client(uri, stop):
+    async with websockets.connect(uri, max_size=None) as ws:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(ws.recv(), 1)
+            except asyncio.TimeoutError:
+                continue
+
+
+async def slow_client(uri, port, rcvbuf, slow_ports, stop):
+    """握手后不再读取，模拟卡住的浏览器
+
+    回环连接的缓冲区会自动增长到几 MB，能吞下整个测试的数据，驱逐与否就取决于内核参数。
+    所以连接前把接收缓冲区设小，并记下本地端口，服务端据此把这条连接的发送缓冲区也设小；
+    握手后暂停读取 transport，客户端一个字节都不再读。
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", port))
+    slow_ports.add(sock.getsockname()[1])
+    try:
+        async with websockets.connect(uri, sock=sock, max_size=None, max_queue=1) as ws:
+            ws.transport.pause_reading()
+            await stop.wait()
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def run(args):
+    manager = DownloadManager(send_timeout=args.send_timeout)
+    files = [
+        {"index": i, "path": f"bench/file_{i:05d}.mxf", "size": 10 ** 9, "downloaded": 0,
+         "speed": 0, "progress": 0, "state": "downloading"}
+        for i in range(args.files)
+    ]
+    manager.update_status(files, 0, 0)
+
+    slow_ports = set()
+
+    async def handler(websocket, *_):
+        if websocket.remote_address[1] in slow_ports:
+            sock = websocket.transport.get_extra_info("socket")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, args.slow_rcvbuf)
+        await manager.register(websocket)
+        try:
+            async for message in websocket:
+                await manager.handle_message(websocket, message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            await manager.unregister(websocket)
+
+    server = await websockets.serve(handler, "127.0.0.1", 0, max_size=None)
+    port = server.sockets[0].getsockname()[1]
+    uri = f"ws://127.0.0.1:{port}"
+
+    stop = asyncio.Event()
+    clients = [asyncio.create_task(slow_client(uri, port, args.slow_rcvbuf, slow_ports, stop)) for _ in range(args.slow)]
+    clients += [asyncio.create_task(fast_client(uri, stop)) for _ in range(args.clients - args.slow)]
+    await asyncio.sleep(1)
+
+    samples = []
+    for tick in range(args.ticks):
+        changed = random.sample(range(args.files), min(args.changed, args.files))
+        for i in changed:
+            files[i]["downloaded"] += 1024 * 1024
+            files[i]["speed"] = random.randint(1, 10 ** 7)
+            files[i]["progress"] = files[i]["downloaded"] / files[i]["size"] * 100
+        manager.update_status(files, tick % 50, tick / args.ticks * 100, changed)
+        await asyncio.sleep(args.interval)
+        samples.append(rss_bytes())
+
+    metrics = manager.get_metrics()
+    stop.set()
+    await asyncio.gather(*clients, return_exceptions=True)
+    server.close()
+
+    warm = samples[len(samples) // 4]
+    result = {
+        "connected": args.clients,
+        "slow_clients": args.slow,
+        "ticks": args.ticks,
+        "rss_start_mb": round(warm / 2 ** 20, 1),
+        "rss_end_mb": round(samples[-1] / 2 ** 20, 1),
+        "rss_peak_mb": round(max(samples) / 2 ** 20, 1),
+        **metrics,
+    }
+    print(json.dumps(result, indent=2))
+
+    # 卡住的客户端都应该被断开，断开后它们的待发送消息被释放，内存不再增长
+    errors = []
+    if metrics["evicted"] != args.slow:
+        errors.append(f"evicted {metrics['evicted']} of {args.slow} stalled clients")
+    growth = (samples[-1] - warm) / 2 ** 20
+    if growth > args.max_rss_growth_mb:
+        errors.append(f"RSS grew by {growth:.1f} MB after warm-up (limit {args.max_rss_growth_mb} MB)")
+    for error in errors:
+        print(f"FAIL: {error}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Broadcast load test with fast and stalled websocket clients.")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--slow", type=int, default=30, help="number of clients that never read")
+    parser.add_argument("--slow-rcvbuf", type=int, default=4096,
+                        help="socket buffer of the stalled connections in bytes, on both ends")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--changed", type=int, default=500, help="files changed per tick")
+    parser.add_argument("--ticks", type=int, default=120)
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between ticks")
+    parser.add_argument("--send-timeout", type=float, default=2)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=32,
+                        help="fail if RSS grows more than this after the first quarter of the ticks")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from huggingface_hub import CommitOperationAdd
+from retry import Retrier
+
+MANIFEST_NAME = "manifest.json"
+
+
+class ChunkedUploader:
+    """大文件分块上传，中断后从已提交的分块继续
+
+    超过 part_size 的文件切成若干分块，作为仓库中 <path_in_repo>.parts/part_NNNNN 上传：
+    分块由 workers 个线程并行读取并 preupload，每攒够 parts_per_commit 个提交一次，失败的
+    分块单独重试。LFS 分块 preupload 后就释放数据，提交只需要 sha256 和大小；内存中最多
+    workers * 2 个分块的数据（正在读取、上传的，加上要随提交发送内容的小分块）。
+
+    每次提交都带上 manifest.json（已提交分块的 sha256），本地也保存一份，重新运行时先读
+    本地、再读仓库中的 manifest，跳过已提交的分块。用 join_parts 还原文件。
+    """
+
+    def __init__(self, api, repo_id, repo_type, part_size=256 * 1024 * 1024, workers=4,
+                 parts_per_commit=8, retries=5, backoff=2, manifest_folder=".uploads", retrier=None):
+        self.api = api
+        self.repo_id = repo_id
+        self.repo_type = repo_type
+        self.part_size = part_size
+        self.workers = workers
+        self.parts_per_commit = parts_per_commit
+        self.manifest_folder = manifest_folder
+        self.retrier = retrier or Retrier(retries, base=backoff)
+
+        self.parts_uploaded = 0
+        self.parts_skipped = 0
+        self.commits = 0
+
+    @property
+    def part_retries(self):
+        return self.retrier.retried
+
+    def with_retries(self, description, func, *args, **kwargs):
+        """失败时指数退避（带抖动、遵守 Retry-After）后重试"""
+        return self.retrier.call(func, *args, description=description, **kwargs)
+
+    def upload_file(self, local_path, path_in_repo):
+        """上传一个文件，小于 part_size 时整个上传；返回分块数（整个上传时为 0）"""
+        size = os.path.getsize(local_path)
+        if size <= self.part_size:
+            self.with_retries(f"Uploading {path_in_repo}", self.api.upload_file,
+                              path_or_fileobj=local_path, path_in_repo=path_in_repo,
+                              repo_id=self.repo_id, repo_type=self.repo_type)
+            return 0
+
+        num_parts = (size + self.part_size - 1) // self.part_size
+        manifest = self.load_manifest(local_path, path_in_repo, size)
+        committed = manifest["parts"]
+        todo = [i for i in range(num_parts) if str(i) not in committed]
+        self.parts_skipped += num_parts - len(todo)
+        if len(todo) < num_parts:
+            print(f"Resuming {path_in_repo}: {num_parts - len(todo)}/{num_parts} parts already uploaded")
+
+        pending = []  # 已 preupload、尚未提交的 [(序号, CommitOperationAdd, sha256)]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="PartUpload") as executor:
+            running = set()
+            queue = iter(todo)
+            while True:
+                # 持有数据的分块（正在读取、上传的，加上 pending 中还没释放数据的）不超过 workers * 2 个
+                held = sum(1 for _, operation, _ in pending if operation.path_or_fileobj)
+                while len(running) + held < self.workers * 2:
+                    part = next(queue, None)
+                    if part is None:
+                        break
+                    running.add(executor.submit(self.upload_part, local_path, path_in_repo, part))
+                if not running and not pending:
+                    break
+                if running:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.append(future.result())
+                # 没有在上传的分块时（全部上传完，或者 pending 占满了内存配额）先提交
+                if len(pending) >= self.parts_per_commit or (not running and pending):
+                    self.commit_parts(path_in_repo, manifest, pending)
+                    pending = []
+
+        manifest["complete"] = True
+        self.commit_parts(path_in_repo, manifest, [])
+        self.remove_local_manifest(path_in_repo)
+        return num_parts
+
+    def upload_part(self, local_path, path_in_repo, part):
+        with open(local_path, 'rb') as f:
+            data = os.pread(f.fileno(), self.part_size, part * self.part_size)
+        operation = CommitOperationAdd(path_in_repo=self.part_path(path_in_repo, part), path_or_fileobj=data)
+        sha256 = operation.upload_info.sha256.hex()
+        # free_memory：LFS 分块上传后把 path_or_fileobj 换成 b""；服务器要求 regular 方式的小分块
+        # 在提交时发送内容，保留数据
+        self.with_retries(f"Uploading part {part} of {path_in_repo}", self.api.preupload_lfs_files,
+                          self.repo_id, additions=[operation], repo_type=self.repo_type, free_memory=True)
+        self.parts_uploaded += 1
+        return part, operation, sha256
+
+    def commit_parts(self, path_in_repo, manifest, uploaded):
+        """提交一批分块和更新后的 manifest；manifest 只在提交成功后记下这些分块"""
+        parts = dict(manifest["parts"])
+        parts.update((str(part), sha256) for part, _, sha256 in uploaded)
+        updated = {**manifest, "parts": parts}
+        operations = [operation for _, operation, _ in uploaded]
+        operations.append(CommitOperationAdd(
+            path_in_repo=self.part_path(path_in_repo, MANIFEST_NAME),
+            path_or_fileobj=json.dumps(updated, sort_keys=True).encode()
+        ))
+        self.with_retries(f"Committing {len(uploaded)} parts of {path_in_repo}", self.api.create_commit,
+                          repo_id=self.repo_id, repo_type=self.repo_type, operations=operations,
+                          commit_message=f"Upload {len(uploaded)} parts of {path_in_repo}")
+        self.commits += 1
+        manifest["parts"] = parts
+        self.save_local_manifest(path_in_repo, manifest)
+
+    @staticmethod
+    def part_path(path_in_repo, part):
+        name = part if isinstance(part, str) else f"part_{part:05d}"
+        return f"{path_in_repo}.parts/{name}"
+
+    def local_manifest_path(self, path_in_repo):
+        return os.path.join(self.manifest_folder, hashlib.sha1(path_in_repo.encode()).hexdigest() + ".json")
+
+    def load_manifest(self, local_path, path_in_repo, size):
+        """本地或仓库中与当前文件大小、分块大小一致的 manifest，都没有时新建"""
+        for manifest in (self.read_local_manifest(path_in_repo), self.read_hub_manifest(path_in_repo)):
+            if (manifest and manifest.get("size") == size and manifest.get("part_size") == self.part_size
+                    and self.matches_local(local_path, manifest)):
+                return manifest
+        return {"path": path_in_repo, "size": size, "part_size": self.part_size, "parts": {}, "complete": False}
+
+    def matches_local(self, local_path, manifest):
+        """抽查第一个已提交的分块，避免同名同大小的另一个文件沿用旧的 manifest"""
+        if not manifest["parts"]:
+            return True
+        part = min(manifest["parts"], key=int)
+        with open(local_path, 'rb') as f:
+            data = os.pread(f.fileno(), self.part_size, int(part) * self.part_size)
+        return hashlib.sha256(data).hexdigest() == manifest["parts"][part]
+
+    def read_local_manifest(self, path_in_repo):
+        try:
+            with open(self.local_manifest_path(path_in_repo)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read_hub_manifest(self, path_in_repo):
+        try:
+            path = self.api.hf_hub_download(repo_id=self.repo_id, repo_type=self.repo_type,
+                                            filename=self.part_path(path_in_repo, MANIFEST_NAME))
+            with open(path) as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def save_local_manifest(self, path_in_repo, manifest):
+        os.makedirs(self.manifest_folder, exist_ok=True)
+        path = self.local_manifest_path(path_in_repo)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def remove_local_manifest(self, path_in_repo):
+        try:
+            os.remove(self.local_manifest_path(path_in_repo))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {
+            "parts_uploaded": self.parts_uploaded,
+            "parts_skipped": self.parts_skipped,
+            "part_retries": self.part_retries,
+            "commits": self.commits,
+            "retry": self.retrier.stats(),
+        }
+
+
+def join_parts(parts_folder, output_file):
+    """按 manifest.json 把下载下来的 <文件>.parts 目录还原成原文件，并校验每个分块的 sha256"""
+    with open(os.path.join(parts_folder, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if not manifest.get("complete"):
+        raise ValueError(f"Upload of {manifest['path']} is not complete")
+    num_parts = (manifest["size"] + manifest["part_size"] - 1) // manifest["part_size"]
+    with open(output_file, 'wb') as out:
+        for part in range(num_parts):
+            with open(os.path.join(parts_folder, f"part_{part:05d}"), 'rb') as f:
+                data = f.read()
+            if hashlib.sha256(data).hexdigest() != manifest["parts"][str(part)]:
+                raise ValueError(f"Part {part} does not match the manifest")
+            out.write(data)
+    return manifest["size"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reassemble a file uploaded in parts by ChunkedUploader.")
+    parser.add_argument("parts_folder", help="downloaded <file>.parts folder containing manifest.json")
+    parser.add_argument("output_file")
+    args = parser.parse_args()
+    size = join_parts(args.parts_folder, args.output_file)
+    print(f"Wrote {size} bytes to {args.output_file}")
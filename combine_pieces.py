@@ -1,19 +1,297 @@
 import os
+import re
+import bisect
+import struct
+import zipfile
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from piece_pack import LocalSource, HubSource, PackReader
+
+PIECE_NAME = re.compile(r'piece_(\d+)(?:\.dat)?$')
+COPY_CHUNK = 16 * 1024 * 1024
+
+
+class PieceSource:
+    """piece 的来源：单独的 piece_N.dat 文件、zip 压缩包中的一个条目，或 pack 中的一段"""
+
+    def __init__(self, index, path, size, member=None, compressed=False, reader=None):
+        self.index = index
+        self.path = path
+        self.size = size
+        self.member = member
+        self.compressed = compressed
+        self.reader = reader  # Hub 上的 pack 由 PackReader 按区间下载
+        self.data_offset = 0  # 未压缩的 zip 条目或本地 pack 中数据的偏移，可直接按区间复制
+
+
+def zip_data_offset(zf, info):
+    """根据本地文件头计算条目数据的起始位置"""
+    zf.fp.seek(info.header_offset)
+    header = zf.fp.read(30)
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def scan_pieces(pieces_folder):
+    """扫描目录中的 piece 文件和压缩包，返回 {piece_index: PieceSource}"""
+    sources = {}
+    for name in os.listdir(pieces_folder):
+        path = os.path.join(pieces_folder, name)
+        match = PIECE_NAME.match(name)
+        if match:
+            index = int(match.group(1))
+            sources[index] = PieceSource(index, path, os.path.getsize(path))
+        elif name.endswith('.zip'):
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    match = PIECE_NAME.match(os.path.basename(info.filename))
+                    if not match:
+                        continue
+                    index = int(match.group(1))
+                    source = PieceSource(index, path, info.file_size, info.filename,
+                                         info.compress_type != zipfile.ZIP_STORED)
+                    if not source.compressed:
+                        source.data_offset = zip_data_offset(zf, info)
+                    sources[index] = source
+        elif name.endswith('.pack'):
+            for index, (offset, length, _) in PackReader(LocalSource(path)).entries.items():
+                source = PieceSource(index, path, length)
+                source.data_offset = offset
+                sources[index] = source
+    return sources
+
+
+def scan_hub_packs(api, repo_id, repo_type, folder="pieces", skip=()):
+    """读取仓库 folder 目录下所有 pack 的索引，返回 ({piece_index: PieceSource}, [HubSource])
+
+    每个 pack 只请求文件末尾一次（索引很大时两次）；skip 中的 piece 本地已有，不会下载。
+    """
+    sources = {}
+    hub_sources = []
+    for path in api.list_repo_files(repo_id, repo_type=repo_type):
+        if not (path.startswith(folder.rstrip('/') + '/') and path.endswith('.pack')):
+            continue
+        hub_source = HubSource(api, repo_id, repo_type, path)
+        reader = PackReader(hub_source)
+        hub_sources.append(hub_source)
+        for index, (offset, length, _) in reader.entries.items():
+            if index not in skip:
+                sources[index] = PieceSource(index, path, length, reader=reader)
+    return sources, hub_sources
+
+
+class FileLayout:
+    """torrent 中各文件在整体字节流中的位置，用来把 piece 切分到对应文件"""
+
+    def __init__(self, piece_length, files):
+        self.piece_length = piece_length
+        self.files = files  # [(相对路径, 起始偏移, 大小, 是否为填充文件)]
+        self.offsets = [offset for _, offset, _, _ in files]
+
+    @classmethod
+    def from_torrent(cls, torrent_file):
+        """torrent_file 可以是 .torrent 文件路径或 lt.torrent_info"""
+        import libtorrent as lt
+        info = torrent_file if isinstance(torrent_file, lt.torrent_info) else lt.torrent_info(torrent_file)
+        storage = info.files()
+        files = [
+            (storage.file_path(i), storage.file_offset(i), storage.file_size(i),
+             bool(storage.file_flags(i) & lt.file_storage.flag_pad_file))
+            for i in range(storage.num_files())
+        ]
+        return cls(info.piece_length(), files)
+
+    @classmethod
+    def single_file(cls, output_file, sources):
+        """没有 torrent 信息时按 piece 大小推算，输出为一个完整的文件"""
+        piece_length = max(source.size for source in sources.values())
+        last = max(sources)
+        total_size = last * piece_length + sources[last].size
+        return cls(piece_length, [(output_file, 0, total_size, False)])
+
+    @property
+    def total_size(self):
+        _, offset, size, _ = self.files[-1]
+        return offset + size
+
+    def segments(self, piece_index, piece_size):
+        """返回 [(文件下标, 文件内偏移, piece 内偏移, 长度)]"""
+        start = piece_index * self.piece_length
+        end = start + piece_size
+        result = []
+        i = bisect.bisect_right(self.offsets, start) - 1
+        while i < len(self.files) and start < end:
+            _, offset, size, pad = self.files[i]
+            file_end = offset + size
+            if start < file_end:
+                length = min(end, file_end) - start
+                if not pad:
+                    result.append((i, start - offset, start - piece_index * self.piece_length, length))
+                start += length
+            i += 1
+        return result
+
+
+class PieceAssembler:
+    """多线程把 piece 按偏移写入目标文件
+
+    单独的 piece 文件和未压缩的 zip 条目用 copy_file_range 在内核中复制，
+    压缩的 zip 条目解压后用 pwrite 写入；不需要按顺序处理，也不会整体读入内存。
+    """
+
+    def __init__(self, layout, output_dir, workers=None):
+        self.layout = layout
+        self.output_dir = output_dir
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 2)
+        self.fds = []
+        self.local = threading.local()  # 每个线程各自打开的压缩包 {path: ZipFile}
+        self.opened_archives = []
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    def open_outputs(self):
+        for path, _, size, pad in self.layout.files:
+            if pad:
+                self.fds.append(None)
+                continue
+            full_path = os.path.join(self.output_dir, path)
+            os.makedirs(os.path.dirname(full_path) or '.', exist_ok=True)
+            fd = os.open(full_path, os.O_WRONLY | os.O_CREAT, 0o644)
+            os.ftruncate(fd, size)
+            self.fds.append(fd)
+
+    def close_outputs(self):
+        for fd in self.fds:
+            if fd is not None:
+                os.close(fd)
+        self.fds = []
+        for zf in self.opened_archives:
+            zf.close()
+        self.opened_archives = []
+
+    def write_piece(self, source):
+        segments = self.layout.segments(source.index, source.size)
+        if source.reader is not None:
+            view = memoryview(source.reader.read_piece(source.index))
+            for file_index, file_offset, piece_offset, length in segments:
+                write_all(self.fds[file_index], view[piece_offset:piece_offset + length], file_offset)
+        elif source.member is None or not source.compressed:
+            src_fd = os.open(source.path, os.O_RDONLY)
+            try:
+                for file_index, file_offset, piece_offset, length in segments:
+                    copy_range(src_fd, self.fds[file_index], source.data_offset + piece_offset, file_offset, length)
+            finally:
+                os.close(src_fd)
+        else:
+            data = self.read_member(source)
+            view = memoryview(data)
+            for file_index, file_offset, piece_offset, length in segments:
+                write_all(self.fds[file_index], view[piece_offset:piece_offset + length], file_offset)
+        with self.lock:
+            self.bytes_written += sum(length for _, _, _, length in segments)
+
+    def read_member(self, source):
+        archives = getattr(self.local, 'archives', None)
+        if archives is None:
+            archives = self.local.archives = {}
+        zf = archives.get(source.path)
+        if zf is None:
+            zf = archives[source.path] = zipfile.ZipFile(source.path)
+            with self.lock:
+                self.opened_archives.append(zf)
+        return zf.read(source.member)
+
+    def run(self, sources):
+        self.open_outputs()
+        try:
+            with ThreadPoolExecutor(self.workers) as pool:
+                # 按所在文件分组，让同一个压缩包尽量由同一批线程顺序读取
+                ordered = sorted(sources.values(), key=lambda s: (s.path, s.data_offset))
+                for future in [pool.submit(self.write_piece, source) for source in ordered]:
+                    future.result()
+        finally:
+            self.close_outputs()
+
+
+def copy_range(src_fd, dst_fd, src_offset, dst_offset, length):
+    """内核内复制一段数据，不支持 copy_file_range 时退回 pread + pwrite"""
+    while length > 0:
+        chunk = min(length, COPY_CHUNK)
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                copied = os.copy_file_range(src_fd, dst_fd, chunk, src_offset, dst_offset)
+            except OSError:
+                copied = 0
+        if copied == 0:
+            data = os.pread(src_fd, chunk, src_offset)
+            if not data:
+                raise EOFError(f"Unexpected end of piece data at offset {src_offset}")
+            copied = write_all(dst_fd, data, dst_offset)
+        src_offset += copied
+        dst_offset += copied
+        length -= copied
+
+
+def write_all(fd, data, offset):
+    written = 0
+    while written < len(data):
+        written += os.pwrite(fd, data[written:], offset + written)
+    return written
+
+
+def combine_pieces(pieces_folder, output, torrent_file=None, workers=None, api=None, repo_id=None,
+                   repo_type="dataset", repo_folder="pieces"):
+    """把 piece 还原为原始文件
+
+    提供 torrent_file 时 output 为输出目录，按 torrent 的文件表还原目录结构；
+    否则 output 为单个输出文件。提供 repo_id 时本地没有的 piece 从仓库 repo_folder
+    目录下的 pack 中按区间下载，不用下载整个 pack。
+    """
+    sources = scan_pieces(pieces_folder) if pieces_folder and os.path.isdir(pieces_folder) else {}
+    hub_sources = []
+    if repo_id:
+        if api is None:
+            from huggingface_hub import HfApi
+            api = HfApi()
+        remote, hub_sources = scan_hub_packs(api, repo_id, repo_type, repo_folder, skip=sources)
+        sources.update(remote)
+    if not sources:
+        print(f"No pieces found in {pieces_folder or repo_id}.")
+        return
+
+    if torrent_file:
+        layout = FileLayout.from_torrent(torrent_file)
+        output_dir = output
+    else:
+        layout = FileLayout.single_file(os.path.basename(output), sources)
+        output_dir = os.path.dirname(output)
+
+    num_pieces = (layout.total_size + layout.piece_length - 1) // layout.piece_length
+    missing = [i for i in range(num_pieces) if i not in sources]
+    if missing:
+        print(f"Warning: {len(missing)} pieces missing, first missing piece: {missing[0]}")
+
+    assembler = PieceAssembler(layout, output_dir, workers)
+    assembler.run(sources)
+    print(f"Combined {len(sources)} pieces ({assembler.bytes_written} bytes) into {output}.")
+    if hub_sources:
+        print(f"Fetched {sum(h.bytes_fetched for h in hub_sources)} bytes from {len(hub_sources)} packs "
+              f"in {sum(h.requests for h in hub_sources)} range requests.")
+    return assembler.bytes_written
 
-def combine_pieces(pieces_folder, output_file):
-    piece_files = sorted(os.listdir(pieces_folder), key=lambda x: int(x.split('_')[1].split('.')[0]))
-    with open(output_file, "wb") as outfile:
-        for piece_file in piece_files:
-            piece_path = os.path.join(pieces_folder, piece_file)
-            with open(piece_path, "rb") as infile:
-                outfile.write(infile.read())
-            print(f"Piece {piece_file} added to {output_file}.")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Combine pieces into a complete file.")
-    parser.add_argument("pieces_folder", help="Folder containing the piece files.")
-    parser.add_argument("output_file", help="Output file path.")
+    parser = argparse.ArgumentParser(description="Combine pieces into the original files.")
+    parser.add_argument("pieces_folder", help="Folder containing piece_N.dat files, piece archives (.zip) and/or piece packs (.pack).")
+    parser.add_argument("output", help="Output file path, or output directory when --torrent is given.")
+    parser.add_argument("--torrent", help=".torrent file used to restore the original file tree.")
+    parser.add_argument("--workers", type=int, help="Number of writer threads.")
+    parser.add_argument("--repo", help="Fetch pieces missing from pieces_folder out of the .pack files in this Hub repo.")
+    parser.add_argument("--repo-type", default="dataset")
+    parser.add_argument("--repo-folder", default="pieces", help="Folder of the packs inside the repo.")
     args = parser.parse_args()
 
-    combine_pieces(args.pieces_folder, args.output_file)
\ No newline at end of file
+    combine_pieces(args.pieces_folder, args.output, args.torrent, args.workers,
+                   repo_id=args.repo, repo_type=args.repo_type, repo_folder=args.repo_folder)
@@ -8,8 +8,18 @@ from rich.console import Console
 from rich.progress import Progress
 from rich.tree import Tree
 import websockets
-import shutil
 from downloader import download_manager
+from alerts import AlertDispatcher
+from pipeline import PiecePipeline
+from uploader import HubBatchUploader
+from retry import Retrier, DeadLetterQueue
+from piece_store import PieceStore
+from progress_model import ProgressModel
+from fast_resume import FastResume
+from metadata_cache import MetadataCache
+from session_profiles import apply_profile
+from status_cache import StatusCache
+from io_executor import io_executor, loop_monitor
 
 class TorrentDownloader:
     def __init__(self, magnet_link, save_path, huggingface_token):
@@ -21,27 +31,49 @@ class TorrentDownloader:
         self.REPO_NAME = 'mp4-dataset'
         self.REPO_TYPE = 'dataset'
         self.session = lt.session()
+        self.SESSION_PROFILE = apply_profile(self.session)
+        # alert_mask 由 AlertDispatcher 按订阅的 alert 类型设置
+        self.alerts = AlertDispatcher(self.session)
+        self.status_cache = StatusCache(self.session, self.alerts)
         self.handle = None
+        self.pipeline = None
+        self.progress_model = None
+        self.batcher = None
+        self.pending_uploads = {}  # {path_in_repo: piece_index}
+        self.COMMIT_BATCH_SIZE = 100  # 每次 commit 包含的 piece 数量
+        self.COMMIT_INTERVAL = 60  # 最长 60 秒提交一次
         self.progress = Progress()
         self.console = Console()
-        self.progress_file = "progress.json"
         self.pieces_folder = os.path.join(save_path, "pieces")
-        os.makedirs(self.pieces_folder, exist_ok=True)
-
-    def load_progress(self):
-        if os.path.exists(self.progress_file):
-            with open(self.progress_file, "r") as f:
-                return json.load(f)
-        return {}
-
-    def save_progress(self, progress):
-        with open(self.progress_file, "w") as f:
-            json.dump(progress, f)
+        self.piece_store = PieceStore(self.pieces_folder)
+        self.retrier = Retrier()
+        # 重试用尽后仍失败的 piece，下载结束前再上传一次
+        self.dead_letters = DeadLetterQueue(os.path.join(save_path, "failed_pieces.json"))
+        self.RESUME_INTERVAL = 60  # 每 60 秒检查一次是否需要保存 resume 数据
+        self.RESUME_SYNC_INTERVAL = 15 * 60  # 每 15 分钟同步一次到 Hub
+        self.fast_resume = FastResume(
+            self.alerts,
+            os.path.join(save_path, "torrent.fastresume"),
+            self.api,
+            f'{self.USERNAME}/{self.REPO_NAME}',
+            self.REPO_TYPE,
+            path_in_repo="resume/torrent.fastresume",
+            interval=self.RESUME_INTERVAL,
+            sync_interval=self.RESUME_SYNC_INTERVAL,
+        )
+        self.metadata_cache = MetadataCache(
+            os.path.join(save_path, "metadata"),
+            self.api,
+            f'{self.USERNAME}/{self.REPO_NAME}',
+            self.REPO_TYPE,
+        )
 
     async def ensure_repo_exists(self):
         """确保仓库存在，如果不存在则创建"""
         try:
-            repo_url = self.api.create_repo(
+            repo_url = await io_executor.run(
+                "hub",
+                self.api.create_repo,
                 repo_id=f"{self.USERNAME}/{self.REPO_NAME}",
                 repo_type=self.REPO_TYPE,
                 private=False
@@ -52,124 +84,201 @@ class TorrentDownloader:
             self.console.print(f'[red]have with repository already: {str(e)}')
             return f"https://huggingface.co/{self.USERNAME}/{self.REPO_NAME}"
 
-    async def handle_piece_finished(self, alert, websocket):
-        piece_index = alert.piece_index
-        piece_length = self.handle.get_torrent_info().piece_length()
-        piece_data = bytearray(piece_length)
-        self.handle.read_piece(piece_index)
+    async def upload_piece(self, piece_index, piece_data):
+        """把 piece 数据交给批量上传，由流水线调用；只有超出内存预算时才落盘"""
+        path_in_repo = f"pieces/piece_{piece_index}.dat"
+        self.pending_uploads[path_in_repo] = piece_index
+        await self.batcher.add(path_in_repo, await self.piece_store.put_async(path_in_repo, piece_data))
+
+    async def retry_dead_letters(self):
+        """下载结束前把提交失败的 piece 重新交给流水线（包括上次运行留下的）"""
+        await self.batcher.flush()
+        pieces = [piece for piece in self.dead_letters if self.handle.have_piece(piece)]
+        if not pieces:
+            return
+        self.console.print(f'[yellow]Retrying {len(pieces)} pieces that failed to upload...')
+        for piece_index in pieces:
+            self.pipeline.submit(piece_index)
+        await self.pipeline.join()
+        await self.batcher.flush()
+        if self.dead_letters:
+            self.console.print(f'[red]{len(self.dead_letters)} pieces could not be uploaded, '
+                               f'listed in {self.dead_letters.path}')
+
+    async def handle_piece_finished(self, alert):
+        # 只把 piece 交给流水线，读取和上传都不阻塞 alert 处理
+        self.pipeline.submit(alert.piece_index)
 
+    async def process_finished_pieces(self, finished_pieces):
+        """按到达顺序处理 piece_finished_alert，不丢弃任何一个"""
         while True:
-            alerts = self.session.pop_alerts()
-            for alert in alerts:
-                if isinstance(alert, lt.read_piece_alert):
-                    if alert.piece == piece_index:
-                        piece_data = alert.buffer
-                        backup_path = os.path.join(self.pieces_folder, f"piece_{piece_index}.dat")
-                        with open(backup_path, "wb") as f:
-                            f.write(piece_data)
-                        try:
-                            self.api.upload_file(
-                                path_or_fileobj=backup_path,
-                                path_in_repo=f"pieces/piece_{piece_index}.dat",
-                                repo_id=f'{self.USERNAME}/{self.REPO_NAME}',
-                                repo_type=self.REPO_TYPE
-                            )
-                            os.remove(backup_path)
-                            await websocket.send(json.dumps({"piece_index": piece_index, "status": "backed_up"}))
-                        except Exception as e:
-                            self.console.print(f'[red]Error uploading piece {piece_index}: {str(e)}')
-                        return
-            await asyncio.sleep(0.1)
+            alert = await finished_pieces.get()
+            try:
+                await self.handle_piece_finished(alert)
+            except Exception as e:
+                self.console.print(f'[red]Error handling piece {alert.piece_index}: {str(e)}')
+            finally:
+                finished_pieces.task_done()
+
+    async def wait_for_status(self, condition, interval=0.1):
+        """等待 torrent 状态满足条件，返回当时的状态快照"""
+        while True:
+            await self.status_cache.refresh()
+            status = self.status_cache.get(self.handle)
+            if condition(status):
+                return status
+            await asyncio.sleep(interval)
+
+    def create_pipeline(self, websocket):
+        async def on_committed(paths):
+            for path in paths:
+                piece_index = self.pending_uploads.pop(path)
+                await self.piece_store.pop_async(path)
+                await self.dead_letters.discard_async([piece_index])
+                try:
+                    await websocket.send(json.dumps({"piece_index": piece_index, "status": "backed_up"}))
+                except websockets.ConnectionClosed:
+                    pass
+
+        async def on_commit_failed(paths, error):
+            self.console.print(f'[red]Error committing {len(paths)} pieces: {str(error)}')
+            await self.dead_letters.add_async([self.pending_uploads.pop(path) for path in paths], error)
+            for path in paths:
+                await self.piece_store.pop_async(path)
+
+        async def on_failed(piece_index, error):
+            self.console.print(f'[red]Error uploading piece {piece_index}: {str(error)}')
+            await self.dead_letters.add_async([piece_index], error)
+
+        self.batcher = HubBatchUploader(
+            self.api,
+            f'{self.USERNAME}/{self.REPO_NAME}',
+            self.REPO_TYPE,
+            batch_size=self.COMMIT_BATCH_SIZE,
+            flush_interval=self.COMMIT_INTERVAL,
+            on_committed=on_committed,
+            on_failed=on_commit_failed,
+            retrier=self.retrier,
+        )
+        return PiecePipeline(
+            self.handle,
+            self.alerts,
+            self.upload_piece,
+            self.handle.get_torrent_info().piece_length(),
+            on_failed=on_failed,
+        )
 
     async def start(self):
         try:
+            # 测量事件循环被阻塞的时间，阻塞调用都应经过 io_executor
+            loop_monitor.start()
             self.console.print(f'Your username is: {self.USERNAME}')
-            login(token=self.huggingface_token)
+            await io_executor.run("hub", login, token=self.huggingface_token)
 
             # 确保仓库存在
             repo_url = await self.ensure_repo_exists()
 
-            params = {
-                'save_path': self.save_path,
-                'storage_mode': lt.storage_mode_t.storage_mode_sparse,
-            }
+            restart_time = time.monotonic()
+            self.alerts.start()
+            finished_pieces = self.alerts.subscribe(lt.piece_finished_alert)
 
-            # Load previous progress if available
-            progress_data = self.load_progress()
-            if progress_data:
-                try:
-                    self.session.load_state(progress_data.get("session_state", b""))
-                    self.handle = lt.add_magnet_uri(self.session, self.magnet_link, params)
-                    self.handle.set_sequential_download(1)
-                except Exception as e:
-                    self.console.print(f'[yellow]Warning: Could not load previous state: {str(e)}')
-                    self.handle = lt.add_magnet_uri(self.session, self.magnet_link, params)
-                    self.handle.set_sequential_download(1)
+            # 有 resume 数据时直接添加，metadata 和已下载的 piece 都不需要重新获取和校验
+            params = await io_executor.run("hub", self.fast_resume.load, self.magnet_link)
+            resumed = params is not None
+            if resumed:
+                self.console.print('Resuming from fast-resume data...')
             else:
-                self.handle = lt.add_magnet_uri(self.session, self.magnet_link, params)
-                self.handle.set_sequential_download(1)
-
+                params = await io_executor.run("hub", self.metadata_cache.add_params, self.magnet_link)
+            params.save_path = self.save_path
+            params.storage_mode = lt.storage_mode_t.storage_mode_sparse
+            self.handle = self.session.add_torrent(params)
+            self.handle.set_sequential_download(1)
             self.session.start_dht()
 
             self.console.print('Downloading Metadata...')
-            while not self.handle.has_metadata():
-                await asyncio.sleep(1)
-            
+            await self.wait_for_status(lambda status: status.has_metadata)
+            metadata_time = time.monotonic() - restart_time
+            await io_executor.run("hub", self.metadata_cache.put, self.handle.torrent_file())
+
+            status = await self.wait_for_status(lambda status: status.state in (
+                lt.torrent_status.downloading, lt.torrent_status.finished, lt.torrent_status.seeding
+            ))
+            self.console.print(
+                f'Restart to downloading: {time.monotonic() - restart_time:.2f}s '
+                f'(metadata after {metadata_time:.2f}s, '
+                f'{"fast-resume" if resumed else "magnet"}, '
+                f'{status.num_pieces} pieces already on disk)'
+            )
+            self.fast_resume.start(self.handle)
+
             self.console.print('Got Metadata, Starting Torrent Download...')
             torrent_info = self.handle.get_torrent_info()
-            
-            files = sorted([
-                {"index": i, "path": torrent_info.files().file_path(i), "size": torrent_info.files().file_size(i)}
-                for i in range(torrent_info.num_files())
-            ], key=lambda x: x["size"], reverse=True)
+            self.progress_model = ProgressModel(torrent_info)
+            model = self.progress_model
+
+            files = sorted(range(model.num_files), key=lambda i: model.sizes[i], reverse=True)
 
             tree = Tree("Files in torrent")
             tasks = {}
-            for file_info in files:
-                tasks[file_info["index"]] = self.progress.add_task(
-                    f"[green]{file_info['path']}", 
-                    total=file_info["size"]
-                )
-                tree.add(f"{file_info['path']} ({self.format_size(file_info['size'])})")
+            for i in files:
+                tasks[i] = self.progress.add_task(f"[green]{model.paths[i]}", total=model.sizes[i])
+                tree.add(f"{model.paths[i]} ({self.format_size(model.sizes[i])})")
 
             self.console.print(tree)
             download_manager.downloads = [
-                {"index": file_info["index"], "size": file_info["size"], "downloaded": 0, "speed": 0}
-                for file_info in files
+                {"index": i, "size": model.sizes[i], "downloaded": 0, "speed": 0}
+                for i in range(model.num_files)
             ]
 
             async with websockets.connect("ws://localhost:8765") as websocket:
-                last_upload_time = time.time()
+                self.pipeline = self.create_pipeline(websocket)
+                self.pipeline.start()
+                self.batcher.start()
+                piece_task = asyncio.create_task(self.process_finished_pieces(finished_pieces))
                 while True:
                     try:
-                        alerts = self.session.pop_alerts()
-                        for alert in alerts:
-                            if isinstance(alert, lt.piece_finished_alert):
-                                await self.handle_piece_finished(alert, websocket)
-                        
-                        s = self.handle.status()
-                        for file_info in files:
-                            completed = self.handle.file_progress()[file_info["index"]]
-                            self.progress.update(tasks[file_info["index"]], completed=completed)
-                            download = download_manager.downloads[file_info["index"]]
+                        # 每个 tick 只取一次状态快照
+                        await self.status_cache.refresh()
+                        s = self.status_cache.get(self.handle)
+                        # 每个 tick 只调用一次 file_progress，只处理有变化的文件
+                        changed = model.update(model.read_file_progress(self.handle))
+                        for i in changed:
+                            completed = model.downloaded[i]
+                            self.progress.update(tasks[i], completed=completed)
+                            download = download_manager.downloads[i]
                             download["downloaded"] = completed
-                            download["speed"] = s.download_rate / 1000
-                            downloaded_size = self.format_size(completed)
-                            total_size = self.format_size(file_info["size"])
+                            download["speed"] = model.files_status[i]["speed"] / 1000
                             self.console.print(
-                                f'Downloading {file_info["path"]}: {downloaded_size} / {total_size} '
+                                f'Downloading {model.paths[i]}: {self.format_size(completed)} / '
+                                f'{self.format_size(model.sizes[i])} '
                                 f'(down: {s.download_rate / 1000:.1f} kB/s)'
                             )
 
+                        stats = self.pipeline.stats()
+                        commit_stats = self.batcher.stats()
+                        self.console.print(
+                            f'Pieces read: {stats["pieces_done"]} ({stats["pieces_per_sec"]:.2f}/s), '
+                            f'backed up: {commit_stats["files_committed"]} in {commit_stats["commits"]} commits, '
+                            f'backlog: {stats["backlog"]}, buffered: {self.format_size(stats["buffered_bytes"])}, '
+                            f'staged: {self.format_size(self.piece_store.memory_used)} in memory, '
+                            f'{len(self.piece_store.spilled)} on disk'
+                            + (' [yellow](throttled)' if stats["throttled"] else '')
+                        )
+                        alert_stats = self.alerts.stats()
+                        lag = loop_monitor.stats()
+                        self.console.print(
+                            f'Alerts: {alert_stats["alerts_per_sec"]:.0f}/s, '
+                            f'pop_alerts CPU: {alert_stats["pop_cpu_ms"]} ms, '
+                            f'dispatch CPU: {alert_stats["dispatch_cpu_ms"]} ms, '
+                            f'loop lag: {lag["lag_ms"]} ms (max {lag["max_lag_ms"]} ms, '
+                            f'{lag["stall_seconds"]}s stalled)'
+                        )
+
                         message = json.dumps(download_manager.get_download_data())
                         await websocket.send(message)
-                        
-                        if time.time() - last_upload_time >= 5 * 3600:  # 每5小时
-                            await self.upload_progress()
-                            last_upload_time = time.time()
 
                         # 检查是否所有文件都下载完成
-                        if all(d["downloaded"] == d["size"] for d in download_manager.downloads):
+                        if model.total_downloaded == model.total_size:
                             self.console.print('[green]Download Complete!')
                             break
 
@@ -184,28 +293,35 @@ class TorrentDownloader:
                         await asyncio.sleep(1)  # 发生错误时短暂暂停
                         continue
 
+                # 下载完成后等待剩余的 piece 处理完
+                await finished_pieces.join()
+                await self.pipeline.join()
+                await self.retry_dead_letters()
+                piece_task.cancel()
+                await self.pipeline.stop()
+                await self.batcher.stop()
+                stats = self.pipeline.stats()
+                commit_stats = self.batcher.stats()
+                self.console.print(
+                    f'Backed up {commit_stats["files_committed"]} pieces in {commit_stats["commits"]} commits '
+                    f'at {stats["pieces_per_sec"]:.2f} pieces/s, '
+                    f'{stats["pieces_failed"] + commit_stats["files_failed"]} failed '
+                    f'({len(self.dead_letters)} still missing), '
+                    f'{self.retrier.retried} retries ({self.retrier.throttled} rate limited), '
+                    f'peak buffered {self.format_size(stats["peak_buffered_bytes"])}, '
+                    f'peak staged {self.format_size(self.piece_store.peak_memory)}, '
+                    f'{self.piece_store.spill_count} spilled to disk, '
+                    f'event loop stalled {loop_monitor.stalls} times ({loop_monitor.stall_seconds:.2f}s)'
+                )
+
         except Exception as e:
             self.console.print(f'[red]Critical error: {str(e)}')
             raise
-
-    async def upload_progress(self):
-        try:
-            session_state = self.session.save_state()
-            progress_data = {
-                "session_state": session_state
-            }
-            self.save_progress(progress_data)
-            backup_path = os.path.join(self.save_path, "progress_backup.json")
-            shutil.copyfile(self.progress_file, backup_path)
-            self.api.upload_file(
-                path_or_fileobj=backup_path,
-                path_in_repo="progress_backup.json",
-                repo_id=f'{self.USERNAME}/{self.REPO_NAME}',
-                repo_type=self.REPO_TYPE
-            )
-            os.remove(backup_path)
-        except Exception as e:
-            self.console.print(f'[red]Error uploading progress: {str(e)}')
+        finally:
+            # 退出前保存最后一次 resume 数据并同步到 Hub
+            await self.fast_resume.stop(self.handle)
+            await self.alerts.stop()
+            await loop_monitor.stop()
 
     @staticmethod
     def format_size(size):
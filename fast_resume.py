@@ -0,0 +1,144 @@
+import asyncio
+import os
+import time
+import libtorrent as lt
+from io_executor import io_executor
+
+
+class FastResume:
+    """libtorrent 原生 fast-resume 的保存与恢复
+
+    通过 save_resume_data_alert 取得 resume 数据（包含 info-dict），原子地写到本地文件，
+    并按间隔同步到 Hub。重启时用它直接添加 torrent，不必再从 DHT 获取 metadata、
+    也不必重新校验已下载的文件。
+    """
+
+    def __init__(self, alerts, resume_file, api=None, repo_id=None, repo_type=None,
+                 path_in_repo=None, interval=60, sync_interval=15 * 60, timeout=30):
+        self.alerts = alerts
+        self.resume_file = resume_file
+        self.api = api
+        self.repo_id = repo_id
+        self.repo_type = repo_type
+        self.path_in_repo = path_in_repo or f"resume/{os.path.basename(resume_file)}"
+        self.interval = interval  # 本地保存间隔（秒）
+        self.sync_interval = sync_interval  # 同步到 Hub 的间隔（秒）
+        self.timeout = timeout
+        self.last_sync = 0
+        self.checkpoints = 0
+        self.syncs = 0
+        self._task = None
+
+    def load(self, magnet_link=None):
+        """读取本地或 Hub 上的 resume 数据，返回 add_torrent_params；没有可用数据时返回 None
+
+        传入 magnet_link 时会检查 info-hash 是否一致。
+        """
+        data = self.read_local() or self.read_hub()
+        if not data:
+            return None
+        try:
+            params = lt.read_resume_data(data)
+        except Exception as e:
+            print(f"Invalid resume data: {e}")
+            return None
+        if magnet_link:
+            # btih magnet 只有 v1，hybrid torrent 的 resume 数据两种都有，只比较 magnet 中有的
+            expected = lt.parse_magnet_uri(magnet_link).info_hashes
+            if ((expected.has_v1() and params.info_hashes.v1 != expected.v1)
+                    or (expected.has_v2() and params.info_hashes.v2 != expected.v2)):
+                print("Resume data belongs to a different torrent, ignoring it")
+                return None
+        return params
+
+    def read_local(self):
+        if os.path.exists(self.resume_file):
+            with open(self.resume_file, 'rb') as f:
+                return f.read()
+        return None
+
+    def read_hub(self):
+        if not self.api:
+            return None
+        try:
+            path = self.api.hf_hub_download(repo_id=self.repo_id, repo_type=self.repo_type,
+                                            filename=self.path_in_repo)
+        except Exception as e:
+            print(f"No resume data on the Hub: {e}")
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    async def checkpoint(self, handle, flush=False, sync=False):
+        """保存一次 resume 数据，返回写入的字节数；失败时返回 None"""
+        flags = lt.torrent_handle.save_info_dict
+        if flush:
+            flags |= lt.torrent_handle.flush_disk_cache
+        result = self.alerts.wait_for(
+            (lt.save_resume_data_alert, lt.save_resume_data_failed_alert),
+            lambda a: a.handle == handle
+        )
+        handle.save_resume_data(flags)
+        try:
+            alert = await asyncio.wait_for(result, self.timeout)
+        except asyncio.TimeoutError:
+            print("Timeout waiting for resume data")
+            return None
+        if alert.type is lt.save_resume_data_failed_alert:
+            print(f"Error saving resume data: {alert.message()}")
+            return None
+
+        data = lt.write_resume_data_buf(alert.params)
+        await io_executor.run("disk", self.write_atomic, data)
+        self.checkpoints += 1
+
+        if self.api and (sync or time.monotonic() - self.last_sync >= self.sync_interval):
+            await self.sync(data)
+        return len(data)
+
+    def write_atomic(self, data):
+        """先写临时文件再 rename，进程中途退出也不会留下半个 resume 文件"""
+        os.makedirs(os.path.dirname(self.resume_file) or '.', exist_ok=True)
+        tmp_path = self.resume_file + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.resume_file)
+
+    async def sync(self, data):
+        try:
+            await io_executor.run(
+                "hub",
+                self.api.upload_file,
+                path_or_fileobj=data,
+                path_in_repo=self.path_in_repo,
+                repo_id=self.repo_id,
+                repo_type=self.repo_type
+            )
+            self.last_sync = time.monotonic()
+            self.syncs += 1
+        except Exception as e:
+            print(f"Error uploading resume data: {e}")
+
+    def start(self, handle):
+        """按 interval 定期保存，只有 libtorrent 报告状态有变化时才真正写入"""
+        self._task = asyncio.create_task(self._run(handle))
+
+    async def stop(self, handle=None):
+        """停止定期保存；传入 handle 时再保存一次并同步到 Hub"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if handle is not None and handle.is_valid():
+            await self.checkpoint(handle, flush=True, sync=True)
+
+    async def _run(self, handle):
+        while True:
+            await asyncio.sleep(self.interval)
+            if handle.need_save_resume_data():
+                await self.checkpoint(handle)
+
+    def stats(self):
+        return {"checkpoints": self.checkpoints, "syncs": self.syncs}
@@ -0,0 +1,401 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, UTC
+import libtorrent as lt
+from aiohttp import web
+
+from alerts import AlertDispatcher
+from io_executor import io_executor, loop_monitor
+from k import TorrentDownloader, format_size
+from retry import Retrier
+from session_profiles import apply_profile
+from status_cache import StatusCache
+from uploader import UploadLimiter
+from web_server import start_http_server
+
+
+def job_info_hash(source):
+    """magnet 或 .torrent 文件的 info-hash（十六进制），用作任务 ID 和仓库目录名"""
+    if os.path.isfile(source):
+        return str(lt.torrent_info(source).info_hashes().get_best())
+    return str(lt.parse_magnet_uri(source).info_hashes.get_best())
+
+
+def read_job_file(path):
+    """每行一个 magnet 或 .torrent 路径，忽略空行和 # 开头的注释"""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def remove_job_folder(folder, keep):
+    """删除任务目录中除 keep（dead-letter 文件）以外的内容，重新加入任务时从 keep 继续重试"""
+    if not os.path.exists(keep):
+        shutil.rmtree(folder, ignore_errors=True)
+        return
+    for entry in os.scandir(folder):
+        if entry.path == keep:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class Job:
+    """队列中的一个 torrent"""
+
+    def __init__(self, source):
+        self.source = source
+        self.id = job_info_hash(source)
+        self.name = None
+        self.state = 'queued'  # queued -> metadata -> waiting_disk -> downloading -> done / failed
+        self.size = 0
+        self.reserved = 0  # 占用的磁盘配额
+        self.error = None
+        self.added = time.time()
+        self.started = None
+        self.finished = None
+        self.downloader = None
+
+    @property
+    def handle(self):
+        return self.downloader.handle if self.downloader else None
+
+    def to_dict(self, status=None):
+        entry = {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "size": self.size,
+            "error": self.error,
+            "added": self.added,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.downloader is not None:
+            entry["failed_pieces"] = len(self.downloader.dead_letters)
+        if status is not None:
+            entry["progress"] = round(status.progress * 100, 2)
+            entry["download_rate"] = status.download_rate
+            entry["peers"] = status.num_peers
+        return entry
+
+
+class DiskBudget:
+    """磁盘配额：torrent 拿到 metadata 后按总大小预留，删除数据后释放"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._space = asyncio.Condition()
+
+    async def reserve(self, size):
+        if size > self.limit:
+            raise ValueError(f"Torrent size {format_size(size)} exceeds disk budget {format_size(self.limit)}")
+        async with self._space:
+            await self._space.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+
+    async def release(self, size):
+        async with self._space:
+            self.used -= size
+            self._space.notify_all()
+
+
+class JobManager:
+    """在一个 lt.session 中运行多个 TorrentDownloader
+
+    全局限制同时下载的 torrent 数（max_active）、数据占用的磁盘（disk_budget，字节）和
+    上传到 Hub 的总带宽（upload_rate，字节/秒）。完成并上传的 torrent 默认删除本地数据，
+    释放的磁盘配额留给队列中的下一个任务。
+    """
+
+    def __init__(self, save_path, huggingface_token, max_active=3, disk_budget=None,
+                 upload_rate=0, keep_files=False, profile=None):
+        self.save_path = save_path
+        self.huggingface_token = huggingface_token
+        self.max_active = max_active
+        self.keep_files = keep_files
+        os.makedirs(save_path, exist_ok=True)
+        if disk_budget is None:
+            # 留 10% 给 piece 暂存、metadata 和系统
+            disk_budget = int(shutil.disk_usage(save_path).free * 0.9)
+        self.disk = DiskBudget(disk_budget)
+        self.limiter = UploadLimiter(upload_rate)
+        self.retrier = Retrier()  # 所有任务共用，/jobs 中汇总重试和失败次数
+
+        self.session = lt.session()
+        settings = {
+            'enable_dht': True,
+            'enable_lsd': True,
+            'enable_upnp': True,
+            'enable_natpmp': True,
+            # 同时下载的数量由 JobManager 控制，libtorrent 不再排队
+            'active_downloads': -1,
+            'active_seeds': -1,
+            'active_limit': -1,
+        }
+        self.SESSION_PROFILE = apply_profile(self.session, profile, overrides=settings)
+        self.alerts = AlertDispatcher(self.session)
+        self.status_cache = StatusCache(self.session, self.alerts)
+
+        self.jobs = {}  # {id: Job}，按加入顺序
+        self.slots = asyncio.Semaphore(max_active)
+        self._prepare_lock = asyncio.Lock()
+        self._prepared = False
+        self._tasks = set()
+        self._report_task = None
+
+    def start(self):
+        """启动 alert 泵、状态汇总和事件循环延迟测量，必须在事件循环中调用"""
+        self.alerts.start()
+        loop_monitor.start()
+        self._report_task = asyncio.create_task(self._report())
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._report_task:
+            self._report_task.cancel()
+            self._report_task = None
+        await self.alerts.stop()
+        await loop_monitor.stop()
+
+    def add(self, source):
+        """加入一个 magnet 或 .torrent 文件；同一个 torrent 已在队列中时返回已有任务"""
+        job = Job(source)
+        existing = self.jobs.get(job.id)
+        if existing and existing.state != 'failed':
+            return existing
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run_job(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def join(self):
+        """等待队列中的任务全部结束"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _prepare(self, downloader):
+        """登录、创建仓库和添加 DHT 路由只做一次"""
+        async with self._prepare_lock:
+            if not self._prepared:
+                await io_executor.run("hub", downloader.prepare_repo)
+                downloader.add_dht_routers()
+                self._prepared = True
+
+    async def _run_job(self, job):
+        async with self.slots:
+            job.state = 'metadata'
+            job.started = time.time()
+            job.downloader = TorrentDownloader(
+                job.source,
+                os.path.join(self.save_path, job.id),
+                self.huggingface_token,
+                session=self.session,
+                alerts=self.alerts,
+                status_cache=self.status_cache,
+                repo_folder=f"torrents/{job.id}",
+                upload_limiter=self.limiter,
+                retrier=self.retrier,
+                on_metadata=lambda handle, torrent_file: self._admit(job, torrent_file),
+                report=False,
+            )
+            try:
+                await self._prepare(job.downloader)
+                if await job.downloader.download_torrent() is None:
+                    raise RuntimeError("Failed to get torrent info")
+                if job.downloader.dead_letters:
+                    raise RuntimeError(f"{len(job.downloader.dead_letters)} pieces could not be uploaded")
+                job.state = 'done'
+                print(f"\nJob {job.id} ({job.name}) done")
+            except asyncio.CancelledError:
+                job.state = 'failed'
+                job.error = 'cancelled'
+                raise
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+                print(f"\nJob {job.id} failed: {e}")
+            finally:
+                job.finished = time.time()
+                await self._remove(job)
+
+    async def _admit(self, job, torrent_file):
+        """拿到 metadata 后等待磁盘配额，期间 torrent 保持暂停"""
+        job.name = torrent_file.name()
+        job.size = torrent_file.total_size()
+        job.state = 'waiting_disk'
+        await self.disk.reserve(job.size)
+        job.reserved = job.size
+        job.state = 'downloading'
+
+    async def _remove(self, job):
+        """从 session 移除 torrent 并释放磁盘配额；不保留文件时删除数据
+
+        保留的文件不再计入配额，配额只限制正在进行的任务。
+        """
+        handle = job.handle
+        if handle is None:
+            return
+        self.status_cache.forget(handle)
+        if self.keep_files:
+            self.session.remove_torrent(handle)
+        else:
+            info_hashes = handle.info_hashes()
+            deleted = self.alerts.wait_for(
+                (lt.torrent_deleted_alert, lt.torrent_delete_failed_alert),
+                lambda a: a.info_hashes == info_hashes
+            )
+            self.session.remove_torrent(handle, lt.session.delete_files)
+            try:
+                alert = await asyncio.wait_for(deleted, 30)
+                if alert.type is lt.torrent_delete_failed_alert:
+                    print(f"\nError deleting {job.id}: {alert.message()}")
+            except asyncio.TimeoutError:
+                print(f"\nTimeout deleting {job.id}")
+            await io_executor.run("disk", remove_job_folder, os.path.join(self.save_path, job.id),
+                                  job.downloader.dead_letters.path)
+        if job.reserved:
+            await self.disk.release(job.reserved)
+            job.reserved = 0
+
+    def status(self):
+        """全部任务和全局限制的状态，供 /jobs 使用"""
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.state] = counts.get(job.state, 0) + 1
+        return {
+            "jobs": [
+                job.to_dict(self.status_cache.statuses.get(job.handle) if job.handle else None)
+                for job in self.jobs.values()
+            ],
+            "counts": counts,
+            "max_active": self.max_active,
+            "disk": {"limit": self.disk.limit, "used": self.disk.used},
+            "upload": self.limiter.stats(),
+            "retry": self.retrier.stats(),
+            "io": io_executor.stats(),
+            "loop": loop_monitor.stats(),
+            "profile": self.SESSION_PROFILE,
+        }
+
+    async def _report(self):
+        """每秒在命令行打印一行汇总"""
+        while True:
+            await asyncio.sleep(1)
+            await self.status_cache.refresh()
+            rate = sum(s.download_rate for s in self.status_cache.statuses.values())
+            counts = self.status()["counts"]
+            print(f'\rJobs: {counts.get("downloading", 0)} downloading, '
+                  f'{counts.get("metadata", 0) + counts.get("waiting_disk", 0)} starting, '
+                  f'{counts.get("queued", 0)} queued, {counts.get("done", 0)} done, '
+                  f'{counts.get("failed", 0)} failed '
+                  f'Speed: {format_size(rate)}/s '
+                  f'Disk: {format_size(self.disk.used)}/{format_size(self.disk.limit)} '
+                  f'Loop lag: {loop_monitor.max_lag * 1000:.0f} ms', end='', flush=True)
+
+    def routes(self):
+        """HTTP 接口：GET /jobs 查看队列，POST /jobs 加入 magnet"""
+        return [
+            web.get('/jobs', self.handle_list),
+            web.post('/jobs', self.handle_add),
+        ]
+
+    async def handle_list(self, request):
+        return web.json_response(self.status())
+
+    async def handle_add(self, request):
+        """请求体为 {"magnets": [...]}、{"magnet": "..."} 或每行一个 magnet 的纯文本
+
+        通过 HTTP 只接受 magnet，不读取服务器上的 .torrent 文件。
+        """
+        body = await request.text()
+        try:
+            data = json.loads(body)
+            sources = data.get('magnets') or [data.get('magnet')]
+        except (ValueError, AttributeError):
+            sources = body.splitlines()
+        sources = [s.strip() for s in sources if s and s.strip()]
+        if not sources or not all(s.startswith('magnet:') for s in sources):
+            return web.json_response({'error': 'expected one or more magnet links'}, status=400)
+        try:
+            jobs = [self.add(source) for source in sources]
+        except RuntimeError as e:
+            return web.json_response({'error': f'invalid magnet link: {e}'}, status=400)
+        return web.json_response({'jobs': [job.to_dict() for job in jobs]}, status=201)
+
+
+async def main(args):
+    print(f'Current Date and Time (UTC): {datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")}')
+    manager = JobManager(
+        args.save_path,
+        args.token,
+        max_active=args.max_active,
+        disk_budget=int(args.disk_budget_gb * 1024 ** 3) if args.disk_budget_gb else None,
+        upload_rate=int(args.upload_mbps * 1024 ** 2),
+        keep_files=args.keep_files,
+        profile=args.profile,
+    )
+    manager.start()
+    http_runner = None
+    if args.serve:
+        http_runner = await start_http_server(manager.status, port=args.port, routes=manager.routes())
+
+    sources = list(args.sources)
+    if args.jobs:
+        sources += read_job_file(args.jobs)
+    for source in sources:
+        try:
+            manager.add(source)
+        except RuntimeError as e:
+            print(f"Skipping invalid source {source}: {e}")
+    print(f"Queued {len(manager.jobs)} torrents, {args.max_active} at a time")
+
+    try:
+        await manager.join()
+        if args.serve:
+            # 继续接受 POST /jobs 加入的任务
+            while True:
+                await asyncio.sleep(1)
+                await manager.join()
+    finally:
+        await manager.stop()
+        if http_runner:
+            await http_runner.cleanup()
+
+    counts = manager.status()["counts"]
+    print(f"\nAll jobs finished: {counts.get('done', 0)} done, {counts.get('failed', 0)} failed")
+    return 1 if counts.get('failed') else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download a queue of torrents in one libtorrent session and upload their pieces to the Hub.")
+    parser.add_argument("token", help="Hugging Face token")
+    parser.add_argument("sources", nargs="*", help="magnet links or .torrent files")
+    parser.add_argument("--jobs", help="file with one magnet link or .torrent path per line")
+    parser.add_argument("--save-path", default="Torrent/")
+    parser.add_argument("--max-active", type=int, default=3, help="torrents downloading at the same time")
+    parser.add_argument("--disk-budget-gb", type=float, help="disk space for torrent data (default: 90%% of free space)")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="total upload rate to the Hub in MB/s (0: unlimited)")
+    parser.add_argument("--keep-files", action="store_true", help="keep downloaded data instead of deleting it after upload")
+    parser.add_argument("--profile", help="session profile, e.g. throughput (default: TORRENT_PROFILE or default)")
+    parser.add_argument("--serve", action="store_true", help="serve GET/POST /jobs and keep running after the queue is empty")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    try:
+        sys.exit(asyncio.run(main(args)))
+    except KeyboardInterrupt:
+        print("\nDownload interrupted by user")
@@ -2,12 +2,23 @@ import libtorrent as lt
 import time
 import os
 import sys
-import json
 from huggingface_hub import HfApi, login
 
 from datetime import datetime, UTC
 import asyncio
 from dler import download_manager  # 确保此行存在
+from alerts import AlertDispatcher
+from uploader import HubBatchUploader
+from retry import Retrier, DeadLetterQueue
+from piece_pack import write_pack
+from combine_pieces import PIECE_NAME
+from piece_store import PieceStore
+from progress_model import ProgressModel, STATE_MAP
+from resume_state import ResumeState
+from metadata_cache import MetadataCache
+from session_profiles import apply_profile
+from status_cache import StatusCache
+from io_executor import io_executor, loop_monitor
 
 def format_size(size):
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -17,27 +28,70 @@ def format_size(size):
 
 class TorrentDownloader:
 
-    def __init__(self, magnet_link, save_path, huggingface_token):
+    def __init__(self, magnet_link, save_path, huggingface_token, session=None, alerts=None,
+                 status_cache=None, repo_folder="", upload_limiter=None, on_metadata=None, report=True,
+                 retrier=None):
+        """session/alerts/status_cache 可由 JobManager 传入，多个下载共用一个 session
+
+        magnet_link 也可以是 .torrent 文件路径；repo_folder 是这个 torrent 在仓库中的目录，
+        on_metadata(handle, torrent_file) 在开始下载数据之前调用（用于磁盘配额）。
+        retrier 可由多个下载共用，汇总重试次数。
+        """
         self.magnet_link = magnet_link
         self.save_path = save_path
         self.pieces_folder = os.path.join(save_path, "pieces")
-        self.metadata_file = os.path.join(save_path, "torrent_metadata.json")
-        self.progress_file = os.path.join(save_path, "download_progress.json")
+        self.metadata_folder = os.path.join(save_path, "metadata")
+        self.progress_file = os.path.join(save_path, "download_progress.bin")
+        self.retrier = retrier or Retrier()
+        # 重试用尽后仍提交失败的 piece，任务结束前再上传一次；重启后也会读取
+        self.dead_letters = DeadLetterQueue(os.path.join(save_path, "failed_pieces.json"))
         self.huggingface_token = huggingface_token
         self.api = HfApi()
         self.USERNAME = "servejjjhjj"
         self.REPO_NAME = 'mp4-dataset'
         self.REPO_TYPE = 'dataset'
-        self.session = lt.session()
+        self.repo_folder = repo_folder
+        self.on_metadata = on_metadata
+        self.report = report  # 是否更新网页和命令行进度，多个下载同时进行时由 JobManager 汇总
+        self.owns_session = session is None
+        self.session = session or lt.session()
+        self.progress_model = None
+        self.handle = None
+        self.alerts = alerts or AlertDispatcher(self.session)
+        self.status_cache = status_cache or StatusCache(self.session, self.alerts)
+        self.metadata_cache = MetadataCache(
+            self.metadata_folder,
+            self.api,
+            f'{self.USERNAME}/{self.REPO_NAME}',
+            self.REPO_TYPE
+        )
+        self.piece_store = PieceStore(self.pieces_folder)
 
         self.UPLOAD_INTERVAL = 5 * 3600  # 5小时上传一次
         self.STATUS_UPDATE_INTERVAL = 1  # 1秒更新一次状态
+        self.COMMIT_BATCH_SIZE = 100  # 每次 commit 包含的 piece 数量
+        self.COMMIT_INTERVAL = 60  # 最长 60 秒提交一次
+        self.PACK_PIECES = True  # 每次 commit 的 piece 合成一个 pack 文件，可以按区间读取单个 piece
+
+        self.batcher = HubBatchUploader(
+            self.api,
+            f'{self.USERNAME}/{self.REPO_NAME}',
+            self.REPO_TYPE,
+            batch_size=self.COMMIT_BATCH_SIZE,
+            flush_interval=self.COMMIT_INTERVAL,
+            on_committed=self.on_pieces_committed,
+            on_failed=self.on_commit_failed,
+            limiter=upload_limiter,
+            pack=self.pack_pieces if self.PACK_PIECES else None,
+            retrier=self.retrier,
+        )
         
         os.makedirs(self.pieces_folder, exist_ok=True)
         os.makedirs(self.save_path, exist_ok=True)
 
+        if not self.owns_session:
+            return
         settings = {
-            'alert_mask': lt.alert.category_t.all_categories,
             'enable_dht': True,
             'enable_lsd': True,
             'enable_upnp': True,
@@ -45,120 +99,149 @@ class TorrentDownloader:
             'download_rate_limit': 0,
             'upload_rate_limit': 0,
         }
-        self.session.apply_settings(settings)
+        # 默认保持 libtorrent 原有设置，TORRENT_PROFILE=throughput 可调大连接数、请求队列、磁盘线程等
+        self.SESSION_PROFILE = apply_profile(self.session, overrides=settings)
 
-    def load_progress_from_hf(self):
+    async def save_piece(self, handle, piece_index):
+        """读取piece并暂存，返回可直接上传的数据"""
         try:
-            progress_content = self.api.download_file(
-                repo_id=f"{self.USERNAME}/{self.REPO_NAME}",
-                filename="download_progress.json"
-            )
-
-
-            progress_data = json.loads(progress_content)
-            print(f"Loaded progress: {len(progress_data['downloaded_pieces'])} pieces downloaded")
-            return progress_data
+            # 共用 session 时其他 torrent 也会读同一个序号的 piece
+            piece_read = self.alerts.wait_for(
+                lt.read_piece_alert, lambda a: a.piece == piece_index and a.handle == handle)
+            handle.read_piece(piece_index)
+            alert = await asyncio.wait_for(piece_read, 10)  # 10秒超时
+
+            if not alert.buffer:
+                print(f"No data received for piece {piece_index}")
+                return None
+
+            return await self.piece_store.put_async(self.piece_path(piece_index), alert.buffer)
+        except asyncio.TimeoutError:
+            print(f"Timeout reading piece {piece_index}")
+            return None
         except Exception as e:
-            print(f"No previous progress found on HuggingFace: {e}")
+            print(f"Error saving piece {piece_index}: {e}")
             return None
 
-    def save_progress_to_hf(self, handle, last_uploaded_piece):
+    def repo_path(self, name):
+        """仓库中的路径，放在 repo_folder 目录下"""
+        return f"{self.repo_folder}/{name}" if self.repo_folder else name
+
+    def piece_path(self, piece_index):
+        return self.repo_path(f"pieces/piece_{piece_index}.dat")
+
+    def pack_pieces(self, batch):
+        """把一个批次的 piece 写成 pieces/pack_<first>_<last>.pack，在上传线程中调用"""
+        pieces = dict(zip(self.piece_indexes(path for path, _ in batch), (data for _, data in batch)))
+        info_hash = self.handle.info_hashes().get_best().to_bytes()
+        fileobj = write_pack(pieces, info_hash, temp_folder=self.pieces_folder)
+        return self.repo_path(f"pieces/pack_{min(pieces)}_{max(pieces)}.pack"), fileobj
+
+    def add_params(self):
+        """magnet 或 .torrent 文件的 add_torrent_params，缓存中有 metadata 时直接使用
+
+        会读取本地文件或从 Hub 下载缓存的 metadata，在 io_executor 中调用。
+        """
+        if os.path.isfile(self.magnet_link):
+            atp = lt.add_torrent_params()
+            atp.ti = lt.torrent_info(self.magnet_link)
+        else:
+            atp = self.metadata_cache.add_params(self.magnet_link)
+        atp.save_path = self.save_path
+        if self.on_metadata:
+            # upload_mode 下仍会获取 metadata，但不下载数据，on_metadata 返回后才开始写盘。
+            # libtorrent 会在 optimistic_disk_retry 秒后清除 auto_managed torrent 的 upload_mode，
+            # 所以先不交给自动管理（也就不能是 paused，否则不会启动）
+            atp.flags |= lt.torrent_flags.upload_mode
+            atp.flags &= ~(lt.torrent_flags.auto_managed | lt.torrent_flags.paused)
+        return atp
+
+    @staticmethod
+    def piece_indexes(paths):
+        return [int(PIECE_NAME.search(path).group(1)) for path in paths]
+
+    async def on_pieces_committed(self, paths):
+        for path in paths:
+            await self.piece_store.pop_async(path)
+        await self.dead_letters.discard_async(self.piece_indexes(paths))
+        print(f"\nUploaded {len(paths)} pieces")
+
+    async def on_commit_failed(self, paths, error):
+        print(f"\nError uploading {len(paths)} pieces: {error}, will retry before the download ends")
+        for path in paths:
+            await self.piece_store.pop_async(path)
+        await self.dead_letters.add_async(self.piece_indexes(paths), error)
+
+    def load_progress_from_hf(self, handle):
+        """读取 Hub 上的续传状态，找不到新格式时读取旧的 download_progress.json；在 io_executor 中调用"""
+        info_hash = handle.info_hashes().get_best().to_bytes()
+        for filename in ("download_progress.bin", "download_progress.json"):
+            try:
+                path = self.api.hf_hub_download(
+                    repo_id=f"{self.USERNAME}/{self.REPO_NAME}",
+                    repo_type=self.REPO_TYPE,
+                    filename=self.repo_path(filename)
+                )
+                state = ResumeState.load(path, info_hash)
+                print(f"Loaded progress: {state.have_count} pieces downloaded")
+                return state
+            except Exception as e:
+                print(f"No previous progress found in {filename}: {e}")
+        return None
+
+    async def save_progress_to_hf(self, handle, last_uploaded_piece):
+        status = await self.status_cache.get_with_pieces(handle)
+        state = ResumeState.from_status(status, last_uploaded_piece)
+        data = await io_executor.run("disk", state.save, self.progress_file)
 
-        progress_data = {
-            "last_uploaded_piece": last_uploaded_piece,
-            "downloaded_pieces": [i for i in range(handle.status().torrent_file.num_pieces()) 
-                                if handle.have_piece(i)],
-            "timestamp": datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S"),
-            "total_pieces": handle.status().torrent_file.num_pieces()
-        }
-        
-        with open(self.progress_file, 'w') as f:
-            json.dump(progress_data, f)
-        
         try:
-            self.api.upload_file(
-                path_or_fileobj=self.progress_file,
-                path_in_repo="download_progress.json",
+            await self.retrier.run(
+                self.api.upload_file,
+                description="Saving progress",
+                path_or_fileobj=data,
+                path_in_repo=self.repo_path("download_progress.bin"),
                 repo_id=f'{self.USERNAME}/{self.REPO_NAME}',
                 repo_type=self.REPO_TYPE
             )
-            print(f"Progress saved at: {datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')}")
+            print(f"Progress saved at: {datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')} ({len(data)} bytes)")
         except Exception as e:
             print(f"Error saving progress: {e}")
-        return progress_data
+        return state
 
-    def update_ui_status(self, handle):
-        """更新UI状态"""
+    def update_ui_status(self, handle, status=None):
+        """更新UI状态，status 为本 tick 的状态快照"""
         try:
-            status = handle.status()
-            torrent_file = status.torrent_file
-            
-            if not torrent_file:
+            status = status or self.status_cache.get(handle)
+            if not self.report or not status.has_metadata:
                 return
-            
-            # 获取状态字符串
-            state_map = {
-                0: 'queued',
-                1: 'checking',
-                2: 'downloading metadata',
-                3: 'downloading',
-                4: 'finished',
-                5: 'seeding',
-                6: 'allocating'
-            }
-            state_str = state_map.get(status.state, 'unknown')
-            
-            file_progress = handle.file_progress()
-            files_status = []
-            total_downloaded = 0
-            total_size = 0
+
+            # 文件表只在拿到 metadata 后读取一次
+            if self.progress_model is None:
+                self.progress_model = ProgressModel(handle.torrent_file())
+            model = self.progress_model
+
+            state_str = STATE_MAP.get(status.state, 'unknown')
 
             try:
-                # 获取所有文件的进度
-                for file_index in range(torrent_file.num_files()):
-                    try:
-                        file_path = torrent_file.files().file_path(file_index)
-                        file_size = torrent_file.files().file_size(file_index)
-                        downloaded = file_progress[file_index]
-                        
-                        # 安全计算下载速度
-                        file_speed = 0
-                        if torrent_file.total_size() > 0:
-                            file_speed = (status.download_rate * file_size) / torrent_file.total_size()
-                        
-                        files_status.append({
-                            "index": file_index,
-                            "path": file_path,
-                            "size": file_size,
-                            "downloaded": downloaded,
-                            "speed": file_speed,
-                            "progress": (downloaded / file_size * 100) if file_size > 0 else 0,
-                            "state": state_str
-                        })
-                        
-                        total_downloaded += downloaded
-                        total_size += file_size
-                    except Exception as e:
-                        print(f"Error processing file {file_index}: {e}")
-                        continue
-
-                # 安全计算总进度
-                total_progress = 0
-                if total_size > 0:
-                    total_progress = (total_downloaded / total_size * 100)
+                changed = model.update(model.read_file_progress(handle), state_str)
+                total_progress = model.total_progress
 
                 # 更新UI
                 download_manager.update_status(
-                    files_status,
+                    model.files_status,
                     status.num_peers,
-                    total_progress
+                    total_progress,
+                    changed
                 )
 
                 # 打印命令行进度
+                alert_stats = self.alerts.stats()
                 print(f'\rProgress: {total_progress:.2f}% '
                       f'Speed: {format_size(status.download_rate)}/s '
                       f'Peers: {status.num_peers} '
-                      f'State: {state_str}', end='', flush=True)
+                      f'State: {state_str} '
+                      f'Alerts: {alert_stats["alerts_per_sec"]:.0f}/s '
+                      f'Loop lag: {loop_monitor.max_lag * 1000:.0f} ms', end='', flush=True)
 
             except Exception as e:
                 print(f"\nError calculating progress: {e}")
@@ -166,9 +249,8 @@ class TorrentDownloader:
         except Exception as e:
             print(f"\nError in update_ui_status: {e}")
 
-    async def download(self):
-        print(f'Current Date and Time (UTC): {datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")}')
-        
+    def prepare_repo(self):
+        """登录并创建仓库，多个下载共用 session 时由 JobManager 调用一次；阻塞调用，在 io_executor 中执行"""
         login(token=self.huggingface_token)
 
         try:
@@ -181,93 +263,170 @@ class TorrentDownloader:
         except Exception as e:
             print(f'Repository note: {e}')
 
-        # 设置 DHT
+    def add_dht_routers(self):
         self.session.add_dht_router("router.bittorrent.com", 6881)
         self.session.add_dht_router("router.utorrent.com", 6881)
         self.session.add_dht_router("dht.transmissionbt.com", 6881)
 
-        # 创建 torrent handle
-        atp = lt.add_torrent_params()
-        atp.url = self.magnet_link
-        atp.save_path = self.save_path
-        handle = self.session.add_torrent(atp)
+    async def download(self):
+        print(f'Current Date and Time (UTC): {datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")}')
+        # 测量事件循环被阻塞的时间，阻塞调用都应经过 io_executor
+        loop_monitor.start()
+
+        await io_executor.run("hub", self.prepare_repo)
+
+        # 设置 DHT
+        self.add_dht_routers()
+
+        self.alerts.start()
+        try:
+            await self.download_torrent()
+        finally:
+            await self.alerts.stop()
+            await loop_monitor.stop()
+            print(f"\nEvent loop stalled {loop_monitor.stalls} times ({loop_monitor.stall_seconds:.2f}s), "
+                  f"max lag {loop_monitor.max_lag * 1000:.0f} ms")
+
+    @staticmethod
+    def contiguous_piece(handle, last, num_pieces, skipped=()):
+        """last 之后连续已下载（或续传时已上传、不再下载）的最后一个 piece"""
+        while last + 1 < num_pieces and (last + 1 in skipped or handle.have_piece(last + 1)):
+            last += 1
+        return last
+
+    async def upload_pieces(self, handle, first, last):
+        """把 first..last 中已下载的 piece 读出并提交到仓库"""
+        for piece_index in range(first, last + 1):
+            if handle.have_piece(piece_index):
+                piece_data = await self.save_piece(handle, piece_index)
+                if piece_data:
+                    await self.batcher.add(self.piece_path(piece_index), piece_data)
+        await self.batcher.flush()
+
+    async def retry_dead_letters(self, handle):
+        """重新读取并上传之前提交失败的 piece（包括上次运行留下的）"""
+        pieces = [piece for piece in self.dead_letters if handle.have_piece(piece)]
+        if not pieces:
+            return
+        print(f"\nRetrying {len(pieces)} pieces that failed to upload...")
+        for piece_index in pieces:
+            piece_data = await self.save_piece(handle, piece_index)
+            if piece_data:
+                await self.batcher.add(self.piece_path(piece_index), piece_data)
+        await self.batcher.flush()
+        if self.dead_letters:
+            print(f"\n{len(self.dead_letters)} pieces could not be uploaded, listed in {self.dead_letters.path}")
+
+    async def download_torrent(self):
+        """下载一个 torrent 并把 piece 上传到仓库，返回 handle（失败时为 None）
+
+        session 的 alert 泵需要已经启动；torrent 下载完成后留在 session 中，由调用方移除。
+        """
+        self.batcher.start()
+        error_alerts = self.alerts.subscribe(category=lt.alert.category_t.error_notification)
+        try:
+            return await self._download_torrent(error_alerts)
+        finally:
+            self.alerts.unsubscribe(error_alerts)
+            await self.batcher.stop()
+
+    async def _download_torrent(self, error_alerts):
+        # 创建 torrent handle，缓存中有 metadata 时直接使用
+        handle = self.handle = self.session.add_torrent(await io_executor.run("hub", self.add_params))
+        metadata_received = self.alerts.wait_for(lt.metadata_received_alert, lambda a: a.handle == handle)
 
         print('Downloading metadata...')
-        while not handle.status().has_metadata:
+        while True:
+            await self.status_cache.refresh()
+            status = self.status_cache.get(handle)
+            if status.has_metadata:
+                break
             try:
-                self.update_ui_status(handle)
+                self.update_ui_status(handle, status)
             except Exception as e:
                 print(f"Error during metadata download: {e}")
-            await asyncio.sleep(1)
+            # metadata 一到就继续，不用等满 1 秒
+            await asyncio.wait([metadata_received], timeout=1)
+        metadata_received.cancel()
 
         print('\nGot metadata, starting download...')
-        torrent_file = handle.status().torrent_file
+        torrent_file = handle.torrent_file()
+        if torrent_file:
+            await io_executor.run("hub", self.metadata_cache.put, torrent_file)
         
         if not torrent_file:
             print("Error: Failed to get torrent info")
-            return
+            return None
 
         print(f"Total size: {format_size(torrent_file.total_size())}")
         print(f"Number of pieces: {torrent_file.num_pieces()}")
 
+        if self.on_metadata:
+            # 等待磁盘配额期间暂停，不连接 peer 也不写盘；配额拿到后再交给自动管理
+            handle.pause()
+            await self.on_metadata(handle, torrent_file)
+            handle.unset_flags(lt.torrent_flags.upload_mode)
+            handle.set_flags(lt.torrent_flags.auto_managed)
+            handle.resume()
+
         # 从之前的进度恢复
-        progress_data = self.load_progress_from_hf()
+        state = await io_executor.run("hub", self.load_progress_from_hf, handle)
         last_uploaded_piece = -1
-        if progress_data:
+        skipped = set()  # 续传时优先级设为 0 的 piece，本地没有数据
+        if state:
             print("Resuming from previous progress...")
-            last_uploaded_piece = progress_data['last_uploaded_piece']
-            for piece in progress_data['downloaded_pieces']:
-                handle.piece_priority(piece, 0)
+            last_uploaded_piece = state.uploaded_watermark
+            try:
+                state.apply(handle)
+                skipped = set(state.have_pieces())
+            except ValueError as e:
+                print(f"Ignoring previous progress: {e}")
 
         last_upload_time = time.time()
         last_status_update = time.time()
 
-        while not handle.status().is_seeding:
+        while True:
+            # 每个 tick 只取一次状态快照，下面的显示和上传都读取它
+            await self.status_cache.refresh()
+            status = self.status_cache.get(handle)
+            # 续传时已上传的 piece 优先级为 0、不在本地，torrent 只会到 finished，不会到 seeding
+            if status.is_finished:
+                break
             current_time = time.time()
             
             # 更新UI状态
             if current_time - last_status_update >= self.STATUS_UPDATE_INTERVAL:
-                self.update_ui_status(handle)
+                self.update_ui_status(handle, status)
                 last_status_update = current_time
             
             # 处理HuggingFace上传
             if current_time - last_upload_time >= self.UPLOAD_INTERVAL:
-                status = handle.status()
-                current_piece = int(status.progress * torrent_file.num_pieces())
+                current_piece = self.contiguous_piece(
+                    handle, last_uploaded_piece, torrent_file.num_pieces(), skipped)
                 
                 if current_piece > last_uploaded_piece:
                     print(f"\nUploading pieces {last_uploaded_piece + 1} to {current_piece}...")
-                    for piece_index in range(last_uploaded_piece + 1, current_piece + 1):
-                        if handle.have_piece(piece_index):
-                            piece_path = await self.save_piece(handle, piece_index)
-                            if piece_path:
-                                try:
-                                    self.api.upload_file(
-                                        path_or_fileobj=piece_path,
-                                        path_in_repo=f"pieces/piece_{piece_index}.dat",
-                                        repo_id=f'{self.USERNAME}/{self.REPO_NAME}',
-                                        repo_type=self.REPO_TYPE
-                                    )
-                                    os.remove(piece_path)
-                                    print(f"Uploaded piece {piece_index}")
-                                except Exception as e:
-                                    print(f"\nError uploading piece {piece_index}: {e}")
-                    
+                    await self.upload_pieces(handle, last_uploaded_piece + 1, current_piece)
+
                     last_uploaded_piece = current_piece
-                    self.save_progress_to_hf(handle, last_uploaded_piece)
+                    await self.save_progress_to_hf(handle, last_uploaded_piece)
                 
                 last_upload_time = current_time
 
-            # 处理alert
-            alerts = self.session.pop_alerts()
-            for alert in alerts:
-                if alert.category() & lt.alert.category_t.error_notification:
+            # 处理alert，共用 session 时只打印自己 torrent 的
+            for alert in self.alerts.drain(error_alerts):
+                alert_handle = getattr(alert, 'handle', None)
+                if alert_handle == handle or (alert_handle is None and self.owns_session):
                     print(f"\nError: {alert.message()}")
 
             await asyncio.sleep(1)
 
         print('\nDownload complete!')
-        self.save_progress_to_hf(handle, torrent_file.num_pieces() - 1)
+        # 上传最后一次定时上传之后完成的 piece
+        await self.upload_pieces(handle, last_uploaded_piece + 1, torrent_file.num_pieces() - 1)
+        await self.retry_dead_letters(handle)
+        await self.save_progress_to_hf(handle, torrent_file.num_pieces() - 1)
+        return handle
 
 async def start_download(magnet_link, save_path, huggingface_token):
     downloader = TorrentDownloader(magnet_link, save_path, huggingface_token)
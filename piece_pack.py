@@ -0,0 +1,138 @@
+import hashlib
+import io
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+# pack 文件：文件头 | piece 数据 | 索引 | 文件尾
+# 文件尾的大小固定，先读文件尾找到索引，再按索引中的偏移直接读取单个 piece，
+# 放在 Hub 上时每一步都是一次 HTTP range 请求
+MAGIC = b'GTPK'
+VERSION = 1
+HEADER = struct.Struct('<4sB3x')  # 魔数、版本
+ENTRY = struct.Struct('<IQI20s')  # piece 序号、偏移、长度、SHA-1
+FOOTER = struct.Struct('<20sQII4s')  # info-hash、索引偏移、piece 数、索引的 CRC32、魔数
+TAIL_GUESS = 64 * 1024  # 第一次从末尾读取的字节数，通常能连同索引一起读到
+
+
+class PackWriter:
+    """按顺序写入 piece，finish() 时写入索引和文件尾"""
+
+    def __init__(self, fileobj, info_hash=None):
+        self.fileobj = fileobj
+        self.info_hash = info_hash or bytes(20)
+        self.entries = []
+        self.offset = HEADER.size
+        fileobj.write(HEADER.pack(MAGIC, VERSION))
+
+    def add(self, piece_index, data):
+        """data 为 bytes 或文件路径"""
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            with open(data, 'rb') as f:
+                data = f.read()
+        self.fileobj.write(data)
+        self.entries.append((piece_index, self.offset, len(data), hashlib.sha1(data).digest()))
+        self.offset += len(data)
+
+    def finish(self):
+        index = b''.join(ENTRY.pack(*entry) for entry in self.entries)
+        self.fileobj.write(index)
+        self.fileobj.write(FOOTER.pack(self.info_hash, self.offset, len(self.entries), zlib.crc32(index), MAGIC))
+        return self.fileobj
+
+
+def write_pack(pieces, info_hash=None, memory_limit=256 * 1024 * 1024, temp_folder=None):
+    """把 {piece 序号: bytes 或文件路径} 写成 pack，返回从头开始的文件对象
+
+    总大小不超过 memory_limit 时写在内存中，否则写到 temp_folder 下的临时文件。
+    """
+    size = sum(len(data) if isinstance(data, bytes) else os.path.getsize(data) for data in pieces.values())
+    if size <= memory_limit:
+        fileobj = io.BytesIO()
+    else:
+        fileobj = tempfile.TemporaryFile(dir=temp_folder)
+    writer = PackWriter(fileobj, info_hash)
+    for piece_index in sorted(pieces):
+        writer.add(piece_index, pieces[piece_index])
+    writer.finish()
+    fileobj.seek(0)
+    return fileobj
+
+
+class LocalSource:
+    """本地的 pack 文件"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, offset, length):
+        with open(self.path, 'rb') as f:
+            return os.pread(f.fileno(), length, offset)
+
+    def tail(self, length):
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            return os.pread(f.fileno(), min(length, size), max(0, size - length))
+
+
+class HubSource:
+    """Hub 仓库中的 pack 文件，每次读取是一次 range 请求"""
+
+    def __init__(self, api, repo_id, repo_type, path_in_repo, revision=None):
+        from huggingface_hub import hf_hub_url
+        from huggingface_hub.utils import build_hf_headers, get_session
+        self.url = hf_hub_url(repo_id, path_in_repo, repo_type=repo_type, revision=revision, endpoint=api.endpoint)
+        self.path = path_in_repo
+        self.headers = build_hf_headers(token=api.token)
+        self.session = get_session()
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.lock = threading.Lock()  # combine_pieces 多个线程同时读取
+
+    def get(self, byte_range):
+        response = self.session.get(self.url, headers={**self.headers, "Range": f"bytes={byte_range}"},
+                                    follow_redirects=True)
+        response.raise_for_status()
+        with self.lock:
+            self.requests += 1
+            self.bytes_fetched += len(response.content)
+        return response.content
+
+    def read(self, offset, length):
+        return self.get(f"{offset}-{offset + length - 1}")
+
+    def tail(self, length):
+        return self.get(f"-{length}")
+
+
+class PackReader:
+    """读取 pack 的索引，按序号读取单个 piece"""
+
+    def __init__(self, source, tail_guess=TAIL_GUESS):
+        self.source = source
+        tail = source.tail(tail_guess)
+        if len(tail) < FOOTER.size:
+            raise ValueError(f"{source.path} is not a piece pack")
+        self.info_hash, index_offset, count, crc, magic = FOOTER.unpack(tail[-FOOTER.size:])
+        if magic != MAGIC:
+            raise ValueError(f"{source.path} is not a piece pack")
+        index_size = count * ENTRY.size
+        if index_size + FOOTER.size <= len(tail):
+            index = tail[-FOOTER.size - index_size:-FOOTER.size]
+        else:
+            # 索引比第一次读到的多，再读一次
+            index = source.read(index_offset, index_size)
+        if zlib.crc32(index) != crc:
+            raise ValueError(f"Index of {source.path} is corrupted")
+        self.entries = {}  # {piece 序号: (偏移, 长度, SHA-1)}
+        for piece_index, offset, length, sha1 in ENTRY.iter_unpack(index):
+            self.entries[piece_index] = (offset, length, sha1)
+
+    def read_piece(self, piece_index):
+        offset, length, sha1 = self.entries[piece_index]
+        data = self.source.read(offset, length)
+        if hashlib.sha1(data).digest() != sha1:
+            raise ValueError(f"Piece {piece_index} in {self.source.path} does not match the index")
+        return data
@@ -0,0 +1,105 @@
+import os
+
+from io_executor import io_executor
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class PieceStore:
+    """内存优先的 piece 暂存区
+
+    piece 数据直接以 bytes 保存在内存中交给上传方；只有超过 memory_limit 时才写到
+    spill_folder 下的临时文件。get() 的返回值可以直接作为 path_or_fileobj 使用。
+    """
+
+    def __init__(self, spill_folder, memory_limit=512 * 1024 * 1024):
+        self.spill_folder = spill_folder
+        self.memory_limit = memory_limit
+        self.memory = {}  # {name: bytes}
+        self.spilled = {}  # {name: 本地文件路径}
+        self.memory_used = 0
+        self.peak_memory = 0
+        self.spill_count = 0
+
+    def put(self, name, data):
+        """保存一个 piece，返回可直接上传的 bytes 或文件路径"""
+        self.pop(name)
+        if self.fits(data):
+            return self.keep(name, data)
+        path = self.spill_path(name)
+        write_file(path, data)
+        return self.spill(name, path)
+
+    async def put_async(self, name, data):
+        """与 put() 相同，需要写临时文件时在 io_executor 的 disk 线程池中写，不阻塞事件循环"""
+        await self.pop_async(name)
+        if self.fits(data):
+            return self.keep(name, data)
+        path = self.spill_path(name)
+        await io_executor.run("disk", write_file, path, data)
+        return self.spill(name, path)
+
+    def fits(self, data):
+        return self.memory_used + len(data) <= self.memory_limit
+
+    def keep(self, name, data):
+        self.memory[name] = data
+        self.memory_used += len(data)
+        self.peak_memory = max(self.peak_memory, self.memory_used)
+        return data
+
+    def spill_path(self, name):
+        return os.path.join(self.spill_folder, name.replace('/', '_'))
+
+    def spill(self, name, path):
+        self.spilled[name] = path
+        self.spill_count += 1
+        return path
+
+    def get(self, name):
+        if name in self.memory:
+            return self.memory[name]
+        return self.spilled.get(name)
+
+    def release(self, name):
+        """释放一个 piece 占用的内存，返回还需要删除的临时文件路径"""
+        data = self.memory.pop(name, None)
+        if data is not None:
+            self.memory_used -= len(data)
+        return self.spilled.pop(name, None)
+
+    def pop(self, name):
+        """释放一个 piece 占用的内存或临时文件"""
+        path = self.release(name)
+        if path:
+            remove_file(path)
+
+    async def pop_async(self, name):
+        """与 pop() 相同，临时文件在 io_executor 的 disk 线程池中删除"""
+        path = self.release(name)
+        if path:
+            await io_executor.run("disk", remove_file, path)
+
+    def __contains__(self, name):
+        return name in self.memory or name in self.spilled
+
+    def __len__(self):
+        return len(self.memory) + len(self.spilled)
+
+    def stats(self):
+        return {
+            "in_memory": len(self.memory),
+            "memory_used": self.memory_used,
+            "peak_memory": self.peak_memory,
+            "spilled": len(self.spilled),
+            "spill_count": self.spill_count,
+        }
@@ -0,0 +1,178 @@
+import asyncio
+import time
+import libtorrent as lt
+from io_executor import io_executor
+
+
+class ByteBudget:
+    """限制同时驻留在内存中的 piece 字节数"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, size):
+        async with self._cond:
+            # 单个 piece 超过上限时也要放行，否则会永远等待
+            await self._cond.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    async def release(self, size):
+        async with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+
+class PiecePipeline:
+    """piece 读取 + 上传流水线
+
+    读取阶段同时发起多个 read_piece，上传阶段由多个 worker 在线程中执行阻塞的上传函数。
+    两阶段之间用有界队列和字节预算限制内存；上传跟不上时降低 torrent 的下载速度。
+    """
+
+    def __init__(self, handle, alerts, upload, piece_length, max_reads=16, workers=4,
+                 max_buffered_bytes=256 * 1024 * 1024, backlog_high=256, backlog_low=64,
+                 on_uploaded=None, on_failed=None, read_timeout=30):
+        self.handle = handle
+        self.alerts = alerts
+        self.upload = upload  # upload(piece_index, data)，协程直接 await，普通函数在 io_executor 的 hub 线程池中调用
+        self.piece_length = piece_length
+        self.max_reads = max_reads
+        self.workers = workers
+        self.backlog_high = backlog_high
+        self.backlog_low = backlog_low
+        self.on_uploaded = on_uploaded
+        self.on_failed = on_failed
+        self.read_timeout = read_timeout
+
+        self.budget = ByteBudget(max_buffered_bytes)
+        self.pending = asyncio.Queue()  # 已完成下载、等待读取的 piece 索引
+        self.ready = asyncio.Queue(maxsize=workers * 2)  # 已读入内存、等待上传的 piece
+        self._tasks = []
+        self.throttled = False
+
+        self.started_at = None
+        self.pieces_done = 0
+        self.bytes_done = 0
+        self.pieces_failed = 0
+        self._window = []  # [(完成时间, 字节数)]，用于计算最近的速率
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._reader()) for _ in range(self.max_reads)]
+        self._tasks += [asyncio.create_task(self._uploader()) for _ in range(self.workers)]
+
+    def submit(self, piece_index):
+        """提交一个已完成下载的 piece，立即返回"""
+        self.pending.put_nowait(piece_index)
+        self._apply_backpressure()
+
+    async def join(self):
+        """等待所有已提交的 piece 处理完"""
+        await self.pending.join()
+        await self.ready.join()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.throttled:
+            self.handle.set_download_limit(-1)
+            self.throttled = False
+
+    async def _reader(self):
+        while True:
+            piece_index = await self.pending.get()
+            try:
+                await self.budget.acquire(self.piece_length)
+                try:
+                    data = await self._read_piece(piece_index)
+                except BaseException:
+                    await self.budget.release(self.piece_length)
+                    raise
+                await self.ready.put((piece_index, data))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.pieces_failed += 1
+                await self._report_failure(piece_index, e)
+            finally:
+                self.pending.task_done()
+
+    async def _read_piece(self, piece_index):
+        piece_read = self.alerts.wait_for(lt.read_piece_alert, lambda a: a.piece == piece_index)
+        self.handle.read_piece(piece_index)
+        alert = await asyncio.wait_for(piece_read, self.read_timeout)
+        if alert.error.value():
+            raise RuntimeError(alert.error.message())
+        return alert.buffer
+
+    async def _uploader(self):
+        while True:
+            piece_index, data = await self.ready.get()
+            try:
+                if asyncio.iscoroutinefunction(self.upload):
+                    await self.upload(piece_index, data)
+                else:
+                    await io_executor.run("hub", self.upload, piece_index, data)
+                self._record(len(data))
+                if self.on_uploaded:
+                    await self.on_uploaded(piece_index)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.pieces_failed += 1
+                await self._report_failure(piece_index, e)
+            finally:
+                del data
+                await self.budget.release(self.piece_length)
+                self.ready.task_done()
+                self._apply_backpressure()
+
+    async def _report_failure(self, piece_index, error):
+        if self.on_failed:
+            await self.on_failed(piece_index, error)
+        else:
+            print(f"Error processing piece {piece_index}: {error}")
+
+    def _record(self, size):
+        now = time.monotonic()
+        self.pieces_done += 1
+        self.bytes_done += size
+        self._window.append((now, size))
+        while self._window and now - self._window[0][0] > 30:
+            self._window.pop(0)
+
+    def upload_rate(self):
+        """最近 30 秒的上传速率（字节/秒）"""
+        if len(self._window) < 2:
+            return 0
+        elapsed = self._window[-1][0] - self._window[0][0]
+        return sum(size for _, size in self._window) / elapsed if elapsed > 0 else 0
+
+    def _apply_backpressure(self):
+        """积压超过高水位时把下载限速到当前上传速率，回落到低水位后解除"""
+        backlog = self.pending.qsize()
+        if not self.throttled and backlog >= self.backlog_high:
+            self.handle.set_download_limit(max(int(self.upload_rate()), self.piece_length))
+            self.throttled = True
+        elif self.throttled and backlog <= self.backlog_low:
+            self.handle.set_download_limit(-1)
+            self.throttled = False
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        return {
+            "pieces_done": self.pieces_done,
+            "pieces_failed": self.pieces_failed,
+            "pieces_per_sec": self.pieces_done / elapsed if elapsed > 0 else 0,
+            "upload_rate": self.upload_rate(),
+            "backlog": self.pending.qsize(),
+            "buffered_bytes": self.budget.used,
+            "peak_buffered_bytes": self.budget.peak,
+            "throttled": self.throttled,
+        }
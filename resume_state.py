@@ -0,0 +1,118 @@
+import json
+import struct
+import time
+import zlib
+import libtorrent as lt
+
+# 文件头：魔数、版本、标志位、info-hash、piece 数、已上传水位、时间戳、位图长度
+HEADER = struct.Struct('<4sBB20sIqqI')
+MAGIC = b'GATR'
+VERSION = 1
+FLAG_ZLIB = 1
+
+# bytes(status.pieces) 每个 piece 一个字节（0/1），先转成 '0'/'1' 再用 int 打包成位图
+_TO_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def pack_bits(flags):
+    """[bool] -> 位图，最高位对应第一个 piece（与 BitTorrent bitfield 一致）"""
+    if not flags:
+        return b''
+    digits = bytes(flags).translate(_TO_DIGITS)
+    padding = -len(digits) % 8
+    return int(digits + b'0' * padding, 2).to_bytes((len(digits) + padding) // 8, 'big')
+
+
+def unpack_bits(bitfield, count):
+    """位图 -> '0'/'1' 组成的 bytes，长度为 count"""
+    if count == 0:
+        return b''
+    digits = bin(int.from_bytes(bitfield, 'big'))[2:].encode()
+    return digits.rjust(len(bitfield) * 8, b'0')[:count]
+
+
+class ResumeState:
+    """紧凑的续传状态：已下载 piece 的位图加上 info-hash、piece 数和已上传水位"""
+
+    def __init__(self, info_hash, num_pieces, bitfield, uploaded_watermark=-1, timestamp=None):
+        self.info_hash = info_hash  # 20 字节
+        self.num_pieces = num_pieces
+        self.bitfield = bitfield
+        self.uploaded_watermark = uploaded_watermark
+        self.timestamp = timestamp if timestamp is not None else int(time.time())
+
+    @classmethod
+    def from_handle(cls, handle, uploaded_watermark=-1):
+        """一次 status 调用取回全部 piece 状态，不再逐个调用 have_piece"""
+        return cls.from_status(handle.status(lt.torrent_handle.query_pieces), uploaded_watermark)
+
+    @classmethod
+    def from_status(cls, status, uploaded_watermark=-1):
+        """从带 piece 位图（query_pieces）的 torrent_status 生成"""
+        info_hash = status.info_hashes.get_best().to_bytes()
+        return cls(info_hash, len(status.pieces), pack_bits(status.pieces), uploaded_watermark)
+
+    @property
+    def have_count(self):
+        return unpack_bits(self.bitfield, self.num_pieces).count(b'1')
+
+    def have_pieces(self):
+        """已下载的 piece 索引"""
+        digits = unpack_bits(self.bitfield, self.num_pieces)
+        return [i for i, d in enumerate(digits) if d == 0x31]
+
+    def piece_priorities(self, have_priority=0, default_priority=4):
+        """每个 piece 的优先级列表，可直接传给 prioritize_pieces"""
+        table = bytes.maketrans(b'01', bytes([default_priority, have_priority]))
+        return list(unpack_bits(self.bitfield, self.num_pieces).translate(table))
+
+    def apply(self, handle):
+        """已下载的 piece 优先级设为 0，一次调用批量设置"""
+        if handle.info_hashes().get_best().to_bytes() != self.info_hash:
+            raise ValueError("Resume state belongs to a different torrent")
+        handle.prioritize_pieces(self.piece_priorities())
+
+    def to_bytes(self, compress=True):
+        payload = self.bitfield
+        flags = 0
+        if compress:
+            compressed = zlib.compress(payload, 9)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_ZLIB
+        header = HEADER.pack(MAGIC, VERSION, flags, self.info_hash, self.num_pieces,
+                             self.uploaded_watermark, self.timestamp, len(payload))
+        return header + payload
+
+    @classmethod
+    def from_bytes(cls, data, info_hash=None):
+        """解析续传状态；也能读取旧版 JSON 格式（downloaded_pieces 列表），这时需要传入 info_hash"""
+        if data[:1] == b'{':
+            return cls.from_legacy_json(json.loads(data), info_hash)
+        magic, version, flags, stored_hash, num_pieces, watermark, timestamp, length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a resume state file")
+        payload = data[HEADER.size:HEADER.size + length]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return cls(stored_hash, num_pieces, payload, watermark, timestamp)
+
+    @classmethod
+    def from_legacy_json(cls, progress_data, info_hash=None):
+        num_pieces = progress_data['total_pieces']
+        flags = bytearray(num_pieces)
+        for piece in progress_data['downloaded_pieces']:
+            flags[piece] = 1
+        return cls(info_hash or bytes(20), num_pieces, pack_bits(flags),
+                   progress_data.get('last_uploaded_piece', -1))
+
+    def save(self, path):
+        data = self.to_bytes()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return data
+
+    @classmethod
+    def load(cls, path, info_hash=None):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read(), info_hash)
@@ -0,0 +1,203 @@
+import asyncio
+import email.utils
+import json
+import os
+import random
+import time
+
+from io_executor import io_executor
+
+# 这些状态码是暂时性的，其余的 4xx（401、403、404、422……）重试也不会成功
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+
+
+def error_status(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def retry_after(error):
+    """从 429/503 响应的 Retry-After（秒数或 HTTP 日期）或 RateLimit 头中取得等待秒数"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            # 格式不对时按正常的退避时间重试
+            return None
+        return max(0.0, date.timestamp() - time.time()) if date else None
+    try:
+        from huggingface_hub.utils import parse_ratelimit_headers
+        info = parse_ratelimit_headers(headers)
+    except ImportError:
+        return None
+    if info and info.remaining == 0:
+        return float(info.reset_in_seconds)
+    return None
+
+
+def is_retryable(error):
+    """状态码是暂时性的，或者没有 HTTP 响应（连接错误、超时）；代码本身的错误不重试"""
+    status = error_status(error)
+    if status is not None:
+        return status in RETRY_STATUS
+    return not isinstance(error, (ValueError, TypeError, LookupError, AttributeError, NotImplementedError))
+
+
+class Retrier:
+    """上传用的重试：指数退避加随机抖动，遵守 Retry-After
+
+    第 n 次重试前等待 [0, min(cap, base * 2^n)) 之间的随机秒数（full jitter），多个上传方
+    不会同时重试；429 等带 Retry-After 的响应按服务器要求等待（不超过 max_wait）。
+    同一个实例可以由多个上传方共用，stats() 汇总重试和失败次数。
+    """
+
+    def __init__(self, retries=5, base=1.0, cap=60.0, max_wait=600.0):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.max_wait = max_wait
+        self.random = random.Random()
+
+        self.calls = 0
+        self.retried = 0
+        self.throttled = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+
+    def delay(self, attempt, error):
+        if error_status(error) == 429:
+            self.throttled += 1
+        wait = retry_after(error)
+        if wait is None:
+            wait = self.random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        return min(wait, self.max_wait)
+
+    def next_delay(self, attempt, error, description):
+        """返回重试前的等待秒数；不应重试时返回 None"""
+        if attempt >= self.retries or not is_retryable(error):
+            self.failed += 1
+            return None
+        delay = self.delay(attempt, error)
+        self.retried += 1
+        self.wait_seconds += delay
+        print(f"\n{description or 'Upload'} failed ({error}), retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, func, *args, description=None, **kwargs):
+        """同步调用，失败时在当前线程中等待后重试"""
+        self.calls += 1
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self.next_delay(attempt, e, description)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def run(self, func, *args, description=None, resource="hub", **kwargs):
+        """在 io_executor 的 resource 线程池中调用阻塞的 func，不占用事件循环；等待用 asyncio.sleep"""
+        self.calls += 1
+        attempt = 0
+        while True:
+            try:
+                return await io_executor.run(resource, func, *args, **kwargs)
+            except Exception as e:
+                delay = self.next_delay(attempt, e, description)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "failed": self.failed,
+            "wait_seconds": round(self.wait_seconds, 2),
+        }
+
+
+class DeadLetterQueue:
+    """重试用尽后仍然失败的 piece，保存在 JSON 文件中，重启后在任务结束前再上传一次
+
+    在事件循环中使用 add_async/discard_async，文件在 io_executor 的 disk 线程池中写。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # {piece 序号: {"error": 最后一次错误, "failures": 失败次数}}
+        self._write_lock = asyncio.Lock()  # 按调用顺序写文件，旧内容不会覆盖新内容
+        try:
+            with open(path) as f:
+                self.entries = {int(key): value for key, value in json.load(f).items()}
+        except (OSError, ValueError):
+            pass
+
+    def record(self, pieces, error):
+        for piece in pieces:
+            entry = self.entries.setdefault(piece, {"error": "", "failures": 0})
+            entry["error"] = str(error)
+            entry["failures"] += 1
+
+    def remove(self, pieces):
+        """返回是否有 piece 被移除"""
+        removed = [piece for piece in pieces if self.entries.pop(piece, None) is not None]
+        return bool(removed)
+
+    def add(self, pieces, error):
+        self.record(pieces, error)
+        self.save()
+
+    def discard(self, pieces):
+        if self.remove(pieces):
+            self.save()
+
+    async def add_async(self, pieces, error):
+        self.record(pieces, error)
+        await self.save_async()
+
+    async def discard_async(self, pieces):
+        if self.remove(pieces):
+            await self.save_async()
+
+    def save(self):
+        self.write(json.dumps(self.entries) if self.entries else None)
+
+    async def save_async(self):
+        # 在事件循环中序列化，线程中只写文件
+        data = json.dumps(self.entries) if self.entries else None
+        async with self._write_lock:
+            await io_executor.run("disk", self.write, data)
+
+    def write(self, data):
+        """data 为 None 时删除文件"""
+        if data is None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + ".tmp", 'w') as f:
+            f.write(data)
+        os.replace(self.path + ".tmp", self.path)
+
+    def __contains__(self, piece):
+        return piece in self.entries
+
+    def __iter__(self):
+        return iter(sorted(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
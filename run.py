@@ -1,30 +1,32 @@
 import libtorrent as lt
 import time
 import os
-import hashlib
+import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from huggingface_hub import HfApi
+from verify_pieces import verify, files_for_pieces
+from metadata_cache import MetadataCache
+from session_profiles import apply_profile
+from status_cache import StatusCache
+from streaming import StreamingDownload, disable_uploads, punch_hole_supported
+from chunked_upload import ChunkedUploader
 
 def print_file_hashes(torrent_info, save_path):
-    print("Torrent files and their hashes:")
+    """按 piece 哈希校验保存目录中的文件，列出需要重新下载的 piece"""
+    print("Verifying files against piece hashes...")
+    result = verify(torrent_info, save_path=save_path)
+    broken = files_for_pieces(torrent_info, result["bad"] + result["missing"])
     for file_index in range(torrent_info.num_files()):
-        file_entry = torrent_info.file_at(file_index)
-        file_path = os.path.join(save_path, file_entry.path)
-        print(f"File: {file_entry.path}")
-        print(f"Expected Hash: {file_entry.sha1_hash}")
-        if os.path.exists(file_path):
-            local_hash = compute_file_hash(file_path)
-            print(f"Local Hash: {local_hash}")
+        path = torrent_info.files().file_path(file_index)
+        if torrent_info.files().file_flags(file_index) & lt.file_storage.flag_pad_file:
+            continue
+        if path in broken:
+            print(f"File: {path} - {len(broken[path])} bad pieces: {sorted(broken[path])}")
         else:
-            print("Local file not found.")
-        print()
-
-def compute_file_hash(file_path):
-    sha1 = hashlib.sha1()
-    with open(file_path, 'rb') as f:
-        while chunk := f.read(8192):
-            sha1.update(chunk)
-    return sha1.hexdigest()
+            print(f"File: {path} - OK")
+    print(f"Checked {result['checked']} pieces: {len(result['bad'])} bad, {len(result['missing'])} missing")
+    return result
 
 def format_size(size):
     if size < 1024:
@@ -36,22 +38,93 @@ def format_size(size):
     else:
         return f"{size / (1024 * 1024 * 1024):.2f} GB"
 
-def print_progress(handle, files):
-    s = handle.status()
-    file_status = handle.file_status()
+def print_progress(handle, files, s):
+    # file_status() 返回的是打开的文件句柄，已下载字节数要用 file_progress()
+    file_progress = handle.file_progress()
     
     # Move cursor to the beginning of the progress display
     print("\033[F" * (len(files) + 2))
     
     for i, file_info in enumerate(files):
         file_size = file_info["size"]
-        downloaded = file_status[i].bytes_complete
+        downloaded = file_progress[file_info["index"]]
         print(f"{file_info['path']} - {format_size(downloaded)} / {format_size(file_size)}")
     
     print(f"Total: {format_size(s.total_done)} / {format_size(s.total_wanted)}")
     print(f"Download: {s.download_rate / 1000:.1f} kB/s, Upload: {s.upload_rate / 1000:.1f} kB/s, Peers: {s.num_peers}")
 
-def download_torrent_with_priority(magnet_link, save_path, huggingface_token):
+def stream_pieces(ses, handle, api, repo_id, repo_type, save_path, disk_budget, status_cache):
+    """磁盘配额模式：本地最多保留 disk_budget 字节，按 piece 边下载边上传边释放"""
+    stream = StreamingDownload(ses, handle, api, repo_id, repo_type, disk_budget, save_path)
+    print(f"Streaming {stream.num_pieces} pieces, at most {stream.window} on disk ({format_size(disk_budget)})")
+
+    def report(stream):
+        s = status_cache.get(handle)
+        print(f"\rUploaded: {stream.uploaded}/{stream.num_pieces} pieces, "
+              f"On disk: {stream.resident} pieces, "
+              f"Download: {s.download_rate / 1000:.1f} kB/s, Peers: {s.num_peers}", end='', flush=True)
+
+    stream.run(status_cache, report)
+    print(f"\nStreamed {stream.uploaded} pieces, peak {stream.peak_resident} pieces on disk")
+    if stream.failed:
+        print(f"Could not read {len(stream.failed)} pieces from disk: {stream.failed}")
+    # 数据都已上传，文件里只剩空洞
+    ses.remove_torrent(handle, lt.session.delete_files)
+
+def upload_file(uploader, file_info, save_path):
+    local_file_path = os.path.join(save_path, file_info["path"])
+    if not os.path.exists(local_file_path):
+        return
+    print(f"Uploading {local_file_path} to Hugging Face...")
+    parts = uploader.upload_file(local_file_path, file_info["path"])
+    if parts:
+        print(f"Uploaded {local_file_path} to Hugging Face in {parts} parts ({file_info['path']}.parts/).")
+    else:
+        print(f"Uploaded {local_file_path} to Hugging Face.")
+    os.remove(local_file_path)
+    print(f"Deleted local file {local_file_path}.")
+
+def download_files(ses, handle, files, uploader, save_path, disk_budget, status_cache, interval=5):
+    """逐个文件下载，文件 N 在后台线程上传时已经开始下载文件 N+1
+
+    已下载、尚未上传删除的文件加上正在下载的文件不超过 disk_budget 字节时才开始下一个文件；
+    本地没有其他文件时总是可以开始，所以比配额还大的文件也能下载。disk_budget 为 0 时
+    与原来一样，上传完一个文件才下载下一个。
+    """
+    # 等待磁盘配额时 torrent 处于 finished 状态，默认会断开做种的 peer，之后也不会重新连接
+    ses.apply_settings({'close_redundant_connections': False})
+    handle.prioritize_files([0] * len(handle.file_priorities()))
+
+    queue = list(files)
+    downloading = None
+    uploads = []  # [(future, file_info)]
+    on_disk = 0  # 已开始下载、尚未上传删除的字节数
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="FileUpload") as executor:
+        while queue or downloading or uploads:
+            for future, file_info in [u for u in uploads if u[0].done()]:
+                uploads.remove((future, file_info))
+                on_disk -= file_info["size"]
+                future.result()  # 上传失败时与原来一样抛出异常
+
+            if downloading is None and queue and (on_disk == 0 or on_disk + queue[0]["size"] <= disk_budget):
+                downloading = queue.pop(0)
+                on_disk += downloading["size"]
+                handle.file_priority(downloading["index"], 7)
+
+            status_cache.refresh_sync()
+            print_progress(handle, files, status_cache.get(handle))
+            if downloading is not None:
+                # piece_granularity：只统计已通过校验的 piece
+                progress = handle.file_progress(lt.torrent_handle.piece_granularity)
+                if progress[downloading["index"]] >= downloading["size"]:
+                    handle.file_priority(downloading["index"], 0)
+                    uploads.append((executor.submit(upload_file, uploader, downloading, save_path), downloading))
+                    downloading = None
+                    continue
+            time.sleep(interval)
+
+def download_torrent_with_priority(magnet_link, save_path, huggingface_token, disk_budget=None,
+                                   part_size=256 * 1024 * 1024):
     # 创建 HfApi 实例
     api = HfApi()
 
@@ -80,24 +153,51 @@ def download_torrent_with_priority(magnet_link, save_path, huggingface_token):
         print("Skipping repository creation and continuing...")
 
     ses = lt.session()
-    params = {
-        'save_path': save_path,
-        'storage_mode': lt.storage_mode_t.storage_mode_sparse,
-    }
-    handle = lt.add_magnet_uri(ses, magnet_link, params)
+    apply_profile(ses)
+    streaming = disk_budget and punch_hole_supported(save_path)
+    if streaming:
+        # 打过洞的 piece 不能发给其他 peer，要在任何 peer 连上之前设置
+        disable_uploads(ses)
+    # 之前拿到过 metadata 时直接使用缓存，不用再等待 DHT
+    metadata_cache = MetadataCache(os.path.join(save_path, "metadata"), api, repo_id, REPO_TYPE)
+    params = metadata_cache.add_params(magnet_link)
+    params.save_path = save_path
+    params.storage_mode = lt.storage_mode_t.storage_mode_sparse
+    handle = ses.add_torrent(params)
+    status_cache = StatusCache(ses)
     handle.set_sequential_download(1)
     ses.start_dht()
 
     print('Downloading Metadata...')
-    while not handle.has_metadata():
-        time.sleep(1)
+    while True:
+        status_cache.refresh_sync()
+        if status_cache.get(handle).has_metadata:
+            break
+        time.sleep(0.1)
+
+    # 大文件分块并行上传，中断后从已提交的分块继续
+    uploader = ChunkedUploader(api, repo_id, REPO_TYPE, part_size=part_size,
+                               manifest_folder=os.path.join(save_path, ".uploads"))
 
     print('Got Metadata, Starting Torrent Download...')
     torrent_info = handle.get_torrent_info()
-    
+    metadata_cache.put(torrent_info)
+
+    if disk_budget:
+        if streaming:
+            stream_pieces(ses, handle, api, repo_id, REPO_TYPE, save_path, disk_budget, status_cache)
+            print('Download Complete')
+            return
+        print("Filesystem does not support punching holes, keeping whole files within the budget")
+    else:
+        # 没有设置配额时，按开始下载时的剩余空间决定最多能领先多少
+        disk_budget = shutil.disk_usage(save_path).free
+
+    # 跳过 v2/hybrid torrent 中的填充文件，它们不会写到磁盘上
     files = sorted([
         {"index": i, "path": torrent_info.files().file_path(i), "size": torrent_info.files().file_size(i)}
         for i in range(torrent_info.num_files())
+        if not torrent_info.files().file_flags(i) & lt.file_storage.flag_pad_file
     ], key=lambda x: x["size"], reverse=True)
 
     # Print initial file list
@@ -105,30 +205,7 @@ def download_torrent_with_priority(magnet_link, save_path, huggingface_token):
         print(f"{file_info['path']} - {format_size(file_info['size'])}")
     print()
 
-    for file_info in files:
-        # Set current file highest priority
-        handle.file_priority(file_info["index"], 7)
-        # Set other files to not download
-        for other in files:
-            if other["index"] != file_info["index"]:
-                handle.file_priority(other["index"], 0)
-
-        while handle.status().state != lt.torrent_status.seeding:
-            print_progress(handle, files)
-            time.sleep(5)
-        
-        # File downloaded, move to Hugging Face
-        local_file_path = os.path.join(save_path, file_info["path"])
-        if os.path.exists(local_file_path):
-            print(f"Uploading {local_file_path} to Hugging Face...")
-            api.upload_file(
-                path_or_fileobj=local_file_path,
-                path_in_repo=file_info["path"],
-                repo_id=repo_id,
-                repo_type=REPO_TYPE)
-            print(f"Uploaded {local_file_path} to Hugging Face.")
-            os.remove(local_file_path)
-            print(f"Deleted local file {local_file_path}.")
+    download_files(ses, handle, files, uploader, save_path, disk_budget, status_cache)
 
     print('Download Complete')
 
@@ -137,4 +214,9 @@ if __name__ == "__main__":
     magnet_link = "magnet:?xt=urn:btih:8123f386aa6a45e26161753a3c0778f8b9b4d4cb&dn=Totoro_FTR-4_F_EN-en-CCAP_US-G_51_2K_GKID_20230303_GKD_IOP_OV&tr=http%3A%2F%2Fnyaa.tracker.wf%3A7777%2Fannounce&tr=udp%3A%2F%2Fopen.stealth.si%3A80%2Fannounce&tr=udp%3A%2F%2Ftracker.opentrackr.org%3A1337%2Fannounce&tr=udp%3A%2F%2Fexodus.desync.com%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.torrent.eu.org%3A451%2Fannounce"
     save_path = "Torrent/"
     huggingface_token = sys.argv[1]
-    download_torrent_with_priority(magnet_link, save_path, huggingface_token)
+    # 设置 TORRENT_DISK_BUDGET_GB 时本地最多保留这么多 torrent 数据，适合比 runner 磁盘还大的文件
+    disk_budget_gb = os.environ.get('TORRENT_DISK_BUDGET_GB')
+    disk_budget = int(float(disk_budget_gb) * 1024 ** 3) if disk_budget_gb else None
+    # 超过 TORRENT_UPLOAD_PART_MB 的文件分块上传
+    part_size = int(float(os.environ.get('TORRENT_UPLOAD_PART_MB', 256)) * 1024 ** 2)
+    download_torrent_with_priority(magnet_link, save_path, huggingface_token, disk_budget, part_size)
@@ -3,23 +3,11 @@ import websockets
 import json
 import subprocess
 import sys
-from http.server import SimpleHTTPRequestHandler, HTTPServer
 from download_torrent import TorrentDownloader, start_download
+from downloader import download_manager
+from web_server import start_http_server
 import threading
 
-class CustomHandler(SimpleHTTPRequestHandler):
-    def end_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        return super().end_headers()
-
-def start_http_server():
-    server_address = ('', 8000)
-    httpd = HTTPServer(server_address, CustomHandler)
-    print("HTTP server running on http://localhost:8000")
-    httpd.serve_forever()
-
 async def websocket_handler(websocket, path):
     async for message in websocket:
         await websocket.send(message)
@@ -62,16 +50,18 @@ def start_cloudflared():
         print(f"Error starting cloudflared: {str(e)}")
 
 async def main(magnet_link, save_path, huggingface_token):
-    http_server_thread = threading.Thread(target=start_http_server)
-    http_server_thread.daemon = True
-    http_server_thread.start()
+    # HTTP 服务与 WebSocket 服务运行在同一个事件循环中
+    http_runner = await start_http_server(download_manager.get_download_data)
 
     cloudflared_thread = threading.Thread(target=start_cloudflared)
     cloudflared_thread.daemon = True
     cloudflared_thread.start()
 
     await start_websocket_server()
-    await start_download(magnet_link, save_path, huggingface_token)
+    try:
+        await start_download(magnet_link, save_path, huggingface_token)
+    finally:
+        await http_runner.cleanup()
 
 if __name__ == "__main__":
     magnet_link = "magnet:?xt=urn:btih:8123f386aa6a45e26161753a3c0778f8b9b4d4cb&dn=Totoro_FTR-4_F_EN-en-CCAP_US-G_51_2K_GKID_20230303_GKD_IOP_OV&tr=http%3A%2F%2Fnyaa.tracker.wf%3A7777%2Fannounce&tr=udp%3A%2F%2Fopen.stealth.si%3A80%2Fannounce&tr=udp%3A%2F%2Ftracker.opentrackr.org%3A1337%2Fannounce&tr=udp%3A%2F%2Fexodus.desync.com%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.torrent.eu.org%3A451%2Fannounce"
@@ -3,25 +3,12 @@ import websockets
 import json
 import subprocess
 import sys
-from http.server import SimpleHTTPRequestHandler, HTTPServer
 
 from k import start_download
 import threading
 from datetime import datetime
 from dler import download_manager
-
-class CustomHandler(SimpleHTTPRequestHandler):
-    def end_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        return super().end_headers()
-
-def start_http_server():
-    server_address = ('', 8000)
-    httpd = HTTPServer(server_address, CustomHandler)
-    print("HTTP server running on http://localhost:8000")
-    httpd.serve_forever()
+from web_server import start_http_server
 
 def read_output(pipe, prefix):
 
@@ -92,8 +79,7 @@ async def websocket_handler(websocket, path):
     await download_manager.register(websocket)
     try:
         async for message in websocket:
-            # Handle any client messages if needed
-            pass
+            await download_manager.handle_message(websocket, message)
     finally:
         await download_manager.unregister(websocket)
 
@@ -102,10 +88,11 @@ async def start_websocket_server():
         await asyncio.Future()  # run forever
 
 async def main(magnet_link, save_path, huggingface_token):
-    # Start the HTTP server
-    http_thread = threading.Thread(target=start_http_server)
-    http_thread.daemon = True
-    http_thread.start()
+    # Start the HTTP server on this event loop
+    http_runner = await start_http_server(
+        download_manager.get_current_status,
+        lambda: download_manager.seq
+    )
 
     # Start cloudflared
     cloudflared_process = start_cloudflared()
@@ -115,7 +102,10 @@ async def main(magnet_link, save_path, huggingface_token):
 
 
     # Start the torrent downloader
-    await start_download(magnet_link, save_path, huggingface_token)
+    try:
+        await start_download(magnet_link, save_path, huggingface_token)
+    finally:
+        await http_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+import asyncio
+import libtorrent as lt
+
+
+class StatusCache:
+    """用 post_torrent_updates + state_update_alert 维护 torrent_status 快照
+
+    每个 tick 调用一次 refresh()，libtorrent 只报告状态有变化的 torrent；控制台、
+    WebSocket 和保存进度都读取同一份快照，不再各自调用 handle.status()。
+    """
+
+    def __init__(self, session, alerts=None, flags=0, timeout=5):
+        self.session = session
+        self.alerts = alerts  # 为 None 时用 wait_for_alert 同步获取（run.py）
+        self.flags = flags
+        self.timeout = timeout
+        self.statuses = {}  # {handle: torrent_status}
+        self.updates = 0
+        self.refreshes = 0
+        self._pending = {}  # {flags: 正在进行的 refresh}
+
+    async def refresh(self, flags=None):
+        """请求一次状态更新并等待 state_update_alert，返回本次有变化的 handle 列表
+
+        多个下载共用一个 session 时，同时发起的 refresh 合并成一次 post_torrent_updates。
+        """
+        flags = self.flags if flags is None else flags
+        pending = self._pending.get(flags)
+        if pending is None:
+            pending = self._pending[flags] = asyncio.ensure_future(self._refresh(flags))
+            pending.add_done_callback(lambda _: self._pending.pop(flags, None))
+        return await asyncio.shield(pending)
+
+    async def _refresh(self, flags):
+        update = self.alerts.wait_for(lt.state_update_alert)
+        self.session.post_torrent_updates(flags)
+        try:
+            alert = await asyncio.wait_for(update, self.timeout)
+        except asyncio.TimeoutError:
+            return []
+        return self.apply(alert.status)
+
+    def refresh_sync(self, flags=None):
+        """同步版本，会取走 session 中所有排队的 alert，只适用于没有 AlertDispatcher 的脚本"""
+        self.session.post_torrent_updates(self.flags if flags is None else flags)
+        if self.session.wait_for_alert(int(self.timeout * 1000)) is None:
+            return []
+        changed = []
+        for alert in self.session.pop_alerts():
+            if isinstance(alert, lt.state_update_alert):
+                changed += self.apply(alert.status)
+        return changed
+
+    def apply(self, statuses):
+        self.refreshes += 1
+        changed = []
+        for status in statuses:
+            self.statuses[status.handle] = status
+            changed.append(status.handle)
+        self.updates += len(changed)
+        return changed
+
+    def get(self, handle):
+        """最近一次的状态；还没有收到过更新时直接查询一次"""
+        status = self.statuses.get(handle)
+        if status is None:
+            status = self.statuses[handle] = handle.status(self.flags)
+        return status
+
+    async def get_with_pieces(self, handle):
+        """带 piece 位图的状态，用于保存进度"""
+        await self.refresh(lt.torrent_handle.query_pieces)
+        status = self.get(handle)
+        if status.has_metadata and not status.pieces:
+            # 状态没有变化时不会被报告，缓存里没有位图
+            status = handle.status(lt.torrent_handle.query_pieces)
+        return status
+
+    def forget(self, handle):
+        self.statuses.pop(handle, None)
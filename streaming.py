@@ -0,0 +1,290 @@
+import ctypes
+import ctypes.util
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import libtorrent as lt
+from huggingface_hub import CommitOperationAdd
+
+from alerts import AlertDispatcher
+from combine_pieces import FileLayout
+from retry import Retrier
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+# piece 状态
+WAITING, DOWNLOADING, DOWNLOADED, EVICTED, FAILED = range(5)
+
+MAX_READ_RETRIES = 3  # read_piece 出错后的重试次数，超过后放弃这个 piece
+READ_RETRY_DELAY = 0.5  # 第 n 次重试前等待 READ_RETRY_DELAY * 2^(n-1) 秒
+
+# 不给任何 peer unchoke，不提供 allowed-fast piece；乐观 unchoke 至少有一个名额，只能把间隔设得足够长
+NO_UPLOAD_SETTINGS = {
+    'unchoke_slots_limit': 0,
+    'allowed_fast_set_size': 0,
+    'optimistic_unchoke_interval': 2 ** 30,
+}
+
+_fallocate = None
+
+
+def punch_hole(fd, offset, length):
+    """释放文件中一段区域占用的磁盘块，文件大小不变，读出来是 0（Linux fallocate）"""
+    global _fallocate
+    if _fallocate is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _fallocate = libc.fallocate
+        _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    if _fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def punch_hole_supported(folder):
+    """在 folder 所在的文件系统上试一次打洞（ext4、xfs、btrfs、tmpfs 支持）"""
+    os.makedirs(folder, exist_ok=True)
+    try:
+        with tempfile.TemporaryFile(dir=folder) as f:
+            f.write(b'\1' * 1024 * 1024)
+            f.flush()
+            os.fsync(f.fileno())
+            allocated = os.fstat(f.fileno()).st_blocks
+            punch_hole(f.fileno(), 0, 1024 * 1024)
+            return os.fstat(f.fileno()).st_blocks < allocated
+    except (OSError, AttributeError):
+        return False
+
+
+def disable_uploads(session):
+    """让 session 不再向任何 peer 上传数据，打过洞的 piece 读出来是 0，发出去会让对方校验失败
+
+    设置只在下一次 unchoke 计算时生效，已经 unchoke 的 peer 不受影响，所以要在添加 torrent 之前调用。
+    """
+    session.apply_settings(NO_UPLOAD_SETTINGS)
+    # 局域网（包括回环）中的 peer 默认不受 unchoke 名额限制，总是 unchoke
+    session.set_peer_class(lt.session.local_peer_class_id, {'ignore_unchoke_slots': False})
+
+
+class StreamingDownload:
+    """在固定的磁盘配额内边下载、边上传、边释放
+
+    只给窗口中的 piece 设置优先级，本地最多保留 budget 字节的 piece 数据；piece 下载完成后
+    用 read_piece 读出，攒成批次在后台线程提交到仓库的 pieces/piece_N.dat，提交成功后对
+    文件中对应的区域打洞，窗口再向后移动。窗口满时不再设置新的 piece，下载自然暂停。
+
+    打洞后的区域读出来是 0，但 libtorrent 仍然认为自己有这些 piece；发给其他 peer 会让对方
+    校验失败并封禁这个客户端，所以这个 session 不上传任何数据（disable_uploads，添加 torrent 前
+    调用；start() 会再调用一次）。
+    读取 piece 出错时最多重试 MAX_READ_RETRIES 次，之后这个 piece 记为失败（failed）。
+    """
+
+    def __init__(self, session, handle, api, repo_id, repo_type, budget, save_path,
+                 batch_bytes=256 * 1024 * 1024, max_in_flight=2, folder_in_repo="pieces", retrier=None):
+        self.session = session
+        self.handle = handle
+        self.api = api
+        self.repo_id = repo_id
+        self.repo_type = repo_type
+        self.save_path = save_path
+        self.batch_bytes = batch_bytes
+        self.max_in_flight = max_in_flight
+        self.folder_in_repo = folder_in_repo
+        self.retrier = retrier or Retrier()
+
+        self.torrent_info = handle.torrent_file()
+        self.layout = FileLayout.from_torrent(self.torrent_info)
+        self.num_pieces = self.torrent_info.num_pieces()
+        self.window = max(1, budget // self.torrent_info.piece_length())  # 窗口中的 piece 数
+        if budget < self.torrent_info.piece_length():
+            print("Disk budget is smaller than one piece, keeping 1 piece on disk")
+
+        self.state = bytearray(self.num_pieces)
+        self.next_piece = 0
+        self.resident = 0  # 在磁盘上、尚未打洞的 piece 数（下载中 + 已下载）
+        self.downloading = 0
+        self.batch = []  # [(piece, bytes)]
+        self.batch_size = 0
+        self.commits = []  # [(future, batch)]
+        self.fds = {}  # {文件下标: fd}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PieceCommit")
+
+        self.uploaded = 0
+        self.bytes_punched = 0
+        self.peak_resident = 0
+        self.failed_commits = 0
+        self.read_failures = {}  # {piece: 读取失败次数}
+        self.read_retries = {}  # {piece: 下次重试的时间}
+        self.failed = []  # 多次读取失败、放弃的 piece
+
+    def start(self):
+        self.session.apply_settings({
+            # 只需要 piece 完成、read_piece 和错误三类 alert
+            'alert_mask': AlertDispatcher.categories_for((lt.piece_finished_alert, lt.read_piece_alert))
+                          | int(lt.alert.category_t.error_notification),
+            # 窗口里的 piece 都下载完、等待上传时 torrent 处于 finished 状态，默认会断开所有做种的
+            # peer，之后窗口前移也不会重新连接
+            'close_redundant_connections': False,
+        })
+        disable_uploads(self.session)
+        self.handle.prioritize_pieces([0] * self.num_pieces)
+        self.fill_window()
+
+    @property
+    def done(self):
+        return self.uploaded + len(self.failed) == self.num_pieces
+
+    def fill_window(self):
+        """窗口有空位时把后面的 piece 设为最高优先级，一次调用批量设置"""
+        priorities = []
+        while self.resident < self.window and self.next_piece < self.num_pieces:
+            piece = self.next_piece
+            self.next_piece += 1
+            self.state[piece] = DOWNLOADING
+            self.resident += 1
+            self.downloading += 1
+            if self.handle.have_piece(piece):
+                # 之前已经下载过（例如重启后校验通过）
+                self.handle.read_piece(piece)
+            else:
+                priorities.append((piece, 7))
+        self.peak_resident = max(self.peak_resident, self.resident)
+        if priorities:
+            self.handle.prioritize_pieces(priorities)
+
+    def handle_alert(self, alert):
+        if isinstance(alert, lt.piece_finished_alert):
+            if self.state[alert.piece_index] == DOWNLOADING:
+                self.handle.read_piece(alert.piece_index)
+        elif isinstance(alert, lt.read_piece_alert):
+            if alert.error.value():
+                self.read_failed(alert.piece, alert.error.message())
+            elif self.state[alert.piece] == DOWNLOADING:
+                self.state[alert.piece] = DOWNLOADED
+                self.downloading -= 1
+                self.batch.append((alert.piece, bytes(alert.buffer)))
+                self.batch_size += len(alert.buffer)
+        elif alert.category() & lt.alert.category_t.error_notification:
+            print(f"\nError: {alert.message()}")
+
+    def read_failed(self, piece, message):
+        """读取出错后按退避时间重试，超过 MAX_READ_RETRIES 次后放弃"""
+        if self.state[piece] != DOWNLOADING:
+            return
+        failures = self.read_failures.get(piece, 0) + 1
+        self.read_failures[piece] = failures
+        if failures <= MAX_READ_RETRIES:
+            delay = READ_RETRY_DELAY * 2 ** (failures - 1)
+            print(f"\nError reading piece {piece}: {message}, retrying in {delay:.1f}s")
+            self.read_retries[piece] = time.monotonic() + delay
+            return
+        print(f"\nError reading piece {piece}: {message}, giving up after {MAX_READ_RETRIES} retries")
+        # 不再下载，释放它在窗口中的位置
+        self.handle.piece_priority(piece, 0)
+        self.state[piece] = FAILED
+        self.downloading -= 1
+        self.resident -= 1
+        self.failed.append(piece)
+        self.fill_window()
+
+    def retry_reads(self):
+        now = time.monotonic()
+        for piece, due in list(self.read_retries.items()):
+            if due <= now:
+                del self.read_retries[piece]
+                self.handle.read_piece(piece)
+
+    def maybe_commit(self):
+        """批次够大，或者窗口里已经没有在下载的 piece（不提交就无法前进）时提交"""
+        if not self.batch or len(self.commits) >= self.max_in_flight:
+            return
+        if self.batch_size >= self.batch_bytes or self.downloading == 0:
+            batch, self.batch, self.batch_size = self.batch, [], 0
+            self.commits.append((self.executor.submit(self.commit, batch), batch))
+
+    def commit(self, batch):
+        self.retrier.call(
+            self.api.create_commit,
+            description=f"Committing {len(batch)} pieces",
+            repo_id=self.repo_id,
+            repo_type=self.repo_type,
+            operations=[
+                CommitOperationAdd(path_in_repo=f"{self.folder_in_repo}/piece_{piece}.dat", path_or_fileobj=data)
+                for piece, data in batch
+            ],
+            commit_message=f"Upload {len(batch)} pieces",
+        )
+
+    def collect_commits(self):
+        """处理已完成的提交：成功的 piece 打洞并移出窗口，失败的放回批次重试"""
+        remaining = []
+        for future, batch in self.commits:
+            if not future.done():
+                remaining.append((future, batch))
+                continue
+            error = future.exception()
+            if error is not None:
+                self.failed_commits += 1
+                print(f"\nError uploading {len(batch)} pieces: {error}, retrying")
+                self.batch = batch + self.batch
+                self.batch_size += sum(len(data) for _, data in batch)
+                continue
+            for piece, _ in batch:
+                self.evict(piece)
+        self.commits = remaining
+        self.fill_window()
+
+    def evict(self, piece):
+        for file_index, file_offset, _, length in self.layout.segments(piece, self.torrent_info.piece_size(piece)):
+            punch_hole(self.fd(file_index), file_offset, length)
+            self.bytes_punched += length
+        self.state[piece] = EVICTED
+        self.resident -= 1
+        self.uploaded += 1
+
+    def fd(self, file_index):
+        if file_index not in self.fds:
+            path = os.path.join(self.save_path, self.layout.files[file_index][0])
+            self.fds[file_index] = os.open(path, os.O_WRONLY)
+        return self.fds[file_index]
+
+    def run(self, status_cache=None, on_tick=None, tick=1.0):
+        """处理 alert 直到全部 piece 上传；status_cache 的状态由这里的 state_update_alert 更新"""
+        self.start()
+        last_tick = 0
+        try:
+            while not self.done:
+                if self.session.wait_for_alert(100) is not None:
+                    for alert in self.session.pop_alerts():
+                        if isinstance(alert, lt.state_update_alert):
+                            if status_cache:
+                                status_cache.apply(alert.status)
+                        else:
+                            self.handle_alert(alert)
+                self.retry_reads()
+                self.collect_commits()
+                self.maybe_commit()
+                if time.monotonic() - last_tick >= tick:
+                    last_tick = time.monotonic()
+                    self.session.post_torrent_updates(0)
+                    if on_tick:
+                        on_tick(self)
+        finally:
+            self.executor.shutdown(wait=True)
+            for fd in self.fds.values():
+                os.close(fd)
+            self.fds = {}
+
+    def stats(self):
+        return {
+            "uploaded": self.uploaded,
+            "num_pieces": self.num_pieces,
+            "window": self.window,
+            "resident": self.resident,
+            "peak_resident": self.peak_resident,
+            "bytes_punched": self.bytes_punched,
+            "failed_commits": self.failed_commits,
+            "failed_pieces": len(self.failed),
+            "retry": self.retrier.stats(),
+        }
@@ -0,0 +1,278 @@
+import asyncio
+import os
+import threading
+import time
+import libtorrent as lt
+
+C = lt.alert.category_t
+
+# 各 alert 类型所属的类别，用来根据订阅推算 alert_mask；不在表中的类型按全部类别处理
+ALERT_CATEGORIES = {
+    lt.piece_finished_alert: C.piece_progress_notification,
+    lt.read_piece_alert: C.storage_notification,
+    lt.save_resume_data_alert: C.storage_notification,
+    lt.save_resume_data_failed_alert: C.storage_notification | C.error_notification,
+    lt.metadata_received_alert: C.status_notification,
+    lt.metadata_failed_alert: C.error_notification,
+    lt.state_update_alert: 0,  # post_torrent_updates 的结果，不受 alert_mask 限制
+    lt.torrent_finished_alert: C.status_notification,
+    lt.torrent_error_alert: C.error_notification | C.status_notification,
+    lt.file_error_alert: C.error_notification | C.storage_notification | C.status_notification,
+    lt.torrent_removed_alert: C.status_notification,
+    lt.torrent_deleted_alert: C.storage_notification,
+    lt.torrent_delete_failed_alert: C.storage_notification | C.error_notification,
+}
+
+# 错误始终需要记录
+BASE_CATEGORIES = C.error_notification
+
+# 只在排查问题时打开的调试类别
+DEBUG_CATEGORIES = {
+    'peer': C.peer_notification | C.peer_log_notification,
+    'connect': C.connect_notification,
+    'tracker': C.tracker_notification,
+    'dht': C.dht_notification | C.dht_log_notification,
+    'torrent': C.torrent_log_notification,
+    'session': C.session_log_notification,
+    'stats': C.performance_warning,
+}
+
+
+class AlertEvent:
+    """alert 的快照
+
+    libtorrent 会在下一次 pop_alerts 时释放上一批 alert，所以分发给订阅者之前
+    要把需要的字段复制出来。保留 category()/message() 方法，用法和原 alert 一致。
+    """
+
+    # 已废弃或会触发额外拷贝的字段
+    SKIPPED_FIELDS = {'ec', 'resume_data'}
+    _fields = {}
+
+    def __init__(self, alert):
+        self.type = type(alert)
+        self.what = alert.what()
+        self._category = alert.category()
+        self._message = alert.message()
+        for name in self.fields(self.type):
+            try:
+                setattr(self, name, getattr(alert, name))
+            except Exception:
+                pass
+
+    @classmethod
+    def fields(cls, alert_type):
+        if alert_type not in cls._fields:
+            cls._fields[alert_type] = [
+                name for name in dir(alert_type)
+                if isinstance(getattr(alert_type, name, None), property) and name not in cls.SKIPPED_FIELDS
+            ]
+        return cls._fields[alert_type]
+
+    def category(self):
+        return self._category
+
+    def message(self):
+        return self._message
+
+
+class AlertDispatcher:
+    """每个 session 一个的 alert 泵，按类型把 alert 分发给订阅者
+
+    alert_mask 由订阅和等待的 alert 类型推算，只打开实际用到的类别；调试类别通过
+    debug 参数或环境变量 TORRENT_ALERT_DEBUG（逗号分隔，如 "peer,tracker"）打开。
+    """
+
+    def __init__(self, session, debug=None):
+        self.session = session
+        self.loop = None
+        self.subscribers = []  # [(alert_type, category, queue)]
+        self.waiters = []  # [(alert_type, predicate, future)]
+        self.wait_categories = 0  # wait_for 用到过的类别，一直保留，避免反复修改设置
+        self.debug_categories = 0
+        self.mask = None
+        self.alerts_total = 0
+        self.pop_seconds = 0.0  # pop_alerts 占用的 CPU 时间
+        self.dispatch_seconds = 0.0
+        self._rate = []  # [(时间, alert 数)]，最近 10 秒
+        if debug is None:
+            debug = os.environ.get('TORRENT_ALERT_DEBUG', '').split(',')
+        for name in debug:
+            if name:
+                self.enable_debug(name)
+        self.update_mask()
+        self._wakeup = None
+        self._task = None
+        self._thread = None
+        self._drained = threading.Event()
+        self._running = False
+
+    def start(self):
+        """启动 alert 泵，必须在事件循环中调用"""
+        if self._task:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._running = True
+        if hasattr(self.session, 'set_alert_notify'):
+            # libtorrent 在自己的线程里调用此回调，只能线程安全地唤醒事件循环
+            self.session.set_alert_notify(self._notify)
+        else:
+            self._thread = threading.Thread(target=self._wait_loop, name="AlertWaiter", daemon=True)
+            self._thread.start()
+        self._task = asyncio.create_task(self._pump())
+        # 启动前已经排队的 alert 也要处理
+        self._wakeup.set()
+
+    async def stop(self):
+        """停止 alert 泵并取消所有未完成的等待"""
+        self._running = False
+        self._drained.set()
+        if hasattr(self.session, 'set_alert_notify'):
+            self.session.set_alert_notify(lambda: None)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _, _, future in self.waiters:
+            if not future.done():
+                future.cancel()
+        self.waiters = []
+
+    def _notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _wait_loop(self):
+        """没有 set_alert_notify 时，用 wait_for_alert 阻塞等待"""
+        while self._running:
+            if self.session.wait_for_alert(500) is not None:
+                # 等泵取走 alert，避免 wait_for_alert 立即返回造成空转
+                self._drained.clear()
+                self._notify()
+                self._drained.wait(0.5)
+
+    async def _pump(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            started = time.thread_time()
+            alerts = self.session.pop_alerts()
+            popped = time.thread_time()
+            self.dispatch(alerts)
+            self.pop_seconds += popped - started
+            self.dispatch_seconds += time.thread_time() - popped
+            self._record(len(alerts))
+            self._drained.set()
+
+    def _record(self, count):
+        now = time.monotonic()
+        self.alerts_total += count
+        self._rate.append((now, count))
+        while self._rate and now - self._rate[0][0] > 10:
+            self._rate.pop(0)
+
+    @staticmethod
+    def categories_for(alert_type):
+        """一个或一组 alert 类型需要的类别"""
+        if isinstance(alert_type, tuple):
+            mask = 0
+            for t in alert_type:
+                mask |= AlertDispatcher.categories_for(t)
+            return mask
+        if alert_type is lt.alert or alert_type not in ALERT_CATEGORIES:
+            return int(C.all_categories)
+        return int(ALERT_CATEGORIES[alert_type])
+
+    def required_mask(self):
+        mask = int(BASE_CATEGORIES) | self.wait_categories | self.debug_categories
+        for alert_type, category, _ in self.subscribers:
+            mask |= int(category) if category is not None else self.categories_for(alert_type)
+        return mask
+
+    def update_mask(self):
+        """按当前订阅设置 alert_mask，只有变化时才调用 apply_settings"""
+        mask = self.required_mask()
+        if mask != self.mask:
+            self.session.apply_settings({'alert_mask': mask})
+            self.mask = mask
+
+    def enable_debug(self, name):
+        """打开调试类别（peer、connect、tracker、dht、torrent、session、stats）"""
+        self.debug_categories |= int(DEBUG_CATEGORIES[name])
+        if self.mask is not None:
+            self.update_mask()
+
+    def stats(self):
+        """alert 速率和 pop_alerts 的 CPU 开销"""
+        window = self._rate[-1][0] - self._rate[0][0] if len(self._rate) > 1 else 0
+        recent = sum(count for _, count in self._rate[1:])
+        return {
+            "alerts_total": self.alerts_total,
+            "alerts_per_sec": recent / window if window > 0 else 0,
+            "pop_cpu_ms": round(self.pop_seconds * 1000, 1),
+            "dispatch_cpu_ms": round(self.dispatch_seconds * 1000, 1),
+            "alert_mask": hex(self.mask or 0),
+        }
+
+    def dispatch(self, alerts):
+        """把一批 alert 分发给订阅队列和一次性等待者"""
+        for alert in alerts:
+            event = None
+            for alert_type, category, queue in self.subscribers:
+                if isinstance(alert, alert_type) and (category is None or alert.category() & category):
+                    event = event or AlertEvent(alert)
+                    queue.put_nowait(event)
+            if self.waiters:
+                self._resolve_waiters(alert, event)
+
+    def _resolve_waiters(self, alert, event):
+        remaining = []
+        for alert_type, predicate, future in self.waiters:
+            if future.done():
+                continue
+            if isinstance(alert, alert_type):
+                event = event or AlertEvent(alert)
+                if predicate is None or predicate(event):
+                    future.set_result(event)
+                    continue
+            remaining.append((alert_type, predicate, future))
+        self.waiters = remaining
+
+    def subscribe(self, alert_type=lt.alert, category=None):
+        """订阅某类 alert，返回一个接收全部匹配 AlertEvent 的 asyncio.Queue"""
+        queue = asyncio.Queue()
+        self.subscribers.append((alert_type, category, queue))
+        self.update_mask()
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers = [s for s in self.subscribers if s[2] is not queue]
+        self.update_mask()
+
+    def wait_for(self, alert_type, predicate=None):
+        """返回一个 Future，在第一个满足条件的 alert 到达时以 AlertEvent 完成
+
+        必须在触发该 alert 的调用（如 read_piece）之前注册。
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((alert_type, predicate, future))
+        categories = self.categories_for(alert_type)
+        if categories & ~self.wait_categories:
+            self.wait_categories |= categories
+            self.update_mask()
+        return future
+
+    @staticmethod
+    def drain(queue):
+        """取出队列中当前所有 alert，不阻塞"""
+        alerts = []
+        while not queue.empty():
+            alerts.append(queue.get_nowait())
+        return alerts
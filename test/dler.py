@@ -2,9 +2,40 @@ import asyncio
 import json
 from datetime import datetime
 
+from io_executor import loop_monitor
+
+try:
+    import msgpack  # 可选，客户端请求时使用二进制帧
+except ImportError:
+    msgpack = None
+
+PROTOCOL_VERSION = 1
+SEND_TIMEOUT = 10  # 单条消息发送超过这个秒数的客户端会被断开
+
+
+class ClientState:
+    """单个WebSocket客户端的发送状态"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.format = "json"
+        self.pending = None  # 尚未发出的消息，客户端较慢时后续的 delta 会合并进来
+        self.sending = False
+        self.behind = 0  # 合并进 pending、尚未发出的帧数
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+
 class DownloadManager:
-    def __init__(self):
-        self.connected_clients = set()
+    def __init__(self, send_timeout=SEND_TIMEOUT):
+        self.connected_clients = {}  # {websocket: ClientState}
+        self.send_timeout = send_timeout
+        self.seq = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+        self.evicted = 0
+        self.files = {}  # {index: 最近一次广播的文件状态}
         self.current_status = {
             "files": [],
             "peers": 0,
@@ -12,37 +43,187 @@ class DownloadManager:
             "start_time": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
         }
 
-    def update_status(self, files_status, peers, total_progress):
-        """更新当前下载状态并广播给所有连接的客户端"""
+    @staticmethod
+    def compact_file(file_status):
+        """压缩浮点字段，减少每条消息的字节数"""
+        entry = dict(file_status)
+        if "speed" in entry:
+            entry["speed"] = int(entry["speed"])
+        if "progress" in entry:
+            entry["progress"] = round(entry["progress"], 2)
+        return entry
+
+    def update_status(self, files_status, peers, total_progress, changed=None):
+        """更新当前下载状态，并只把变化的字段广播给客户端
+
+        changed 为本次有变化的文件在 files_status 中的下标；不传时逐个比较全部文件。
+        """
+        self.seq += 1
+        entries = files_status if changed is None else (files_status[i] for i in changed)
+        delta_files = {}
+        for entry in entries:
+            entry = self.compact_file(entry)
+            index = entry["index"]
+            last = self.files.get(index)
+            if last is None:
+                self.files[index] = entry
+                delta_files[index] = entry
+                continue
+            fields = {k: v for k, v in entry.items() if last.get(k) != v}
+            if fields:
+                last.update(fields)
+                delta_files[index] = fields
+
+        total_progress = round(total_progress, 2)
+        delta = {"type": "delta", "v": PROTOCOL_VERSION, "seq": self.seq}
+        if delta_files:
+            delta["files"] = delta_files
+        if peers != self.current_status["peers"]:
+            delta["peers"] = peers
+        if total_progress != self.current_status["total_progress"]:
+            delta["total_progress"] = total_progress
+
         self.current_status = {
             "files": files_status,
             "peers": peers,
             "total_progress": total_progress,
+            "start_time": self.current_status["start_time"],
             "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
         }
-        asyncio.create_task(self.broadcast_status())
+        if delta_files or "peers" in delta or "total_progress" in delta:
+            for client in list(self.connected_clients.values()):
+                self.queue_message(client, delta)
+
+    def snapshot(self):
+        """完整状态，客户端连接或请求重新同步时发送"""
+        return {
+            "type": "snapshot",
+            "v": PROTOCOL_VERSION,
+            "seq": self.seq,
+            "files": [self.files[i] for i in sorted(self.files)],
+            "peers": self.current_status["peers"],
+            "total_progress": self.current_status["total_progress"],
+            "start_time": self.current_status["start_time"],
+        }
 
     async def register(self, websocket):
         """注册新的WebSocket客户端"""
-        self.connected_clients.add(websocket)
-        await websocket.send(json.dumps(self.current_status))
+        client = ClientState(websocket)
+        self.connected_clients[websocket] = client
+        self.queue_message(client, self.snapshot())
 
     async def unregister(self, websocket):
         """注销WebSocket客户端"""
-        self.connected_clients.remove(websocket)
+        self.connected_clients.pop(websocket, None)
+
+    async def handle_message(self, websocket, message):
+        """处理客户端消息：{"format": "msgpack"} 切换为二进制帧，{"type": "resync"} 重新发送快照"""
+        client = self.connected_clients.get(websocket)
+        if client is None:
+            return
+        try:
+            request = json.loads(message)
+        except (TypeError, ValueError):
+            return
+        if request.get("format") in ("json", "msgpack"):
+            if request["format"] == "msgpack" and msgpack is None:
+                return
+            client.format = request["format"]
+            client.pending = None
+            self.queue_message(client, self.snapshot())
+        elif request.get("type") == "resync":
+            client.pending = None
+            self.queue_message(client, self.snapshot())
+
+    def queue_message(self, client, message):
+        """把消息交给客户端的发送任务；上一条还没发完时合并到待发送的消息中
+
+        每个客户端最多只有一条待发送消息，被合并掉的帧计入 frames_dropped。
+        """
+        if client.pending is None:
+            client.pending = self.copy_message(message)
+        else:
+            client.behind += 1
+            client.frames_dropped += 1
+            self.frames_dropped += 1
+            if message["type"] == "snapshot":
+                client.pending = self.copy_message(message)
+            elif client.pending["type"] == "snapshot":
+                # 快照中已有的文件条目就是 self.files 中的对象，但之后新增的文件不在里面，重新生成
+                client.pending = self.snapshot()
+            else:
+                self.merge_delta(client.pending, message)
+        if not client.sending:
+            client.sending = True
+            asyncio.create_task(self.send_pending(client))
+
+    @staticmethod
+    def copy_message(message):
+        message = dict(message)
+        if isinstance(message.get("files"), dict):
+            message["files"] = {i: dict(f) for i, f in message["files"].items()}
+        return message
 
-    async def broadcast_status(self):
-        """向所有连接的客户端广播状态更新"""
-        if self.connected_clients:
-            message = json.dumps(self.current_status)
-            await asyncio.gather(
-                *[client.send(message) for client in self.connected_clients],
-                return_exceptions=True
-            )
+    @staticmethod
+    def merge_delta(pending, delta):
+        """把新的 delta 合并进尚未发出的 delta，客户端只会收到最新状态"""
+        for key in ("seq", "peers", "total_progress"):
+            if key in delta:
+                pending[key] = delta[key]
+        if "files" not in delta:
+            return
+        files = pending.setdefault("files", {})
+        for index, fields in delta["files"].items():
+            files.setdefault(index, {}).update(fields)
+
+    def encode(self, client, message):
+        if client.format == "msgpack":
+            return msgpack.packb(message, use_bin_type=True)
+        return json.dumps(message, separators=(",", ":"))
+
+    async def send_pending(self, client):
+        try:
+            while client.pending is not None and client.websocket in self.connected_clients:
+                message, client.pending = client.pending, None
+                client.behind = 0
+                data = self.encode(client, message)
+                await asyncio.wait_for(client.websocket.send(data), self.send_timeout)
+                client.frames_sent += 1
+                self.frames_sent += 1
+                self.bytes_sent += len(data)
+        except asyncio.TimeoutError:
+            await self.evict(client)
+        except Exception:
+            await self.unregister(client.websocket)
+        finally:
+            client.sending = False
+
+    async def evict(self, client):
+        """断开发送超时的慢客户端，释放它的待发送消息"""
+        self.evicted += 1
+        client.pending = None
+        await self.unregister(client.websocket)
+        # 关闭握手本身也可能卡住，放到后台执行
+        asyncio.create_task(client.websocket.close(code=1008, reason="slow consumer"))
+
+    def get_metrics(self):
+        """广播路径的指标：客户端数、积压帧数、合并丢弃的帧数、被断开的客户端数和事件循环延迟"""
+        clients = list(self.connected_clients.values())
+        return {
+            "clients": len(clients),
+            "sending": sum(1 for c in clients if c.sending),
+            "queue_depth": sum(1 for c in clients if c.pending is not None),
+            "max_frames_behind": max((c.behind for c in clients), default=0),
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "bytes_sent": self.bytes_sent,
+            "evicted": self.evicted,
+            "loop_lag": loop_monitor.stats(),
+        }
 
     def get_current_status(self):
         """获取当前状态"""
         return self.current_status
 
 # 创建全局下载管理器实例
-download_manager = DownloadManager()
\ No newline at end of file
+download_manager = DownloadManager()
@@ -0,0 +1,144 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 每类资源一个线程池：Hub 请求受网络和速率限制，磁盘读写受磁盘队列限制，
+# 分开后长时间的上传不会占满文件读写的线程
+POOL_SIZES = {"hub": 4, "disk": 2}
+
+
+class IOExecutor:
+    """事件循环中的阻塞调用（HfApi、文件读写）都通过 run() 放到对应资源的线程池中执行
+
+    stats() 给出每个线程池的调用次数、排队等待时间和执行时间，排队时间长说明线程池太小。
+    """
+
+    def __init__(self, pools=None):
+        self.sizes = dict(POOL_SIZES if pools is None else pools)
+        self.executors = {}
+        self.lock = threading.Lock()
+        self.counters = {
+            resource: {"calls": 0, "active": 0, "busy_seconds": 0.0, "queue_seconds": 0.0, "max_queue_seconds": 0.0}
+            for resource in self.sizes
+        }
+
+    def executor(self, resource):
+        if resource not in self.sizes:
+            raise ValueError(f"Unknown I/O resource {resource!r}, expected one of {sorted(self.sizes)}")
+        with self.lock:
+            executor = self.executors.get(resource)
+            if executor is None:
+                executor = self.executors[resource] = ThreadPoolExecutor(
+                    max_workers=self.sizes[resource], thread_name_prefix=f"IO-{resource}")
+            return executor
+
+    def _timed(self, resource, submitted, func, args, kwargs):
+        started = time.monotonic()
+        counters = self.counters[resource]
+        with self.lock:
+            counters["calls"] += 1
+            counters["active"] += 1
+            counters["queue_seconds"] += started - submitted
+            counters["max_queue_seconds"] = max(counters["max_queue_seconds"], started - submitted)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self.lock:
+                counters["active"] -= 1
+                counters["busy_seconds"] += time.monotonic() - started
+
+    def submit(self, resource, func, *args, **kwargs):
+        """在同步代码中使用，返回 concurrent.futures.Future"""
+        return self.executor(resource).submit(self._timed, resource, time.monotonic(), func, args, kwargs)
+
+    async def run(self, resource, func, *args, **kwargs):
+        """在 resource 对应的线程池中调用 func，等待期间不占用事件循环"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._timed, resource, time.monotonic(), func, args, kwargs)
+        return await loop.run_in_executor(self.executor(resource), call)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            executors, self.executors = list(self.executors.values()), {}
+        for executor in executors:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self.lock:
+            return {
+                resource: {
+                    "threads": self.sizes[resource],
+                    "calls": c["calls"],
+                    "active": c["active"],
+                    "busy_seconds": round(c["busy_seconds"], 2),
+                    "queue_seconds": round(c["queue_seconds"], 2),
+                    "max_queue_ms": round(c["max_queue_seconds"] * 1000, 1),
+                }
+                for resource, c in self.counters.items()
+            }
+
+
+class LoopLagMonitor:
+    """测量事件循环被阻塞的时间
+
+    每隔 interval 秒 sleep 一次，实际醒来比预期晚的部分就是这段时间内事件循环没能调度的时间。
+    单次超过 warn 秒时打印一行，stats() 汇总最大延迟和累计阻塞时间。
+    """
+
+    def __init__(self, interval=0.1, warn=0.5):
+        self.interval = interval
+        self.warn = warn
+        self.task = None
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.stalls = 0  # 超过 warn 的次数
+        self.stall_seconds = 0.0
+
+    def start(self):
+        """在当前事件循环中开始测量，已经在运行时什么也不做"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - expected))
+
+    def record(self, lag):
+        self.samples += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
+        if lag >= self.warn:
+            self.stalls += 1
+            self.stall_seconds += lag
+            print(f"\nEvent loop blocked for {lag:.2f}s")
+
+    def stats(self):
+        return {
+            "lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "mean_lag_ms": round(self.total_lag / self.samples * 1000, 1) if self.samples else 0.0,
+            "stalls": self.stalls,
+            "stall_seconds": round(self.stall_seconds, 2),
+        }
+
+
+# 全局实例，同一进程中的下载和上传共用线程池
+io_executor = IOExecutor()
+loop_monitor = LoopLagMonitor()
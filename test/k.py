@@ -1,14 +1,23 @@
 import libtorrent as lt
 import time
 import os
-import sys
-import json
-import zipfile
 import shutil
+import tempfile
+import io
 from huggingface_hub import HfApi, login
 from datetime import datetime, timezone
 import asyncio
 from dler import download_manager
+from alerts import AlertDispatcher
+from piece_store import PieceStore
+from progress_model import ProgressModel, STATE_MAP
+from resume_state import ResumeState
+from metadata_cache import MetadataCache
+from session_profiles import apply_profile
+from status_cache import StatusCache
+from archive_packer import ArchivePacker
+from retry import Retrier, DeadLetterQueue
+from io_executor import io_executor, loop_monitor
 
 def format_size(size):
     """格式化文件大小"""
@@ -24,20 +33,39 @@ class TorrentDownloader:
         self.save_path = save_path
         self.pieces_folder = os.path.join(save_path, "pieces")
         self.temp_folder = os.path.join(save_path, "temp")
-        self.metadata_file = os.path.join(save_path, "torrent_metadata.json")
-        self.progress_file = os.path.join(save_path, "download_progress.json")
+        self.metadata_folder = os.path.join(save_path, "metadata")
+        self.progress_file = os.path.join(save_path, "download_progress.bin")
         self.huggingface_token = huggingface_token
         self.api = HfApi()
         self.USERNAME = "servejjjhjj"
         self.REPO_NAME = 'mp4-dataset'
         self.REPO_TYPE = 'dataset'
         self.session = lt.session()
+        self.progress_model = None
+        self.alerts = AlertDispatcher(self.session)
+        self.status_cache = StatusCache(self.session, self.alerts)
+        self.metadata_cache = MetadataCache(
+            self.metadata_folder,
+            self.api,
+            f'{self.USERNAME}/{self.REPO_NAME}',
+            self.REPO_TYPE
+        )
 
         # 配置参数
         self.UPLOAD_INTERVAL = 60  # 60秒检查一次是否需要上传
         self.STATUS_UPDATE_INTERVAL = 1  # 1秒更新一次状态
         self.PIECES_PER_ARCHIVE = 100  # 每个压缩包包含的piece数量
         self.MAX_RETRIES = 3  # 上传重试次数
+        self.PIECE_MEMORY_LIMIT = 512 * 1024 * 1024  # 暂存piece的内存上限，超出后写入pieces目录
+        self.ARCHIVE_MEMORY_LIMIT = 256 * 1024 * 1024  # 压缩包在内存中的上限，超出后写入temp目录
+        self.ARCHIVE_CODEC = 'deflate'  # 可压缩的 piece 使用的压缩方式（Python 3.14 起可用 zstd）
+        self.ARCHIVE_LEVEL = None  # None 表示该压缩方式的默认级别（deflate 1，zstd 3）
+
+        self.piece_store = PieceStore(self.pieces_folder, self.PIECE_MEMORY_LIMIT)
+        self.packer = ArchivePacker(self.ARCHIVE_CODEC, self.ARCHIVE_LEVEL)
+        self.retrier = Retrier(self.MAX_RETRIES)
+        # 重试用尽后仍上传失败的 piece，下载结束前再上传一次；重启后也会读取
+        self.dead_letters = DeadLetterQueue(os.path.join(save_path, "failed_pieces.json"))
 
         # 创建必要的目录
         for folder in [self.pieces_folder, self.temp_folder]:
@@ -45,7 +73,6 @@ class TorrentDownloader:
 
         # 配置libtorrent会话
         settings = {
-            'alert_mask': lt.alert.category_t.all_categories,
             'enable_dht': True,
             'enable_lsd': True,
             'enable_upnp': True,
@@ -54,47 +81,23 @@ class TorrentDownloader:
             'upload_rate_limit': 0,  # 0 表示无限制
             'alert_queue_size': 10000,
         }
-        self.session.apply_settings(settings)
+        self.SESSION_PROFILE = apply_profile(self.session, overrides=settings)
 
     async def save_piece(self, handle, piece_index):
-        """异步保存piece到文件"""
+        """异步读取piece并暂存到内存，超出内存预算时才写入文件"""
         try:
-            # 创建 Future 对象用于等待回调
-            piece_future = asyncio.Future()
-
-            # 定义回调函数
-            def piece_read_callback(piece_buffer):
-                if not piece_future.done():
-                    piece_future.set_result(piece_buffer)
-
-            # 调用 read_piece
+            # 先注册等待再调用 read_piece，由 alert 泵在数据到达时唤醒
+            piece_future = self.alerts.wait_for(lt.read_piece_alert, lambda a: a.piece == piece_index)
             handle.read_piece(piece_index)
 
-            # 等待回调完成，设置超时时间
             try:
-            # 循环处理alerts直到获取到所需的piece数据
-                async with asyncio.timeout(10):  # 10秒超时
-                    while not piece_future.done():
-                        alerts = self.session.pop_alerts()
-                        for alert in alerts:
-                            if isinstance(alert, lt.read_piece_alert):
-                                if alert.piece == piece_index and not piece_future.done():
-                                    piece_future.set_result(alert.buffer)
-                        await asyncio.sleep(0.1)
-
-                piece_buffer = await piece_future
+                alert = await asyncio.wait_for(piece_future, 10)  # 10秒超时
+                piece_buffer = alert.buffer
                 if not piece_buffer:
                     print(f"No data received for piece {piece_index}")
                     return None
 
-
-
-            # 保存 piece 数据到文件
-                piece_path = os.path.join(self.pieces_folder, f"piece_{piece_index}.dat")
-                with open(piece_path, 'wb') as f:
-                    f.write(piece_buffer)
-
-                return piece_path
+                return await self.piece_store.put_async(f"piece_{piece_index}.dat", piece_buffer)
             except asyncio.TimeoutError:
                 print(f"Timeout reading piece {piece_index}")
                 return None
@@ -105,144 +108,156 @@ class TorrentDownloader:
             return None
 
     def create_piece_archive(self, start_piece, end_piece, successful_pieces):
-        """将多个piece打包成zip文件"""
-        try:
-            archive_name = f"pieces_{start_piece}_to_{end_piece}.zip"
-            archive_path = os.path.join(self.temp_folder, archive_name)
-
-            with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for piece_index in successful_pieces:
-                    piece_path = os.path.join(self.pieces_folder, f"piece_{piece_index}.dat")
-                    if os.path.exists(piece_path):
-                        zf.write(piece_path, f"piece_{piece_index}.dat")
-                        os.remove(piece_path)  # 删除已打包的piece文件
+        """将多个piece打包成zip（按内容选择存储或压缩），压缩包写在内存中，超过 ARCHIVE_MEMORY_LIMIT 时才用临时文件
 
-            return archive_path
+        压缩和读取暂存文件会阻塞，在 io_executor 的 disk 线程池中调用。
+        """
+        try:
+            pieces = {}
+            for piece_index in successful_pieces:
+                piece_data = self.piece_store.get(f"piece_{piece_index}.dat")
+                if piece_data:
+                    pieces[f"piece_{piece_index}.dat"] = piece_data
+
+            archive_size = sum(
+                len(data) if isinstance(data, bytes) else os.path.getsize(data)
+                for data in pieces.values()
+            )
+            if archive_size <= self.ARCHIVE_MEMORY_LIMIT:
+                archive = io.BytesIO()
+            else:
+                archive = tempfile.TemporaryFile(dir=self.temp_folder)
+
+            # 已经压缩过的视频数据直接存储，只有能压缩的 piece 才压缩
+            self.packer.pack(pieces, archive)
+            archive.seek(0)
+            return archive
         except Exception as e:
             print(f"Error creating archive: {e}")
             return None
 
-    async def upload_piece_archive(self, archive_path, start_piece, end_piece):
-        """上传piece压缩包到HuggingFace"""
-        for attempt in range(self.MAX_RETRIES):
-            try:
-                self.api.upload_file(
-                    path_or_fileobj=archive_path,
-                    path_in_repo=f"test/pieces/archive_{start_piece}_to_{end_piece}.zip",
-                    repo_id=f'{self.USERNAME}/{self.REPO_NAME}',
-                    repo_type=self.REPO_TYPE
-                )
-                os.remove(archive_path)
+    async def upload_piece_archive(self, archive, start_piece, end_piece):
+        """上传piece压缩包到HuggingFace，重试用尽后返回最后一次的错误，成功时返回 None"""
+        def upload():
+            archive.seek(0)
+            self.api.upload_file(
+                path_or_fileobj=archive,
+                path_in_repo=f"test/pieces/archive_{start_piece}_to_{end_piece}.zip",
+                repo_id=f'{self.USERNAME}/{self.REPO_NAME}',
+                repo_type=self.REPO_TYPE
+            )
+
+        try:
+            # 在线程中上传，失败时指数退避后重试（遵守 Retry-After）
+            await self.retrier.run(upload, description=f"Uploading pieces {start_piece} to {end_piece}")
+            return None
+        except Exception as e:
+            print(f"Upload of pieces {start_piece} to {end_piece} failed: {e}")
+            return e
+        finally:
+            archive.close()
+
+    async def upload_pieces(self, handle, pieces):
+        """把暂存的 pieces 打包上传，失败时释放暂存数据并记入 dead_letters，返回是否成功"""
+        start_piece = min(pieces)
+        end_piece = max(pieces)
+        archive = await io_executor.run("disk", self.create_piece_archive, start_piece, end_piece, pieces)
+        error = "could not create archive"
+        if archive:
+            error = await self.upload_piece_archive(archive, start_piece, end_piece)
+            if error is None:
+                print(f"Successfully uploaded pieces {start_piece} to {end_piece}")
+                await self.save_progress_to_file(handle, end_piece)
+                await self.release_pieces(pieces)
+                await self.dead_letters.discard_async(pieces)
                 return True
-            except Exception as e:
-                print(f"Upload attempt {attempt + 1} failed: {e}")
-                await asyncio.sleep(5)  # 等待一段时间后重试
+        print(f"\nPieces {start_piece} to {end_piece} will be retried before the download ends")
+        await self.release_pieces(pieces)
+        await self.dead_letters.add_async(pieces, error)
         return False
 
-    def load_progress_from_file(self):
+    async def retry_dead_letters(self, handle):
+        """重新读取并上传之前上传失败的 piece（包括上次运行留下的）"""
+        pieces = [piece for piece in self.dead_letters if handle.have_piece(piece)]
+        if not pieces:
+            return
+        print(f"\nRetrying {len(pieces)} pieces that failed to upload...")
+        saved = [piece for piece in pieces if await self.save_piece(handle, piece)]
+        for i in range(0, len(saved), self.PIECES_PER_ARCHIVE):
+            await self.upload_pieces(handle, saved[i:i + self.PIECES_PER_ARCHIVE])
+        if self.dead_letters:
+            print(f"\n{len(self.dead_letters)} pieces could not be uploaded, listed in {self.dead_letters.path}")
+
+    async def release_pieces(self, pieces):
+        """释放已打包的piece（上传成功，或已记入 dead_letters）"""
+        for piece_index in pieces:
+            await self.piece_store.pop_async(f"piece_{piece_index}.dat")
+
+    def load_progress_from_file(self, info_hash=None):
         """从本地文件加载下载进度"""
         try:
             if os.path.exists(self.progress_file):
-                with open(self.progress_file, 'r') as f:
-                    progress_data = json.load(f)
-                print(f"Loaded progress: {len(progress_data['downloaded_pieces'])} pieces downloaded")
-                return progress_data
+                state = ResumeState.load(self.progress_file, info_hash)
+                print(f"Loaded progress: {state.have_count} pieces downloaded")
+                return state
         except Exception as e:
             print(f"Error loading progress: {e}")
         return None
 
-    def save_progress_to_file(self, handle, last_uploaded_piece):
+    async def save_progress_to_file(self, handle, last_uploaded_piece):
         """保存下载进度到本地文件"""
-        progress_data = {
-            "last_uploaded_piece": last_uploaded_piece,
-            "downloaded_pieces": [i for i in range(handle.status().torrent_file.num_pieces())
-                                if handle.have_piece(i)],
-            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-            "total_pieces": handle.status().torrent_file.num_pieces()
-        }
+        status = await self.status_cache.get_with_pieces(handle)
+        state = ResumeState.from_status(status, last_uploaded_piece)
 
         try:
-            with open(self.progress_file, 'w') as f:
-                json.dump(progress_data, f, indent=2)
+            data = await io_executor.run("disk", state.save, self.progress_file)
 
             # 上传进度文件到HuggingFace
-            self.api.upload_file(
-                path_or_fileobj=self.progress_file,
-                path_in_repo="test/download_progress.json",
+            await io_executor.run(
+                "hub",
+                self.api.upload_file,
+                path_or_fileobj=data,
+                path_in_repo="test/download_progress.bin",
                 repo_id=f'{self.USERNAME}/{self.REPO_NAME}',
                 repo_type=self.REPO_TYPE
             )
         except Exception as e:
             print(f"Error saving progress: {e}")
 
-        return progress_data
+        return state
 
-    def update_ui_status(self, handle):
-        """更新UI状态"""
+    def update_ui_status(self, handle, status=None):
+        """更新UI状态，status 为本 tick 的状态快照"""
         try:
-            status = handle.status()
-            torrent_file = status.torrent_file
-
-            if not torrent_file:
+            status = status or self.status_cache.get(handle)
+            if not status.has_metadata:
                 return
 
-            state_map = {
-                0: 'queued',
-                1: 'checking',
-                2: 'downloading metadata',
-                3: 'downloading',
-                4: 'finished',
-                5: 'seeding',
-                6: 'allocating'
-            }
-            state_str = state_map.get(status.state, 'unknown')
-
-            file_progress = handle.file_progress()
-            files_status = []
-            total_downloaded = 0
-            total_size = 0
+            # 文件表只在拿到 metadata 后读取一次
+            if self.progress_model is None:
+                self.progress_model = ProgressModel(handle.torrent_file())
+            model = self.progress_model
+
+            state_str = STATE_MAP.get(status.state, 'unknown')
 
             try:
-                for file_index in range(torrent_file.num_files()):
-                    try:
-                        file_path = torrent_file.files().file_path(file_index)
-                        file_size = torrent_file.files().file_size(file_index)
-                        downloaded = file_progress[file_index]
-
-                        file_speed = 0
-                        if torrent_file.total_size() > 0:
-                            file_speed = (status.download_rate * file_size) / torrent_file.total_size()
-
-                        files_status.append({
-                            "index": file_index,
-                            "path": file_path,
-                            "size": file_size,
-                            "downloaded": downloaded,
-                            "speed": file_speed,
-                            "progress": (downloaded / file_size * 100) if file_size > 0 else 0,
-                            "state": state_str
-                        })
-
-                        total_downloaded += downloaded
-                        total_size += file_size
-                    except Exception as e:
-                        print(f"Error processing file {file_index}: {e}")
-                        continue
-
-                total_progress = 0
-                if total_size > 0:
-                    total_progress = (total_downloaded / total_size * 100)
+                changed = model.update(model.read_file_progress(handle), state_str)
+                total_progress = model.total_progress
 
+                # 更新UI
                 download_manager.update_status(
-                    files_status,
+                    model.files_status,
                     status.num_peers,
-                    total_progress
+                    total_progress,
+                    changed
                 )
 
+                # 打印命令行进度
                 print(f'\rProgress: {total_progress:.2f}% '
                       f'Speed: {format_size(status.download_rate)}/s '
                       f'Peers: {status.num_peers} '
-                      f'State: {state_str}', end='', flush=True)
+                      f'State: {state_str} '
+                      f'Loop lag: {loop_monitor.max_lag * 1000:.0f} ms', end='', flush=True)
 
             except Exception as e:
                 print(f"\nError calculating progress: {e}")
@@ -254,11 +269,15 @@ class TorrentDownloader:
         """主下载逻辑"""
         print(f'Current Date and Time (UTC): {datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")}')
 
+        # 测量事件循环被阻塞的时间，阻塞调用都应经过 io_executor
+        loop_monitor.start()
         try:
-            login(token=self.huggingface_token)
+            await io_executor.run("hub", login, token=self.huggingface_token)
             print("Successfully logged in to Hugging Face")
 
-            repo_url = self.api.create_repo(
+            repo_url = await io_executor.run(
+                "hub",
+                self.api.create_repo,
                 repo_id=f"{self.USERNAME}/{self.REPO_NAME}",
                 repo_type=self.REPO_TYPE,
                 private=False,
@@ -271,19 +290,27 @@ class TorrentDownloader:
             self.session.add_dht_router("router.utorrent.com", 6881)
             self.session.add_dht_router("dht.transmissionbt.com", 6881)
 
-            # 创建torrent handle
-            atp = lt.add_torrent_params()
-            atp.url = self.magnet_link
+            self.alerts.start()
+
+            # 创建torrent handle，缓存中有 metadata 时直接使用
+            atp = await io_executor.run("hub", self.metadata_cache.add_params, self.magnet_link)
             atp.save_path = self.save_path
             handle = self.session.add_torrent(atp)
+            metadata_received = self.alerts.wait_for(lt.metadata_received_alert, lambda a: a.handle == handle)
 
             print('Downloading metadata...')
-            while not handle.status().has_metadata:
-                self.update_ui_status(handle)
-                await asyncio.sleep(1)
+            while True:
+                await self.status_cache.refresh()
+                status = self.status_cache.get(handle)
+                if status.has_metadata:
+                    break
+                self.update_ui_status(handle, status)
+                await asyncio.wait([metadata_received], timeout=1)
+            metadata_received.cancel()
 
             print('\nGot metadata, starting download...')
             torrent_info = handle.get_torrent_info()
+            await io_executor.run("hub", self.metadata_cache.put, torrent_info)
             print(f"Total size: {format_size(torrent_info.total_size())}")
             print(f"Number of pieces: {torrent_info.num_pieces()}")
 
@@ -291,36 +318,34 @@ class TorrentDownloader:
             last_upload_time = time.time()
             pending_pieces = []
 
-            while not handle.status().is_seeding:
+            while True:
+                # 每个 tick 只取一次状态快照
+                await self.status_cache.refresh()
+                status = self.status_cache.get(handle)
+                # 不需要的 piece（优先级 0）不在本地时 torrent 只会到 finished，不会到 seeding
+                finished = status.is_finished
                 current_time = time.time()
-                self.update_ui_status(handle)
-
-                # 计算当前下载的piece
-                current_piece = int(handle.status().progress * torrent_info.num_pieces())
-
-                # 保存新下载的pieces
-                for piece_index in range(last_processed_piece + 1, current_piece + 1):
-                    if handle.have_piece(piece_index):
-                        piece_path = await self.save_piece(handle, piece_index)
-                        if piece_path:
-                            pending_pieces.append(piece_index)
-                            print(f"Saved piece {piece_index}")
-
-                last_processed_piece = current_piece
+                self.update_ui_status(handle, status)
+
+                # 保存新下载的pieces：从上次的位置起连续已下载的部分
+                while (last_processed_piece + 1 < torrent_info.num_pieces()
+                       and handle.have_piece(last_processed_piece + 1)):
+                    piece_index = last_processed_piece + 1
+                    piece_data = await self.save_piece(handle, piece_index)
+                    if piece_data:
+                        pending_pieces.append(piece_index)
+                        print(f"Saved piece {piece_index}")
+                    last_processed_piece = piece_index
+                if finished:
+                    break
 
                 # 检查是否需要上传
                 if (len(pending_pieces) >= self.PIECES_PER_ARCHIVE or
                     (current_time - last_upload_time >= self.UPLOAD_INTERVAL and pending_pieces)):
                     print(f"\nUploading {len(pending_pieces)} pieces")
-                    start_piece = min(pending_pieces)
-                    end_piece = max(pending_pieces)
-
-                    archive_path = self.create_piece_archive(start_piece, end_piece, pending_pieces)
-                    if archive_path:
-                        if await self.upload_piece_archive(archive_path, start_piece, end_piece):
-                            print(f"Successfully uploaded pieces {start_piece} to {end_piece}")
-                            self.save_progress_to_file(handle, end_piece)
-                            pending_pieces = []  # 清空已上传的pieces
+                    # 失败的 piece 记入 dead_letters，下载结束前再上传
+                    await self.upload_pieces(handle, pending_pieces)
+                    pending_pieces = []
 
                     last_upload_time = current_time
 
@@ -330,24 +355,21 @@ class TorrentDownloader:
 
             # 上传剩余的pieces
             if pending_pieces:
-                start_piece = min(pending_pieces)
-                end_piece = max(pending_pieces)
-                print(f"\nUploading final pieces {start_piece} to {end_piece}")
-
-                archive_path = self.create_piece_archive(start_piece, end_piece, pending_pieces)
-                if archive_path:
-                    if await self.upload_piece_archive(archive_path, start_piece, end_piece):
-                        print(f"Successfully uploaded final pieces")
-                        self.save_progress_to_file(handle, end_piece)
-
-            # 清理临时文件
-            if os.path.exists(self.pieces_folder):
-                shutil.rmtree(self.pieces_folder)
-            if os.path.exists(self.temp_folder):
-                shutil.rmtree(self.temp_folder)
+                print(f"\nUploading final pieces {min(pending_pieces)} to {max(pending_pieces)}")
+                await self.upload_pieces(handle, pending_pieces)
+            await self.retry_dead_letters(handle)
+
+            # 清理临时文件；还有上传失败的 piece 时保留，下次运行从 failed_pieces.json 继续
+            if not self.dead_letters:
+                for folder in (self.pieces_folder, self.temp_folder):
+                    if os.path.exists(folder):
+                        await io_executor.run("disk", shutil.rmtree, folder)
 
         except Exception as e:
             print(f"Download error: {e}")
+        finally:
+            await self.alerts.stop()
+            await loop_monitor.stop()
 
 async def start_download(magnet_link, save_path, huggingface_token):
     """启动下载任务"""
@@ -0,0 +1,113 @@
+import os
+import libtorrent as lt
+
+
+class MetadataCache:
+    """按 info-hash 缓存 torrent 的 info-dict
+
+    第一次从 DHT/peer 拿到 metadata 后保存到本地目录和 Hub 仓库，之后的运行直接把它
+    作为 atp.ti 使用，不再等待 "Downloading metadata..."。
+    """
+
+    def __init__(self, cache_folder, api=None, repo_id=None, repo_type=None, folder_in_repo="metadata"):
+        self.cache_folder = cache_folder
+        self.api = api
+        self.repo_id = repo_id
+        self.repo_type = repo_type
+        self.folder_in_repo = folder_in_repo
+
+    @staticmethod
+    def key(info_hashes):
+        """有 v1 时用 v1：btih magnet 只有 v1，而 hybrid torrent 的 get_best() 是 v2"""
+        best = info_hashes.v1 if info_hashes.has_v1() else info_hashes.get_best()
+        return best.to_bytes().hex()
+
+    @staticmethod
+    def matches(expected, actual):
+        """只比较 expected（magnet）中有的 info-hash 类型"""
+        if expected.has_v1() and expected.v1 != actual.v1:
+            return False
+        if expected.has_v2() and expected.v2 != actual.v2:
+            return False
+        return True
+
+    def local_path(self, key):
+        return os.path.join(self.cache_folder, f"{key}.torrent")
+
+    def get(self, magnet_link):
+        """返回缓存的 lt.torrent_info，没有缓存或内容不匹配时返回 None"""
+        expected = lt.parse_magnet_uri(magnet_link).info_hashes
+        key = self.key(expected)
+        data = self.read_local(key)
+        from_hub = False
+        if data is None:
+            data = self.read_hub(key)
+            from_hub = data is not None
+        if data is None:
+            return None
+        try:
+            torrent_info = lt.torrent_info(data)
+        except Exception as e:
+            print(f"Invalid cached metadata for {key}: {e}")
+            return None
+        if not self.matches(expected, torrent_info.info_hashes()):
+            print(f"Cached metadata for {key} does not match the magnet link, ignoring it")
+            return None
+        if from_hub:
+            self.write_local(key, data)
+        return torrent_info
+
+    def add_params(self, magnet_link):
+        """magnet 对应的 add_torrent_params，有缓存时已经带上 ti"""
+        params = lt.parse_magnet_uri(magnet_link)
+        torrent_info = self.get(magnet_link)
+        if torrent_info is not None:
+            params.ti = torrent_info
+        return params
+
+    def put(self, torrent_info, upload=True):
+        """保存 metadata；只保存 info-dict，原样写回以保证 info-hash 不变"""
+        key = self.key(torrent_info.info_hashes())
+        if os.path.exists(self.local_path(key)):
+            return key
+        data = b'd4:info' + bytes(torrent_info.info_section()) + b'e'
+        self.write_local(key, data)
+        if upload and self.api:
+            try:
+                self.api.upload_file(
+                    path_or_fileobj=data,
+                    path_in_repo=f"{self.folder_in_repo}/{key}.torrent",
+                    repo_id=self.repo_id,
+                    repo_type=self.repo_type
+                )
+            except Exception as e:
+                print(f"Error uploading metadata: {e}")
+        return key
+
+    def read_local(self, key):
+        path = self.local_path(key)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        return None
+
+    def write_local(self, key, data):
+        os.makedirs(self.cache_folder, exist_ok=True)
+        tmp_path = self.local_path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.local_path(key))
+
+    def read_hub(self, key):
+        if not self.api:
+            return None
+        try:
+            path = self.api.hf_hub_download(
+                repo_id=self.repo_id,
+                repo_type=self.repo_type,
+                filename=f"{self.folder_in_repo}/{key}.torrent"
+            )
+        except Exception:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
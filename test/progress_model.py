@@ -0,0 +1,99 @@
+import time
+import libtorrent as lt
+
+STATE_MAP = {
+    0: 'queued',
+    1: 'checking',
+    2: 'downloading metadata',
+    3: 'downloading',
+    4: 'finished',
+    5: 'seeding',
+    6: 'allocating'
+}
+
+
+class ProgressModel:
+    """缓存 torrent 的文件表，每个 tick 只计算字节数有变化的文件
+
+    文件路径和大小在拿到 metadata 后只读取一次；update() 返回本次变化的文件索引，
+    files_status 中只有这些条目会被改写。
+    """
+
+    def __init__(self, torrent_info):
+        files = torrent_info.files()
+        self.num_files = files.num_files()
+        self.paths = [files.file_path(i) for i in range(self.num_files)]
+        self.sizes = [files.file_size(i) for i in range(self.num_files)]
+        self.total_size = sum(self.sizes)
+        self.downloaded = [0] * self.num_files
+        self.speeds = {}  # 上个 tick 有速度的文件 {index: bytes/s}
+        self.total_downloaded = 0
+        self.state = None
+        self.last_tick = None
+        self.files_status = [
+            {
+                "index": i,
+                "path": self.paths[i],
+                "size": self.sizes[i],
+                "downloaded": 0,
+                "speed": 0,
+                "progress": 0,
+                "state": None,
+            }
+            for i in range(self.num_files)
+        ]
+
+    @staticmethod
+    def read_file_progress(handle):
+        # 按 piece 粒度统计，避免 libtorrent 逐个 block 扫描未完成的 piece
+        return handle.file_progress(flags=lt.torrent_handle.piece_granularity)
+
+    def update(self, file_progress, state=None, now=None):
+        """传入 handle.file_progress() 的结果，返回本次有变化的文件索引列表"""
+        now = now if now is not None else time.monotonic()
+        elapsed = now - self.last_tick if self.last_tick is not None else 0
+        self.last_tick = now
+
+        changed = []
+        if file_progress != self.downloaded:
+            for i, (new, old) in enumerate(zip(file_progress, self.downloaded)):
+                if new != old:
+                    changed.append(i)
+                    self.total_downloaded += new - old
+                    self.downloaded[i] = new
+                    speed = (new - old) / elapsed if elapsed > 0 else 0
+                    self._set(i, downloaded=new, speed=speed)
+
+        # 上个 tick 还在下载、这次没有变化的文件，速度归零
+        stalled = self.speeds.keys() - set(changed)
+        for i in stalled:
+            self._set(i, speed=0)
+        changed.extend(stalled)
+
+        if state is not None and state != self.state:
+            self.state = state
+            for entry in self.files_status:
+                entry["state"] = state
+            changed = list(range(self.num_files))
+
+        return changed
+
+    def _set(self, i, downloaded=None, speed=None):
+        entry = self.files_status[i]
+        if downloaded is not None:
+            entry["downloaded"] = downloaded
+            entry["progress"] = (downloaded / self.sizes[i] * 100) if self.sizes[i] > 0 else 0
+        if speed is not None:
+            entry["speed"] = speed
+            if speed:
+                self.speeds[i] = speed
+            else:
+                self.speeds.pop(i, None)
+
+    @property
+    def total_progress(self):
+        return (self.total_downloaded / self.total_size * 100) if self.total_size > 0 else 0
+
+    def diff(self, changed):
+        """只包含变化文件的状态列表"""
+        return [self.files_status[i] for i in changed]
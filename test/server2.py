@@ -3,61 +3,13 @@ import websockets
 import json
 import subprocess
 import sys
-from http.server import SimpleHTTPRequestHandler, HTTPServer
 from k import start_download
-import threading
 from datetime import datetime, UTC
 from dler import download_manager
 import time
 import aiohttp
 import signal
-
-class HealthCheckHandler(SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/healthz':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            response = {'status': 'ok', 'timestamp': datetime.now(UTC).isoformat()}
-            self.wfile.write(json.dumps(response).encode())
-            # Add debug output
-            print("Health check request handled successfully")
-        else:
-            super().do_GET()
-
-    def end_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        return super().end_headers()
-
-    def log_message(self, format, *args):
-        # Override to add more detailed logging
-        print(f"HTTP Server: {format%args}")
-
-class HTTPServerThread(threading.Thread):
-    def __init__(self, port=8000):
-        super().__init__(daemon=True)
-        self.port = port
-        self.server = None
-        self.is_running = threading.Event()
-
-    def run(self):
-        try:
-            server_address = ('', self.port)
-            self.server = HTTPServer(server_address, HealthCheckHandler)
-            self.is_running.set()
-            print(f"HTTP server running on http://localhost:{self.port}")
-            self.server.serve_forever()
-        except Exception as e:
-            print(f"HTTP Server error: {e}")
-            self.is_running.clear()
-
-    def stop(self):
-        if self.server:
-            self.server.shutdown()
-            self.server.server_close()
-            self.is_running.clear()
+from web_server import start_http_server
 
 async def check_http_server():
     """检查HTTP服务是否就绪"""
@@ -133,8 +85,7 @@ async def websocket_handler(websocket, path):
             try:
                 async with asyncio.timeout(5.0):
                     print(f"Received WebSocket message: {message}")
-                    # Add your message handling logic here
-                    pass
+                    await download_manager.handle_message(websocket, message)
             except asyncio.TimeoutError:
                 print("Message handling timeout")
     except Exception as e:
@@ -152,9 +103,11 @@ async def start_websocket_server():
 async def main(magnet_link, save_path, huggingface_token):
     print("Starting main application...")
     
-    # Start HTTP server in a separate thread
-    http_server = HTTPServerThread()
-    http_server.start()
+    # HTTP 服务与 WebSocket 服务运行在同一个事件循环中
+    http_runner = await start_http_server(
+        download_manager.get_current_status,
+        lambda: download_manager.seq
+    )
     
     try:
         # Wait for HTTP server to start
@@ -193,7 +146,7 @@ async def main(magnet_link, save_path, huggingface_token):
     finally:
         # Cleanup
         print("Cleaning up resources...")
-        http_server.stop()
+        await http_runner.cleanup()
         if 'cloudflared_process' in locals() and cloudflared_process:
             cloudflared_process.terminate()
             try:
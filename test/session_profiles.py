@@ -0,0 +1,64 @@
+import os
+import libtorrent as lt
+
+# 按 GitHub Actions 托管 runner 估算：2-4 核、7-16 GB 内存、约 14 GB 可用磁盘
+PROFILES = {
+    # libtorrent 默认值
+    'default': {},
+    # 单个大 torrent 尽量跑满带宽和磁盘
+    'throughput': {
+        'connections_limit': 500,
+        'connection_speed': 200,  # 每秒发起的连接数
+        'torrent_connect_boost': 100,
+        'active_downloads': 8,
+        'active_seeds': 8,
+        'active_limit': 16,
+        'max_queued_disk_bytes': 128 * 1024 * 1024,  # 等待写盘的数据上限
+        'send_buffer_watermark': 3 * 1024 * 1024,
+        'send_buffer_low_watermark': 1024 * 1024,
+        'send_buffer_watermark_factor': 150,
+        'max_out_request_queue': 1500,  # 每个 peer 最多同时请求的 block 数
+        'request_queue_time': 5,  # 按 5 秒的下载量决定请求队列深度
+        'whole_pieces_threshold': 5,
+        'file_pool_size': 500,
+        'checking_mem_usage': 1024,  # 校验时使用的内存（16 KiB block 数）
+        'cache_size': 32768,  # libtorrent 1.2 的磁盘缓存（16 KiB block 数），2.x 使用系统页缓存
+        'piece_extent_affinity': True,
+        'mixed_mode_algorithm': lt.bandwidth_mixed_algo_t.prefer_tcp,
+        'peer_timeout': 60,
+        'suggest_mode': lt.suggest_mode_t.suggest_read_cache,
+    },
+}
+
+
+def cpu_scaled_settings(cpu_count=None):
+    """和 CPU 核数相关的设置：磁盘 I/O 线程和 piece 校验线程"""
+    cpu_count = cpu_count or os.cpu_count() or 2
+    # 校验线程多于核数只会互相争抢 CPU
+    return {
+        'aio_threads': min(16, cpu_count * 4),
+        'hashing_threads': cpu_count,
+    }
+
+
+def profile_settings(name='default', cpu_count=None):
+    if name not in PROFILES:
+        raise ValueError(f"Unknown session profile: {name} (available: {', '.join(PROFILES)})")
+    settings = dict(PROFILES[name])
+    if name != 'default':
+        settings.update(cpu_scaled_settings(cpu_count))
+    # 只保留当前 libtorrent 版本支持的设置
+    known = lt.default_settings()
+    return {key: value for key, value in settings.items() if key in known}
+
+
+def apply_profile(session, name=None, overrides=None):
+    """把设置档应用到 session；name 为空时读取环境变量 TORRENT_PROFILE
+
+    默认 default，保持原来的 libtorrent 设置；throughput 需要显式选择。
+    """
+    name = name or os.environ.get('TORRENT_PROFILE') or 'default'
+    settings = profile_settings(name)
+    settings.update(overrides or {})
+    session.apply_settings(settings)
+    return name
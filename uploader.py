@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+from huggingface_hub import CommitOperationAdd
+from retry import Retrier
+from io_executor import io_executor
+
+
+class UploadLimiter:
+    """多个上传方共用的令牌桶，限制上传到 Hub 的总带宽（字节/秒），rate 为 0 表示不限速"""
+
+    def __init__(self, rate=0, burst=None):
+        self.rate = rate
+        self.burst = burst or rate  # 桶容量，默认 1 秒的流量
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.bytes_total = 0
+        self.wait_seconds = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, size):
+        """上传 size 字节之前调用，超出速率时等待；单次超过桶容量时先透支再补足"""
+        self.bytes_total += size
+        if not self.rate:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= size
+            if self.tokens < 0:
+                delay = -self.tokens / self.rate
+                self.wait_seconds += delay
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "bytes_total": self.bytes_total,
+            "wait_seconds": round(self.wait_seconds, 2),
+        }
+
+
+def data_size(data):
+    """bytes、文件路径或文件对象的大小"""
+    if isinstance(data, bytes):
+        return len(data)
+    if isinstance(data, str):
+        return os.path.getsize(data)
+    size = data.seek(0, os.SEEK_END)
+    data.seek(0)
+    return size
+
+
+def files_size(files):
+    """[(path_in_repo, data)] 的总大小；文件路径和文件对象要访问磁盘，在 io_executor 中调用"""
+    return sum(data_size(data) for _, data in files)
+
+
+class HubBatchUploader:
+    """把多个文件合并到一次 create_commit 中上传
+
+    攒够 batch_size 个文件或距上次提交超过 flush_interval 秒时提交一次。
+    未提交的文件超过 max_pending 个时 add() 会等待，避免内存无限增长。
+    设置 pack(batch) -> (path_in_repo, fileobj) 时，每个批次合成一个文件提交（例如 piece pack）。
+    提交失败时由 retrier 退避重试，重试用尽后才调用 on_failed。
+    """
+
+    def __init__(self, api, repo_id, repo_type, batch_size=100, flush_interval=30,
+                 max_pending=None, on_committed=None, on_failed=None, limiter=None, pack=None,
+                 retrier=None):
+        self.api = api
+        self.repo_id = repo_id
+        self.repo_type = repo_type
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending or batch_size * 2
+        self.on_committed = on_committed  # on_committed(paths)
+        self.on_failed = on_failed  # on_failed(paths, error)
+        self.limiter = limiter  # 多个 uploader 共用的 UploadLimiter
+        self.pack = pack
+        self.retrier = retrier or Retrier()
+
+        self.batch = []  # [(path_in_repo, path_or_fileobj)]
+        self.in_flight = 0
+        self.last_flush = time.monotonic()
+        self._commit_lock = asyncio.Lock()
+        self._space = asyncio.Condition()
+        self._timer = None
+        self._flushes = set()
+
+        self.commits = 0
+        self.files_committed = 0
+        self.files_failed = 0
+
+    def start(self):
+        self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """提交剩余的文件并停止定时提交"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def add(self, path_in_repo, path_or_fileobj):
+        """加入一个待上传的文件，批次已满时在后台提交"""
+        async with self._space:
+            await self._space.wait_for(lambda: len(self.batch) + self.in_flight < self.max_pending)
+            self.batch.append((path_in_repo, path_or_fileobj))
+        if len(self.batch) >= self.batch_size:
+            self._flush_in_background()
+
+    async def flush(self):
+        """立即提交当前批次，并等待所有提交完成"""
+        self._flush_in_background()
+        while self._flushes:
+            await asyncio.gather(*list(self._flushes))
+
+    def _flush_in_background(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        self.in_flight += len(batch)
+        task = asyncio.create_task(self._commit(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush_in_background()
+
+    async def _commit(self, batch):
+        paths = [path for path, _ in batch]
+        # 同一分支上的并发 commit 会互相冲突，逐个提交
+        async with self._commit_lock:
+            self.last_flush = time.monotonic()
+            files = batch
+            try:
+                if self.pack:
+                    files = [await io_executor.run("disk", self.pack, batch)]
+                if self.limiter:
+                    await self.limiter.acquire(await io_executor.run("disk", files_size, files))
+                await self.retrier.run(
+                    self.api.create_commit,
+                    description=f"Committing {len(batch)} files",
+                    repo_id=self.repo_id,
+                    repo_type=self.repo_type,
+                    operations=[
+                        CommitOperationAdd(path_in_repo=path, path_or_fileobj=data)
+                        for path, data in files
+                    ],
+                    commit_message=f"Upload {len(batch)} files",
+                )
+                self.commits += 1
+                self.files_committed += len(batch)
+                if self.on_committed:
+                    await self.on_committed(paths)
+            except Exception as e:
+                self.files_failed += len(batch)
+                if self.on_failed:
+                    await self.on_failed(paths, e)
+                else:
+                    print(f"Error committing {len(batch)} files: {e}")
+            finally:
+                if files is not batch:
+                    files[0][1].close()
+                async with self._space:
+                    self.in_flight -= len(batch)
+                    self._space.notify_all()
+
+    def stats(self):
+        return {
+            "commits": self.commits,
+            "files_committed": self.files_committed,
+            "files_failed": self.files_failed,
+            "pending": len(self.batch) + self.in_flight,
+        }
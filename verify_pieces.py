@@ -0,0 +1,186 @@
+import os
+import mmap
+import hashlib
+import zipfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import libtorrent as lt
+from combine_pieces import FileLayout, scan_pieces
+
+ZERO_BLOCK = bytes(1024 * 1024)
+
+# 工作进程中的全局状态，由 init_worker 设置
+_layout = None
+_root = None
+_sources = None
+_maps = {}  # {路径: mmap}
+_archives = {}  # {路径: ZipFile}
+
+
+def piece_hashes(torrent_info):
+    """返回每个 piece 的 SHA-1（v1）哈希"""
+    if not torrent_info.info_hashes().has_v1():
+        raise ValueError("Torrent has no v1 piece hashes")
+    return [bytes(torrent_info.hash_for_piece(i)) for i in range(torrent_info.num_pieces())]
+
+
+def init_worker(layout, root, sources):
+    global _layout, _root, _sources
+    _layout = layout
+    _root = root
+    _sources = sources
+    _maps.clear()
+    _archives.clear()
+
+
+def open_map(path):
+    """整个文件只映射一次，之后按区间切片，读大块数据时不需要复制"""
+    mm = _maps.get(path)
+    if mm is None:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        _maps[path] = mm
+    return mm
+
+
+def hash_from_files(piece_index, piece_size):
+    """从保存目录中的原始文件计算 piece 哈希，文件缺失或长度不够时返回 None"""
+    sha1 = hashlib.sha1()
+    position = 0
+    for file_index, file_offset, piece_offset, length in _layout.segments(piece_index, piece_size):
+        # segments 不包含填充文件，中间空出的部分按 0 计算
+        update_zeros(sha1, piece_offset - position)
+        full_path = os.path.join(_root, _layout.files[file_index][0])
+        try:
+            if os.path.getsize(full_path) < file_offset + length:
+                return None
+            sha1.update(open_map(full_path)[file_offset:file_offset + length])
+        except OSError:
+            return None
+        position = piece_offset + length
+    update_zeros(sha1, piece_size - position)
+    return sha1.digest()
+
+
+def update_zeros(sha1, length):
+    while length > 0:
+        block = min(length, len(ZERO_BLOCK))
+        sha1.update(ZERO_BLOCK[:block])
+        length -= block
+
+
+def hash_from_source(piece_index):
+    """从 piece 文件或压缩包计算 piece 哈希"""
+    source = _sources.get(piece_index)
+    if source is None:
+        return None
+    if source.member is not None and source.compressed:
+        zf = _archives.get(source.path)
+        if zf is None:
+            zf = _archives[source.path] = zipfile.ZipFile(source.path)
+        return hashlib.sha1(zf.read(source.member)).digest()
+    if source.size == 0:
+        return hashlib.sha1(b'').digest()
+    mm = open_map(source.path)
+    return hashlib.sha1(mm[source.data_offset:source.data_offset + source.size]).digest()
+
+
+def check_range(first, sizes, expected):
+    """校验连续的一段 piece，返回 (不匹配的 piece, 缺失的 piece)"""
+    bad, missing = [], []
+    for offset, (size, digest) in enumerate(zip(sizes, expected)):
+        piece_index = first + offset
+        if _sources is not None:
+            actual = hash_from_source(piece_index)
+        else:
+            actual = hash_from_files(piece_index, size)
+        if actual is None:
+            missing.append(piece_index)
+        elif actual != digest:
+            bad.append(piece_index)
+    return bad, missing
+
+
+def verify(torrent, save_path=None, pieces_folder=None, workers=None, pieces=None):
+    """按 torrent 的 piece 哈希校验数据
+
+    save_path 为 libtorrent 的保存目录（按原始文件树读取），pieces_folder 为 piece_N.dat、
+    piece 压缩包或 pack 所在的目录，两者二选一。pieces 可以限定只校验部分 piece。
+    返回 {"checked", "bad", "missing"}，bad 和 missing 中的 piece 需要重新获取。
+    """
+    torrent_info = torrent if isinstance(torrent, lt.torrent_info) else lt.torrent_info(torrent)
+    layout = FileLayout.from_torrent(torrent_info)
+    hashes = piece_hashes(torrent_info)
+    sizes = [torrent_info.piece_size(i) for i in range(len(hashes))]
+    indices = sorted(pieces) if pieces is not None else list(range(len(hashes)))
+
+    sources = scan_pieces(pieces_folder) if pieces_folder else None
+    workers = workers or os.cpu_count() or 1
+
+    # 连续的 piece 分给同一个进程，顺序读取同一段文件
+    runs = []
+    for i in indices:
+        if runs and runs[-1][-1] == i - 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    chunk = max(1, len(indices) // (workers * 4))
+    tasks = []
+    for run in runs:
+        for pos in range(0, len(run), chunk):
+            part = run[pos:pos + chunk]
+            tasks.append((part[0], [sizes[i] for i in part], [hashes[i] for i in part]))
+
+    bad, missing = [], []
+    if not tasks:
+        return {"checked": 0, "bad": bad, "missing": missing}
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(layout, save_path, sources)) as pool:
+        for task_bad, task_missing in pool.map(check_range, *zip(*tasks)):
+            bad.extend(task_bad)
+            missing.extend(task_missing)
+    return {"checked": len(indices), "bad": bad, "missing": missing}
+
+
+def files_for_pieces(torrent_info, piece_indices):
+    """受影响的文件 {文件路径: [piece 索引]}"""
+    layout = FileLayout.from_torrent(torrent_info)
+    result = {}
+    for piece_index in piece_indices:
+        size = torrent_info.piece_size(piece_index)
+        for file_index, _, _, _ in layout.segments(piece_index, size):
+            result.setdefault(layout.files[file_index][0], []).append(piece_index)
+    return result
+
+
+def download_pieces(repo_id, local_dir, pattern="pieces/*", repo_type="dataset", token=None):
+    """从 Hub 数据集取回 piece 文件，返回本地目录"""
+    from huggingface_hub import snapshot_download
+    snapshot_download(repo_id=repo_id, repo_type=repo_type, local_dir=local_dir,
+                      allow_patterns=[pattern], token=token)
+    return os.path.join(local_dir, os.path.dirname(pattern))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify downloaded data against the torrent's piece hashes.")
+    parser.add_argument("torrent", help=".torrent file")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--save-path", help="libtorrent save path containing the original file tree.")
+    group.add_argument("--pieces", help="Folder containing piece_N.dat files, piece archives (.zip) and/or piece packs (.pack).")
+    group.add_argument("--repo", help="Hub dataset to pull pieces from before verifying.")
+    parser.add_argument("--pattern", default="pieces/*", help="Pieces path pattern in the Hub repo.")
+    parser.add_argument("--local-dir", default="hub_pieces", help="Where to store pieces pulled from the Hub.")
+    parser.add_argument("--workers", type=int, help="Number of hashing processes.")
+    args = parser.parse_args()
+
+    pieces_folder = args.pieces
+    if args.repo:
+        pieces_folder = download_pieces(args.repo, args.local_dir, args.pattern)
+
+    torrent_info = lt.torrent_info(args.torrent)
+    result = verify(torrent_info, args.save_path, pieces_folder, args.workers)
+    print(f"Checked {result['checked']} pieces: {len(result['bad'])} bad, {len(result['missing'])} missing")
+    for path, indices in files_for_pieces(torrent_info, result['bad'] + result['missing']).items():
+        print(f"{path}: pieces {sorted(indices)}")
@@ -0,0 +1,122 @@
+import gzip
+import json
+import mimetypes
+import os
+from datetime import datetime, UTC
+from aiohttp import web
+
+from io_executor import io_executor
+
+# 这些类型压缩后明显变小，其余文件（视频、压缩包等）直接用 sendfile 发送
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 1024
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    return response
+
+
+class StaticFiles:
+    """静态文件：文本文件缓存 gzip 结果并支持 ETag，其余文件交给 FileResponse 用 sendfile 发送"""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.gzip_cache = {}  # {path: (etag, 压缩后的内容)}
+
+    def resolve(self, rel_path):
+        """返回 (路径, os.stat 结果)，找不到时返回 None；会访问磁盘，在 io_executor 中调用"""
+        path = os.path.realpath(os.path.join(self.root, rel_path))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return None
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        return (path, os.stat(path)) if os.path.isfile(path) else None
+
+    async def handle(self, request):
+        found = await io_executor.run("disk", self.resolve, request.match_info.get('path', ''))
+        if found is None:
+            raise web.HTTPNotFound()
+        path, st = found
+
+        content_type, _ = mimetypes.guess_type(path)
+        if (
+            content_type and content_type.startswith(COMPRESSIBLE_TYPES)
+            and st.st_size >= MIN_COMPRESS_SIZE
+            and 'gzip' in request.headers.get('Accept-Encoding', '')
+        ):
+            return await self.gzip_response(request, path, st, content_type)
+        return web.FileResponse(path)
+
+    @staticmethod
+    def read_gzip(path):
+        with open(path, 'rb') as f:
+            return gzip.compress(f.read(), compresslevel=6)
+
+    async def gzip_response(self, request, path, st, content_type):
+        etag = f"{st.st_mtime_ns:x}-{st.st_size:x}-gz"
+        cached = self.gzip_cache.get(path)
+        if cached is None or cached[0] != etag:
+            cached = (etag, await io_executor.run("disk", self.read_gzip, path))
+            self.gzip_cache[path] = cached
+
+        headers = {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+        if request.headers.get('If-None-Match') == f'"{etag}"':
+            return web.Response(status=304, headers=headers)
+        headers['Content-Encoding'] = 'gzip'
+        return web.Response(body=cached[1], content_type=content_type, headers=headers)
+
+
+class StatusEndpoint:
+    """/status：返回下载状态的 JSON，状态版本不变时复用已序列化的结果"""
+
+    def __init__(self, get_status, get_version=None):
+        self.get_status = get_status
+        self.get_version = get_version
+        self.cached_version = None
+        self.cached_body = None
+
+    async def handle(self, request):
+        version = self.get_version() if self.get_version else None
+        if version is None or version != self.cached_version or self.cached_body is None:
+            self.cached_body = json.dumps(self.get_status(), separators=(',', ':')).encode()
+            self.cached_version = version
+        headers = {'Cache-Control': 'no-cache'}
+        if version is not None:
+            etag = f'"status-{version}"'
+            headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                return web.Response(status=304, headers=headers)
+        return web.Response(body=self.cached_body, content_type='application/json', headers=headers)
+
+
+async def healthz(request):
+    return web.json_response({'status': 'ok', 'timestamp': datetime.now(UTC).isoformat()})
+
+
+def create_app(get_status, get_version=None, root='.', routes=None):
+    """routes 是额外的 aiohttp 路由（如 JobManager.routes()），注册在静态文件之前"""
+    app = web.Application(middlewares=[cors_middleware])
+    static_files = StaticFiles(root)
+    app.router.add_get('/healthz', healthz)
+    app.router.add_get('/status', StatusEndpoint(get_status, get_version).handle)
+    app.router.add_routes(routes or [])
+    app.router.add_get('/{path:.*}', static_files.handle)
+    return app
+
+
+async def start_http_server(get_status, get_version=None, port=8000, root='.', routes=None):
+    """在当前事件循环中启动 HTTP 服务，返回 AppRunner，停止时调用 runner.cleanup()"""
+    runner = web.AppRunner(create_app(get_status, get_version, root, routes), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, port=port)
+    await site.start()
+    print(f"HTTP server running on http://localhost:{port}")
+    return runner